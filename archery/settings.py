@@ -80,6 +80,17 @@ env = environ.Env(
     ),
     CURRENT_AUDITOR=(str, "sql.utils.workflow_audit:AuditV2"),
     PASSWORD_MIXIN_PATH=(str, "sql.plugins.password:DummyMixin"),
+    # 实例连接池，按 实例+库 复用数据库连接，当前支持 mysql、pgsql、mssql、oracle、clickhouse
+    ENGINE_CONNECTION_POOL_ENABLED=(bool, False),
+    ENGINE_CONNECTION_POOL_CLASS=(str, "sql.utils.connection_pool:ConnectionPool"),
+    ENGINE_CONNECTION_POOL_MAX_SIZE=(int, 10),
+    ENGINE_CONNECTION_POOL_MAX_IDLE=(int, 5),
+    ENGINE_CONNECTION_POOL_IDLE_TIMEOUT=(int, 300),
+    ENGINE_CONNECTION_POOL_MAX_LIFETIME=(int, 3600),
+    ENGINE_CONNECTION_POOL_WAIT_TIMEOUT=(int, 10),
+    ENGINE_CONNECTION_POOL_PING_INTERVAL=(int, 30),
+    # ssh隧道在进程内共享，无引用后保留的时间(秒)
+    SSH_TUNNEL_IDLE_TTL=(int, 300),
 )
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -125,6 +136,19 @@ CURRENT_AUDITOR = env("CURRENT_AUDITOR")
 
 PASSWORD_MIXIN_PATH = env("PASSWORD_MIXIN_PATH")
 
+ENGINE_CONNECTION_POOL = {
+    "enabled": env("ENGINE_CONNECTION_POOL_ENABLED"),
+    "class": env("ENGINE_CONNECTION_POOL_CLASS"),
+    "max_size": env("ENGINE_CONNECTION_POOL_MAX_SIZE"),
+    "max_idle": env("ENGINE_CONNECTION_POOL_MAX_IDLE"),
+    "idle_timeout": env("ENGINE_CONNECTION_POOL_IDLE_TIMEOUT"),
+    "max_lifetime": env("ENGINE_CONNECTION_POOL_MAX_LIFETIME"),
+    "wait_timeout": env("ENGINE_CONNECTION_POOL_WAIT_TIMEOUT"),
+    "ping_interval": env("ENGINE_CONNECTION_POOL_PING_INTERVAL"),
+}
+
+SSH_TUNNEL_IDLE_TTL = env("SSH_TUNNEL_IDLE_TTL")
+
 # Application definition
 INSTALLED_APPS = (
     "django.contrib.admin",
@@ -1,8 +1,13 @@
 # -*- coding: UTF-8 -*-
 import logging
+import threading
+import time
 import traceback
 
 import simplejson as json
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.http import HttpResponse
 
 from common.utils.permission import superuser_required
@@ -12,40 +17,104 @@ from django.db import transaction
 logger = logging.getLogger("default")
 
 
+# 进程内共享的系统配置缓存，redis中的版本号变化或超过CONFIG_CACHE_TTL后重新加载
+# 配置通过 Config 的 post_save/post_delete 信号失效，QuerySet.update()、bulk_create 等批量操作不会触发信号，
+# 修改配置请使用 SysConfig.set/replace，直接批量修改后需调用 notify_config_changed
+CONFIG_CACHE_TTL = 300
+CONFIG_VERSION_KEY = "sys_config:version"
+_config_cache = {"version": None, "loaded_at": 0, "config": None}
+_config_lock = threading.Lock()
+
+
+def _config_version():
+    try:
+        return cache.get(CONFIG_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"获取系统配置版本号失败:{e}")
+        return None
+
+
+def _load_config():
+    """从数据库加载全部配置，失败时返回空字典"""
+    try:
+        # 获取系统配置信息
+        all_config = Config.objects.all().values("item", "value")
+        sys_config = {}
+        for items in all_config:
+            if items["value"] in ("true", "True"):
+                items["value"] = True
+            elif items["value"] in ("false", "False"):
+                items["value"] = False
+            sys_config[items["item"]] = items["value"]
+        return sys_config
+    except Exception as m:
+        logger.error(f"获取系统配置信息失败:{m}{traceback.format_exc()}")
+        return {}
+
+
+def _cached_config():
+    """获取进程内缓存的全部配置，版本号需在查询数据库之前获取，避免把旧数据记为新版本"""
+    version = _config_version()
+    with _config_lock:
+        if (
+            _config_cache["config"] is not None
+            and _config_cache["version"] == version
+            and time.time() - _config_cache["loaded_at"] < CONFIG_CACHE_TTL
+        ):
+            return _config_cache["config"]
+    config = _load_config()
+    with _config_lock:
+        _config_cache.update(version=version, loaded_at=time.time(), config=config)
+    return config
+
+
+def clear_config_cache(notify=True):
+    """
+    清除进程内的配置缓存
+    :param notify: 是否递增redis中的版本号，通知其他进程重新加载
+    """
+    with _config_lock:
+        _config_cache.update(version=None, loaded_at=0, config=None)
+    if notify:
+        try:
+            cache.incr(CONFIG_VERSION_KEY)
+        except ValueError:
+            cache.set(CONFIG_VERSION_KEY, int(time.time()), timeout=None)
+        except Exception as e:
+            logger.warning(f"更新系统配置版本号失败:{e}")
+
+
+def notify_config_changed():
+    """
+    配置变更后立即清除本进程的缓存，事务提交后再递增版本号通知其他进程，
+    避免其他进程在提交前按新版本号加载到旧配置并一直缓存到过期
+    """
+    clear_config_cache(notify=False)
+    transaction.on_commit(clear_config_cache)
+
+
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+def config_changed(sender, **kwargs):
+    notify_config_changed()
+
+
 class SysConfig(object):
     def __init__(self):
-        self.sys_config = {}
+        self.sys_config = dict(_cached_config())
 
     def get_all_config(self):
-        try:
-            # 获取系统配置信息
-            all_config = Config.objects.all().values("item", "value")
-            sys_config = {}
-            for items in all_config:
-                if items["value"] in ("true", "True"):
-                    items["value"] = True
-                elif items["value"] in ("false", "False"):
-                    items["value"] = False
-                sys_config[items["item"]] = items["value"]
-            self.sys_config = sys_config
-        except Exception as m:
-            logger.error(f"获取系统配置信息失败:{m}{traceback.format_exc()}")
-            self.sys_config = {}
+        self.sys_config = _load_config()
 
     def get(self, key, default_value=None):
         value = self.sys_config.get(key)
-        if value:
-            return value
-        # 尝试去数据库里取
-        config_entry = Config.objects.filter(item=key).last()
-        if config_entry:
+        if isinstance(value, str):
+            # 是字符串的话, 如果是空, 或者全是空格, 返回默认值
+            if value.strip() == "":
+                return default_value
             # 清洗成 python 的 bool
-            value = self.filter_bool(config_entry.value)
-        # 是字符串的话, 如果是空, 或者全是空格, 返回默认值
-        if isinstance(value, str) and value.strip() == "":
-            return default_value
+            value = self.filter_bool(value)
         if value is not None:
-            self.sys_config[key] = value
             return value
         return default_value
 
@@ -88,6 +157,8 @@ class SysConfig(object):
             result["status"] = 1
             result["msg"] = str(e)
         finally:
+            # bulk_create不会触发post_save，手动通知
+            notify_config_changed()
             self.get_all_config()
         return result
 
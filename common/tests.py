@@ -5,9 +5,10 @@ from unittest.mock import patch, ANY
 import datetime
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import Client, TestCase
 
-from common.config import SysConfig
+from common.config import SysConfig, CONFIG_VERSION_KEY
 from common.utils.sendmsg import MsgSender
 from sql.engines import EngineBase, ResultSet
 from sql.models import (
@@ -76,6 +77,31 @@ class ConfigOpsTests(TestCase):
         archer_config.set("other_config", "testvalue3")
         self.assertEqual(archer_config.sys_config["other_config"], "testvalue3")
 
+    def test_config_cache(self):
+        archer_config = SysConfig()
+        archer_config.set("cache_config", "value1")
+        SysConfig()
+        with self.assertNumQueries(0):
+            self.assertEqual(SysConfig().get("cache_config"), "value1")
+            self.assertIsNone(SysConfig().get("not_exists_config"))
+        archer_config.set("cache_config", "value2")
+        self.assertEqual(SysConfig().get("cache_config"), "value2")
+        # 超过缓存时间后重新加载
+        with patch("common.config.CONFIG_CACHE_TTL", 0):
+            with self.assertNumQueries(2):
+                SysConfig()
+                SysConfig()
+
+    def test_config_version_on_commit(self):
+        """配置修改后立即清除本进程缓存，事务提交后才递增版本号"""
+        SysConfig().set("cache_config", "value1")
+        version = cache.get(CONFIG_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            SysConfig().set("cache_config", "value2")
+            self.assertEqual(SysConfig().get("cache_config"), "value2")
+            self.assertEqual(cache.get(CONFIG_VERSION_KEY), version)
+        self.assertNotEqual(cache.get(CONFIG_VERSION_KEY), version)
+
 
 class SendMessageTest(TestCase):
     """发送消息测试"""
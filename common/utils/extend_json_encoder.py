@@ -16,6 +16,9 @@ from bson.regex import Regex
 
 @singledispatch
 def convert(o):
+    # numpy 数组、标量以及列式结果集的行数据(ColumnarRows)，整体转换为python对象
+    if hasattr(o, "tolist"):
+        return o.tolist()
     raise TypeError("can not convert type")
 
 
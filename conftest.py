@@ -15,10 +15,17 @@ from sql.models import (
     InstanceTag,
     WorkflowAudit,
 )
-from common.config import SysConfig
+from common.config import SysConfig, clear_config_cache
 from sql.utils.workflow_audit import AuditV2, AuditSetting
 
 
+@pytest.fixture(autouse=True)
+def reset_sys_config_cache():
+    """测试用例的数据库操作会回滚，每个用例开始前清除进程内的配置缓存"""
+    clear_config_cache(notify=False)
+    yield
+
+
 @pytest.fixture
 def normal_user(django_user_model):
     user = django_user_model.objects.create(
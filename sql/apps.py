@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class SqlConfig(AppConfig):
+    name = "sql"
+
+    def ready(self):
+        # 注册模型信号处理
+        from sql import signals  # noqa: F401
@@ -1,20 +1,58 @@
 # -*- coding: UTF-8 -*-
 import datetime
-import os
+import hashlib
+import io
+import logging
+import posixpath
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import quote
 
 import MySQLdb
 import simplejson as json
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.template import loader
-from django.conf import settings
+from django_q.tasks import async_task
 from sql.engines import get_engine
 from django.contrib.auth.decorators import permission_required
-from django.http import HttpResponse, JsonResponse, FileResponse
+from django.http import (
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    FileResponse,
+)
 
 from common.utils.extend_json_encoder import ExtendJSONEncoder
+from sql.offlinedownload import StorageFileResponse
+from sql.storage import DynamicStorage
 from sql.utils.resource_group import user_instances
 from .models import Instance
 
+logger = logging.getLogger("default")
+
+# 导出整个实例的数据字典时并发导出的库数量
+DICTIONARY_EXPORT_WORKERS = 4
+# 数据字典文件在存储中的目录
+DICTIONARY_STORAGE_DIR = "dictionary"
+# 导出任务进度的保留时间（秒）
+DICTIONARY_EXPORT_PROGRESS_TTL = 24 * 3600
+# 同一实例同时只允许一个导出任务，任务异常退出时锁自动过期（秒）
+DICTIONARY_EXPORT_LOCK_TTL = 3600
+# 随数据变化的表信息，不参与结构变更的判断
+VOLATILE_TABLE_KEYS = {
+    "TABLE_ROWS",
+    "AVG_ROW_LENGTH",
+    "DATA_LENGTH",
+    "MAX_DATA_LENGTH",
+    "INDEX_LENGTH",
+    "DATA_FREE",
+    "AUTO_INCREMENT",
+    "UPDATE_TIME",
+    "CHECK_TIME",
+    "CHECKSUM",
+}
+
 
 @permission_required("sql.menu_data_dictionary", raise_exception=True)
 def table_list(request):
@@ -90,21 +128,68 @@ def table_info(request):
     )
 
 
-def get_export_full_path(base_dir: str, instance_name: str, db_name: str) -> str:
-    """validate if the instance_name and db_name provided is secure"""
-    fullpath = os.path.normpath(
-        os.path.join(base_dir, f"{instance_name}_{db_name}.html")
+def get_export_file_name(instance_name: str, db_name: str) -> str:
+    """生成数据字典在存储中的文件名，并校验instance_name和db_name是否安全"""
+    file_name = posixpath.normpath(
+        posixpath.join(DICTIONARY_STORAGE_DIR, f"{instance_name}_{db_name}.html")
     )
-    if not fullpath.startswith(base_dir):
+    if posixpath.dirname(file_name) != DICTIONARY_STORAGE_DIR or "\\" in file_name:
         return ""
-    return fullpath
+    return file_name
+
+
+def render_dictionary(db_name, tables):
+    """渲染单个库的数据字典"""
+    context = {
+        "db_name": db_name,
+        "tables": tables,
+        "export_time": datetime.datetime.now(),
+    }
+    return loader.render_to_string(
+        template_name="dictionaryexport.html", context=context
+    )
+
+
+def dictionary_checksum(tables):
+    """计算库结构的校验和，忽略表行数、数据长度、更新时间等随数据变化的信息"""
+    structure = [
+        {
+            "TABLE_INFO": {
+                k: v
+                for k, v in tb["TABLE_INFO"].items()
+                if k not in VOLATILE_TABLE_KEYS
+            },
+            "COLUMNS": list(tb["COLUMNS"]),
+        }
+        for tb in tables
+    ]
+    content = json.dumps(structure, sort_keys=True, default=str)
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+
+def _progress_key(job_id):
+    return f"data_dictionary:export:{job_id}"
+
+
+def _lock_key(instance_id):
+    return f"data_dictionary:export:lock:{instance_id}"
+
+
+def _checksum_key(instance_id, db_name):
+    return f"data_dictionary:checksum:{instance_id}:{db_name}"
+
+
+def get_export_progress(job_id):
+    """获取导出任务进度"""
+    return cache.get(_progress_key(job_id))
 
 
 @permission_required("sql.data_dictionary_export", raise_exception=True)
 def export(request):
-    """导出数据字典"""
+    """导出数据字典，单个库直接下载，整个实例提交后台任务导出到存储"""
     instance_name = request.GET.get("instance_name", "")
     db_name = request.GET.get("db_name", "")
+    incremental = request.GET.get("incremental", "") in ("1", "true")
 
     try:
         instance = user_instances(
@@ -116,51 +201,216 @@ def export(request):
 
     # 普通用户仅可以获取指定数据库的字典信息
     if db_name:
-        dbs = [query_engine.escape_string(db_name)]
-    # 管理员可以导出整个实例的字典信息
-    elif request.user.is_superuser:
-        dbs = query_engine.get_all_databases().rows
-    else:
-        return JsonResponse(
-            {"status": 1, "msg": "仅管理员可以导出整个实例的字典信息！", "data": []}
-        )
-
-    # 获取数据，存入目录
-    path = os.path.join(settings.BASE_DIR, "downloads", "dictionary")
-    os.makedirs(path, exist_ok=True)
-    for db in dbs:
-        table_metas = query_engine.get_tables_metas_data(db_name=db)
-        context = {
-            "db_name": db_name,
-            "tables": table_metas,
-            "export_time": datetime.datetime.now(),
-        }
-        data = loader.render_to_string(
-            template_name="dictionaryexport.html", context=context, request=request
-        )
-        fullpath = get_export_full_path(path, instance_name, db)
-        if not fullpath:
-            return JsonResponse({"status": 1, "msg": "实例名或db名不合法", "data": []})
-        with open(fullpath, "w", encoding="utf-8") as fp:
-            fp.write(data)
-    # 关闭连接
-    query_engine.close()
-    if db_name:
-        fullpath = get_export_full_path(path, instance_name, db)
-        if not fullpath:
+        db_name = query_engine.escape_string(db_name)
+        if not get_export_file_name(instance_name, db_name):
             return JsonResponse({"status": 1, "msg": "实例名或db名不合法", "data": []})
-        response = FileResponse(open(fullpath, "rb"))
+        try:
+            tables = query_engine.get_tables_metas_data(db_name=db_name)
+        finally:
+            query_engine.close()
+        data = render_dictionary(db_name, tables)
+        response = FileResponse(io.BytesIO(data.encode("utf-8")))
         response["Content-Type"] = "application/octet-stream"
         response["Content-Disposition"] = (
             f'attachment;filename="{quote(instance_name)}_{quote(db_name)}.html"'
         )
         return response
+    # 管理员可以导出整个实例的字典信息
+    elif not request.user.is_superuser:
+        return JsonResponse(
+            {"status": 1, "msg": "仅管理员可以导出整个实例的字典信息！", "data": []}
+        )
 
-    else:
+    dbs = query_engine.get_all_databases().rows
+    query_engine.close()
+    if not all(get_export_file_name(instance_name, db) for db in dbs):
+        return JsonResponse({"status": 1, "msg": "实例名或db名不合法", "data": []})
+
+    job_id = uuid.uuid4().hex
+    if not cache.add(
+        _lock_key(instance.id), job_id, timeout=DICTIONARY_EXPORT_LOCK_TTL
+    ):
         return JsonResponse(
             {
-                "status": 0,
-                "msg": f"实例{instance_name}数据字典导出成功，请到downloads目录下载！",
-                "data": [],
+                "status": 1,
+                "msg": f"实例{instance_name}已有数据字典导出任务在执行，请稍后再试！",
+                "data": {"job_id": cache.get(_lock_key(instance.id))},
             }
         )
+    cache.set(
+        _progress_key(job_id),
+        {
+            "instance_name": instance_name,
+            "incremental": incremental,
+            "status": "queued",
+            "total": len(dbs),
+            "finished": 0,
+            "generated": [],
+            "skipped": [],
+            "failed": {},
+        },
+        timeout=DICTIONARY_EXPORT_PROGRESS_TTL,
+    )
+    try:
+        async_task(
+            "sql.data_dictionary.export_instance_dictionary",
+            job_id,
+            instance.id,
+            dbs,
+            incremental=incremental,
+            task_name=f"data-dictionary-export-{instance.id}",
+            timeout=DICTIONARY_EXPORT_LOCK_TTL,
+        )
+    except Exception as e:
+        cache.delete(_lock_key(instance.id))
+        logger.error(f"提交数据字典导出任务失败：{e}")
+        return JsonResponse({"status": 1, "msg": f"提交导出任务失败：{e}", "data": []})
+    return JsonResponse(
+        {
+            "status": 0,
+            "msg": f"实例{instance_name}数据字典导出任务已提交，请等待导出完成后下载！",
+            "data": {"job_id": job_id},
+        }
+    )
+
+
+def export_instance_dictionary(job_id, instance_id, dbs, incremental=False):
+    """
+    后台任务，导出实例多个库的数据字典到存储
+    :param job_id: 任务id，用于记录进度
+    :param instance_id: 实例id
+    :param dbs: 库名列表
+    :param incremental: 增量模式，仅重新生成结构发生变化的库
+    """
+    progress = get_export_progress(job_id) or {
+        "total": len(dbs),
+        "finished": 0,
+        "generated": [],
+        "skipped": [],
+        "failed": {},
+    }
+    progress["status"] = "running"
+    cache.set(_progress_key(job_id), progress, timeout=DICTIONARY_EXPORT_PROGRESS_TTL)
+    storage = None
+    try:
+        instance = Instance.objects.get(id=instance_id)
+        storage = DynamicStorage()
+        # 多个库并发获取元数据，渲染和保存在当前线程完成
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(DICTIONARY_EXPORT_WORKERS, len(dbs)))
+        ) as executor:
+            futures = {
+                executor.submit(get_tables_metas, instance, db): db for db in dbs
+            }
+            for future in as_completed(futures):
+                db = futures[future]
+                try:
+                    if export_db_dictionary(
+                        storage, instance, db, future.result(), incremental
+                    ):
+                        progress["generated"].append(db)
+                    else:
+                        progress["skipped"].append(db)
+                except Exception as e:
+                    logger.error(
+                        f"导出数据字典失败，实例：{instance_id}，库：{db}，{e}"
+                    )
+                    progress["failed"][db] = str(e)
+                progress["finished"] += 1
+                cache.set(
+                    _progress_key(job_id),
+                    progress,
+                    timeout=DICTIONARY_EXPORT_PROGRESS_TTL,
+                )
+        progress["status"] = "failed" if progress["failed"] else "finished"
+    except Exception as e:
+        logger.error(f"数据字典导出任务异常，实例：{instance_id}，{e}")
+        progress["status"] = "failed"
+        progress["error"] = str(e)
+    finally:
+        if storage:
+            storage.close()
+        cache.set(
+            _progress_key(job_id), progress, timeout=DICTIONARY_EXPORT_PROGRESS_TTL
+        )
+        if cache.get(_lock_key(instance_id)) == job_id:
+            cache.delete(_lock_key(instance_id))
+    return progress
+
+
+def export_db_dictionary(storage, instance, db_name, tables, incremental=False):
+    """
+    保存单个库的数据字典到存储
+    :return: 是否重新生成，增量模式下结构未变化并且文件存在时跳过
+    """
+    file_name = get_export_file_name(instance.instance_name, db_name)
+    checksum = dictionary_checksum(tables)
+    checksum_key = _checksum_key(instance.id, db_name)
+    exists = storage.exists(file_name)
+    if incremental and exists and cache.get(checksum_key) == checksum:
+        return False
+    data = render_dictionary(db_name, tables)
+    # 存储在文件名重复时会自动重命名，需要先删除旧文件
+    if exists:
+        storage.delete(file_name)
+    storage.save(file_name, ContentFile(data.encode("utf-8")))
+    cache.set(checksum_key, checksum, timeout=None)
+    return True
+
+
+@permission_required("sql.data_dictionary_export", raise_exception=True)
+def export_status(request):
+    """获取数据字典导出任务进度"""
+    job_id = request.GET.get("job_id", "")
+    progress = get_export_progress(job_id) if job_id else None
+    if progress is None:
+        return JsonResponse({"status": 1, "msg": "导出任务不存在或已过期", "data": {}})
+    return JsonResponse({"status": 0, "msg": "ok", "data": progress})
+
+
+@permission_required("sql.data_dictionary_export", raise_exception=True)
+def export_download(request):
+    """下载导出到存储的数据字典，本地和sftp存储返回文件流，云对象存储重定向到临时下载地址"""
+    instance_name = request.GET.get("instance_name", "")
+    db_name = request.GET.get("db_name", "")
+    try:
+        user_instances(request.user, db_type=["mysql", "mssql", "oracle"]).get(
+            instance_name=instance_name
+        )
+    except Instance.DoesNotExist:
+        return JsonResponse({"status": 1, "msg": "你所在组未关联该实例！", "data": []})
+    file_name = get_export_file_name(instance_name, db_name)
+    if not db_name or not file_name:
+        return JsonResponse({"status": 1, "msg": "实例名或db名不合法", "data": []})
+
+    storage = DynamicStorage()
+    try:
+        if not storage.exists(file_name):
+            storage.close()
+            return JsonResponse(
+                {"status": 1, "msg": "文件不存在，请先导出", "data": []}
+            )
+        if storage.storage_type in ["s3c", "azure"]:
+            storage.close()
+            return HttpResponseRedirect(storage.url(file_name))
+        response = StorageFileResponse(storage.open(file_name, "rb"), storage=storage)
+    except Exception as e:
+        storage.close()
+        logger.error(f"下载数据字典失败，文件：{file_name}，{e}")
+        return JsonResponse(
+            {"status": 1, "msg": "文件下载失败，请联系管理员", "data": []}
+        )
+    response["Content-Type"] = "application/octet-stream"
+    response["Content-Disposition"] = (
+        f'attachment;filename="{quote(instance_name)}_{quote(db_name)}.html"'
+    )
+    return response
+
+
+def get_tables_metas(instance, db_name):
+    """使用独立的engine获取单个库的表信息，可在线程中并发执行"""
+    query_engine = get_engine(instance=instance)
+    try:
+        return query_engine.get_tables_metas_data(db_name=db_name)
+    finally:
+        query_engine.close()
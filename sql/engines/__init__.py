@@ -1,12 +1,17 @@
 """engine base库, 包含一个``EngineBase`` class和一个get_engine函数"""
 
+import hashlib
 import importlib
+import logging
 import re
-from sql.engines.models import ResultSet, ReviewSet
+from sql.engines.models import ResultSet, ReviewSet, StreamingResultSet
 from sql.models import Instance
-from sql.utils.ssh_tunnel import SSHConnection
+from sql.utils.connection_pool import pool_manager
+from sql.utils.ssh_tunnel import ssh_tunnel_manager
 from django.conf import settings
 
+logger = logging.getLogger("default")
+
 
 class EngineBase:
     """enginebase 只定义了init函数和若干方法的名字, 具体实现用mysql.py pg.py等实现"""
@@ -16,9 +21,16 @@ class EngineBase:
     name = "Base"
     info = "base engine"
 
+    # 是否支持连接池，支持的引擎需实现 _connect 方法
+    pool_supported = False
+
+    # 离线导出提交时的行数统计策略 table_rows/explain/probe/count，可通过系统配置 export_count_strategy 覆盖
+    export_count_strategy = "probe"
+
     def __init__(self, instance: Instance = None):
         self.conn = None
         self.thread_id = None
+        self._conn_pool = None
         if instance:
             self.instance = instance  # type: Instance
             self.instance_name = instance.instance_name
@@ -28,21 +40,17 @@ class EngineBase:
             self.db_name = instance.db_name
             self.mode = instance.mode
 
-            # 判断如果配置了隧道则连接隧道，只测试了MySQL
+            # 判断如果配置了隧道则连接隧道，只测试了MySQL，隧道在进程内共享
             if self.instance.tunnel:
-                self.ssh = SSHConnection(
-                    self.host,
-                    self.port,
-                    instance.tunnel.host,
-                    instance.tunnel.port,
-                    instance.tunnel.user,
-                    instance.tunnel.password,
-                    instance.tunnel.pkey,
-                    instance.tunnel.pkey_password,
+                self.ssh = ssh_tunnel_manager.acquire(
+                    instance.tunnel, self.host, self.port
                 )
                 self.host, self.port = self.ssh.get_ssh()
 
     def __del__(self):
+        # 未显式关闭的连接归还到连接池，避免占用连接池名额
+        if getattr(self, "_conn_pool", None) and self.conn:
+            self.release_connection()
         if hasattr(self, "ssh"):
             del self.ssh
         if hasattr(self, "remotessh"):
@@ -51,26 +59,16 @@ class EngineBase:
     def remote_instance_conn(self, instance=None):
         user, password = instance.get_username_password()
         # 判断如果配置了隧道则连接隧道
-        if not hasattr(self, "remotessh") and instance.tunnel:
-            self.remotessh = SSHConnection(
-                instance.host,
-                instance.port,
-                instance.tunnel.host,
-                instance.tunnel.port,
-                instance.tunnel.user,
-                instance.tunnel.password,
-                instance.tunnel.pkey,
-                instance.tunnel.pkey_password,
+        if instance.tunnel:
+            self.remotessh = ssh_tunnel_manager.acquire(
+                instance.tunnel, instance.host, instance.port
             )
             self.remote_host, self.remote_port = self.remotessh.get_ssh()
-            user, password = instance.get_username_password()
-            self.remote_user = user
-            self.remote_password = password
-        elif not instance.tunnel:
+        else:
             self.remote_host = instance.host
             self.remote_port = instance.port
-            self.remote_user = user
-            self.remote_password = password
+        self.remote_user = user
+        self.remote_password = password
         return (
             self.remote_host,
             self.remote_port,
@@ -81,6 +79,76 @@ class EngineBase:
     def get_connection(self, db_name=None):
         """返回一个conn实例"""
 
+    @property
+    def pool_enabled(self):
+        """是否使用连接池"""
+        instance = getattr(self, "instance", None)
+        return (
+            self.pool_supported
+            and pool_manager.enabled
+            and instance is not None
+            and instance.pk is not None
+        )
+
+    def pool_key(self, db_name=None):
+        """连接池的key，实例连接信息(包括密码)变更或者隧道重建后会使用新的连接池"""
+        password_digest = hashlib.sha256(
+            str(self.password or "").encode("utf-8")
+        ).hexdigest()[:16]
+        return (
+            self.instance.pk,
+            self.instance.db_type,
+            self.host,
+            self.port,
+            self.user,
+            password_digest,
+            db_name or "",
+        )
+
+    def _connect(self, db_name=None):
+        """新建一个原生连接，支持连接池的引擎需实现"""
+        raise NotImplementedError
+
+    def _ping(self, conn):
+        """连接池取出空闲连接时的健康检查，返回False或者抛出异常则丢弃连接"""
+        return True
+
+    def _reset_connection(self, conn):
+        """连接归还到连接池前重置会话状态，抛出异常则丢弃连接"""
+        conn.rollback()
+
+    def checkout_connection(self, db_name=None):
+        """获取一个原生连接，启用连接池时从连接池中取出，否则新建"""
+        if not self.pool_enabled:
+            self._conn_pool = None
+            return self._connect(db_name=db_name)
+        pool = pool_manager.get_pool(self.pool_key(db_name))
+        conn = pool.acquire(lambda: self._connect(db_name=db_name), self._ping)
+        self._conn_pool = pool
+        return conn
+
+    def release_connection(self, discard=False):
+        """释放当前连接，来自连接池的连接归还到连接池，否则直接关闭
+        :param discard: 连接状态不确定(如流式读取中途退出)时直接关闭，不放回连接池
+        """
+        conn, pool = self.conn, self._conn_pool
+        self.conn, self._conn_pool = None, None
+        if conn is None:
+            return
+        if pool is None:
+            conn.close()
+            return
+        if discard:
+            pool.release(conn, discard=True)
+            return
+        try:
+            self._reset_connection(conn)
+        except Exception as e:
+            logger.debug(f"{self.name}连接重置失败，丢弃连接：{e}")
+            pool.release(conn, discard=True)
+            return
+        pool.release(conn)
+
     def test_connection(self):
         """测试实例链接是否正常"""
         return self.query(sql=self.test_query)
@@ -167,6 +235,24 @@ class EngineBase:
         """获取表结构, 返回一个 ResultSet，rows=list"""
         return ResultSet()
 
+    def get_int_primary_key(self, db_name, tb_name, **kwargs):
+        """获取单列整数主键的列名, 用于按主键范围切分数据, 不支持或不存在时返回 None"""
+        return None
+
+    def get_table_rows(self, db_name, tb_name, **kwargs):
+        """获取表统计信息中的行数, 不支持时返回 None"""
+        return None
+
+    def estimate_rows(self, db_name=None, sql=""):
+        """通过执行计划估算查询语句返回的行数, 不支持时返回 None"""
+        return None
+
+    def get_probe_sql(self, sql, limit_num):
+        """返回最多读取 limit_num 行的探测语句, 用于判断结果集行数是否超过阈值"""
+        return self.filter_sql(
+            sql=f"SELECT 1 FROM ({sql.rstrip(';')}) t", limit_num=limit_num
+        )
+
     def query_check(self, db_name=None, sql=""):
         """查询语句的检查、注释去除、切分, 返回一个字典 {'bad_query': bool, 'filtered_sql': str}"""
 
@@ -186,6 +272,25 @@ class EngineBase:
         """实际查询 返回一个ResultSet"""
         return ResultSet()
 
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        **kwargs,
+    ):
+        """流式查询 返回一个StreamingResultSet，不支持服务端游标的引擎查询全部结果后再分批返回"""
+        result_set = self.query(
+            db_name=db_name,
+            sql=sql,
+            limit_num=limit_num,
+            parameters=parameters,
+            **kwargs,
+        )
+        return StreamingResultSet.from_result_set(result_set, batch_size=batch_size)
+
     def query_masking(self, db_name=None, sql="", resultset=None):
         """传入 sql语句, db名, 结果集,
         返回一个脱敏后的结果集"""
@@ -1,8 +1,15 @@
 # -*- coding: UTF-8 -*-
-from clickhouse_driver import connect
+from clickhouse_driver.dbapi.connection import Connection
 from clickhouse_driver.util.escape import escape_chars_map
 from sql.utils.sql_utils import get_syntax_type
-from .models import ResultSet, ReviewResult, ReviewSet
+from .models import (
+    ColumnarResultSet,
+    ColumnarRows,
+    ResultSet,
+    ReviewResult,
+    ReviewSet,
+    StreamingResultSet,
+)
 from common.utils.timer import FuncTimer
 from common.config import SysConfig
 from . import EngineBase
@@ -13,8 +20,33 @@ import re
 logger = logging.getLogger("default")
 
 
+class ClickHouseConnection(Connection):
+    """
+    dbapi 连接的每个 cursor 都会新建一个 Client(即一个 TCP 连接)，
+    这里让同一连接的 cursor 复用同一个 Client，连接才能被连接池复用
+    """
+
+    _client = None
+
+    def _make_client(self):
+        if self._client is None:
+            self._client = super()._make_client()
+        return self._client
+
+    def close(self):
+        super().close()
+        if self._client is not None:
+            self._client.disconnect()
+
+    @property
+    def client(self):
+        """连接复用的原生 Client，用于按数据块流式读取结果"""
+        return self._make_client()
+
+
 class ClickHouseEngine(EngineBase):
     test_query = "SELECT 1"
+    pool_supported = True
 
     def __init__(self, instance=None):
         super(ClickHouseEngine, self).__init__(instance=instance)
@@ -23,8 +55,12 @@ class ClickHouseEngine(EngineBase):
     def get_connection(self, db_name=None):
         if self.conn:
             return self.conn
+        self.conn = self.checkout_connection(db_name=db_name)
+        return self.conn
+
+    def _connect(self, db_name=None):
         if db_name:
-            self.conn = connect(
+            return ClickHouseConnection(
                 host=self.host,
                 port=self.port,
                 user=self.user,
@@ -32,15 +68,17 @@ class ClickHouseEngine(EngineBase):
                 database=db_name,
                 connect_timeout=10,
             )
-        else:
-            self.conn = connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                connect_timeout=10,
-            )
-        return self.conn
+        return ClickHouseConnection(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            connect_timeout=10,
+        )
+
+    def _reset_connection(self, conn):
+        """clickhouse无事务，仅释放已使用的cursor，保留底层TCP连接"""
+        conn.cursors = []
 
     name = "ClickHouse"
     info = "ClickHouse engine"
@@ -124,6 +162,39 @@ class ClickHouseEngine(EngineBase):
         )
         return result
 
+    @staticmethod
+    def _execute_blocks(client, sql, parameters=None, settings=None):
+        """
+        按 Client.execute_iter 的流程发送查询，逐个返回服务端的数据块，不在客户端合并整个结果集，
+        第一个数据块为只包含列信息的表头块
+        依赖 clickhouse_driver.Client 的非公开接口(disconnect_on_error、substitute_params、packet_generator、
+        connection.send_query/send_external_tables)，requirements.txt 中固定了驱动版本，升级时需核对这些接口
+        """
+        with client.disconnect_on_error(sql, settings):
+            if parameters is not None:
+                sql = client.substitute_params(
+                    sql, parameters, client.connection.context
+                )
+            client.connection.send_query(sql, params=parameters)
+            client.connection.send_external_tables(None)
+        for packet in client.packet_generator():
+            block = getattr(packet, "block", None)
+            if block is not None:
+                yield block
+
+    @staticmethod
+    def _block_rows(block, columnar=False):
+        """数据块转换为行，按列读取(numpy)时保留为列式数据 ColumnarRows"""
+        if columnar:
+            return ColumnarRows(block.get_columns())
+        return block.get_rows()
+
+    def _columnar(self, columnar=None):
+        """流式读取时是否按列(numpy数组)读取数据块，未指定时读取系统配置"""
+        if columnar is None:
+            return bool(self.config.get("clickhouse_columnar", False))
+        return columnar
+
     def query(
         self,
         db_name=None,
@@ -131,23 +202,40 @@ class ClickHouseEngine(EngineBase):
         limit_num=0,
         close_conn=True,
         parameters=None,
+        columnar=False,
         **kwargs,
     ):
-        """返回 ResultSet"""
-        result_set = ResultSet(full_sql=sql)
+        """
+        返回 ResultSet，通过原生协议按数据块读取，达到 limit_num 后不再读取剩余数据块，
+        columnar 为 True 时按列读取，返回 rows 为 ColumnarRows 的 ColumnarResultSet
+        """
+        result_set = (
+            ColumnarResultSet(full_sql=sql) if columnar else ResultSet(full_sql=sql)
+        )
+        limit_num = int(limit_num)
         try:
             conn = self.get_connection(db_name=db_name)
-            cursor = conn.cursor()
-            cursor.execute(sql, parameters)
-            if int(limit_num) > 0:
-                rows = cursor.fetchmany(size=int(limit_num))
+            client = conn.client
+            parts, row_count = [], 0
+            for block in self._execute_blocks(
+                client, sql, parameters, settings={"use_numpy": columnar}
+            ):
+                if not result_set.column_list:
+                    result_set.column_list = [i[0] for i in block.columns_with_types]
+                    result_set.column_type = [i[1] for i in block.columns_with_types]
+                if block.num_rows:
+                    parts.append(self._block_rows(block, columnar))
+                    row_count += block.num_rows
+                if 0 < limit_num <= row_count:
+                    # 剩余数据块不再读取，断开连接丢弃，下次使用时自动重连
+                    client.disconnect()
+                    break
+            if columnar:
+                rows = ColumnarRows.concat(parts)
             else:
-                rows = cursor.fetchall()
-            fields = cursor.description
-
-            result_set.column_list = [i[0] for i in fields] if fields else []
-            result_set.rows = rows
-            result_set.affected_rows = len(rows)
+                rows = [row for part in parts for row in part]
+            result_set.rows = rows[:limit_num] if limit_num > 0 else rows
+            result_set.affected_rows = len(result_set.rows)
         except Exception as e:
             logger.warning(f"ClickHouse语句执行报错，语句：{sql}，错误信息{e}")
             result_set.error = str(e).split("Stack trace")[0]
@@ -156,6 +244,68 @@ class ClickHouseEngine(EngineBase):
                 self.close()
         return result_set
 
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        columnar=None,
+        **kwargs,
+    ):
+        """
+        通过原生协议按数据块流式读取，返回 StreamingResultSet，数据块大小(max_block_size)与批次大小一致，
+        按列读取时数据块以numpy数组保留，每个批次为 ColumnarRows，序列化时才按列转换
+        """
+        result_set = StreamingResultSet(
+            full_sql=sql, limit_num=limit_num, batch_size=batch_size
+        )
+        columnar = self._columnar(columnar)
+        try:
+            conn = self.get_connection(db_name=db_name)
+            client = conn.client
+            blocks = self._execute_blocks(
+                client,
+                sql,
+                parameters,
+                settings={"max_block_size": batch_size, "use_numpy": columnar},
+            )
+            # 读取表头块获取列信息，语句执行报错也在这里抛出
+            header = next(blocks, None)
+            if header is not None:
+                result_set.column_list = [i[0] for i in header.columns_with_types]
+                result_set.column_type = [i[1] for i in header.columns_with_types]
+            pending = ColumnarRows() if columnar else []
+            if header is not None and header.num_rows:
+                pending = self._block_rows(header, columnar)
+            state = {"pending": pending, "finished": header is None}
+
+            def fetchmany(size):
+                pending = state["pending"]
+                while len(pending) < size and not state["finished"]:
+                    block = next(blocks, None)
+                    if block is None:
+                        state["finished"] = True
+                    elif block.num_rows:
+                        pending = pending + self._block_rows(block, columnar)
+                rows, state["pending"] = pending[:size], pending[size:]
+                return rows
+
+            def on_close(completed):
+                # 未读取完的结果直接断开连接丢弃
+                if not state["finished"]:
+                    blocks.close()
+                    client.disconnect()
+                self.release_connection(discard=not completed)
+
+            result_set.set_source(fetchmany, on_close)
+        except Exception as e:
+            logger.warning(f"ClickHouse语句执行报错，语句：{sql}，错误信息{e}")
+            result_set.error = str(e).split("Stack trace")[0]
+            self.close()
+        return result_set
+
     def query_check(self, db_name=None, sql=""):
         # 查询语句的检查、注释去除、切分
         result = {"msg": "", "bad_query": False, "filtered_sql": sql, "has_star": False}
@@ -497,5 +647,4 @@ class ClickHouseEngine(EngineBase):
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            self.conn = None
+            self.release_connection()
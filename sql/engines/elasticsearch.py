@@ -8,17 +8,20 @@
 
 __author__ = "feiazifeiazi"
 
+import itertools
 import logging
 import os
 import re
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from opensearchpy import OpenSearch
 import simplejson as json
 import sqlparse
 
 from common.utils.timer import FuncTimer
 from . import EngineBase
-from .models import ResultSet, ReviewSet, ReviewResult
+from .models import ResultSet, ReviewSet, ReviewResult, StreamingResultSet
 from common.config import SysConfig
 import logging
 
@@ -98,6 +101,11 @@ class ElasticsearchEngineBase(EngineBase):
 
     name: str = "SearchBase"
     info: str = "SearchBase 引擎"
+    # 深度翻页时每页的文档数，以及 PIT、SQL 游标的保持时间
+    search_page_size = 1000
+    search_keep_alive = "1m"
+    # PIT 翻页时保证排序唯一的字段
+    pit_tiebreaker = "_shard_doc"
 
     def get_all_databases(self):
         """获取所有“数据库”名（从索引名提取）,默认提取 __ 前的部分作为数据库名"""
@@ -325,84 +333,25 @@ class ElasticsearchEngineBase(EngineBase):
                 result_set = self._security_role(sql, query_params)
             elif query_params.path.startswith("/_security/user"):
                 result_set = self._security_user(sql, query_params)
-            elif query_params.sql and self.name == "Elasticsearch":
-                query_body = {"query": query_params.sql}
-                response = self.conn.sql.query(body=query_body)
-                # 提取列名和行数据
-                columns = response.get("columns", [])
-                rows = response.get("rows", [])
-                # 获取字段名作为列名
-                column_list = [col["name"] for col in columns]
-
-                # 处理查询结果，将列表和字典转换为 JSON 字符串。列名可能是重复的。
-                formatted_rows = []
-                for row in rows:
-                    # 创建字典，将列名和对应的行值关联
-                    formatted_row = []
-                    for col_name, value in zip(column_list, row):
-                        # 如果字段是列表或字典，将其转换为 JSON 字符串
-                        if isinstance(value, (list, dict)):
-                            formatted_row.append(json.dumps(value))
-                        else:
-                            formatted_row.append(value)
-                    formatted_rows.append(formatted_row)
-                # 构建结果集
-                result_set.rows = formatted_rows
-                result_set.column_list = column_list
-            elif query_params.sql and self.name == "OpenSearch":
-                query_body = {"query": query_params.sql}
-                response = self.conn.transport.perform_request(
-                    method="POST", url="/_opendistro/_sql", body=query_body
-                )
-                # 提取列名和行数据
-                columns = response.get("schema", [])
-                rows = response.get("datarows", [])
-                # 获取字段名作为列名
-                column_list = [col["name"] for col in columns]
-
-                # 处理查询结果，将列表和字典转换为 JSON 字符串。列名可能是重复的。
-                formatted_rows = []
-                for row in rows:
-                    # 创建字典，将列名和对应的行值关联
-                    formatted_row = []
-                    for col_name, value in zip(column_list, row):
-                        # 如果字段是列表或字典，将其转换为 JSON 字符串
-                        if isinstance(value, (list, dict)):
-                            formatted_row.append(json.dumps(value))
-                        else:
-                            formatted_row.append(value)
-                    formatted_rows.append(formatted_row)
-                # 构建结果集
-                result_set.rows = formatted_rows
-                result_set.column_list = column_list
+            elif query_params.sql:
+                # 通过游标按页读取，直到 limit_num
+                result_set.rows = []
+                for column_list, rows in self._sql_pages(query_params.sql, limit_num):
+                    result_set.column_list = column_list
+                    result_set.rows.extend(rows)
             else:
-                # 执行搜索查询
-                response = self.conn.search(
-                    index=query_params.index,
-                    body=query_params.query_body,
-                    params=query_params.params,
-                )
-
-                # 提取查询结果
-                hits = response.get("hits", {}).get("hits", [])
-                # 处理查询结果，将列表和字典转换为 JSON 字符串
+                # 超过一页时通过 PIT + search_after 翻页
+                max_rows = query_params.size
+                if limit_num > 0:
+                    max_rows = min(max_rows, limit_num)
                 rows = []
                 all_search_keys = {}  # 用于收集所有字段的集合
                 all_search_keys["_id"] = None
-                for hit in hits:
-                    # 获取文档 ID 和 _source 数据
-                    doc_id = hit.get("_id")
-                    source_data = hit.get("_source", {})
-
-                    # 转换需要转换为 JSON 字符串的字段
-                    for key, value in source_data.items():
-                        all_search_keys[key] = None  # 收集所有字段名
-                        if isinstance(value, (list, dict)):  # 如果字段是列表或字典
-                            source_data[key] = json.dumps(value)  # 转换为 JSON 字符串
-
-                    # 构建结果行
-                    row = {"_id": doc_id, **source_data}
-                    rows.append(row)
+                for hits in self._search_pages(query_params, max_rows):
+                    for hit in hits:
+                        row = self._hit_to_row(hit)
+                        all_search_keys.update(dict.fromkeys(row))  # 收集所有字段名
+                        rows.append(row)
 
                 column_list = list(all_search_keys.keys())
                 # 构建结果集
@@ -417,6 +366,231 @@ class ElasticsearchEngineBase(EngineBase):
         except Exception as e:
             raise Exception(f"执行查询时出错: {str(e)}")
 
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        **kwargs,
+    ):
+        """流式查询，DSL 使用 PIT + search_after 翻页，SQL 使用游标翻页，返回 StreamingResultSet"""
+        query_params = self.parse_es_select_query_to_query_params(sql, limit_num)
+        if query_params.path.startswith(("/_cat/", "/_security/")):
+            return super().query_stream(
+                db_name=db_name,
+                sql=sql,
+                limit_num=limit_num,
+                parameters=parameters,
+                batch_size=batch_size,
+                **kwargs,
+            )
+        result_set = StreamingResultSet(
+            full_sql=sql, limit_num=limit_num, batch_size=batch_size
+        )
+        pages = None
+        try:
+            self.get_connection()
+            if query_params.sql:
+                pages = self._sql_pages(query_params.sql, limit_num)
+                column_list, first_rows = next(pages, ([], []))
+                rows = itertools.chain(
+                    first_rows, (row for _, page in pages for row in page)
+                )
+            else:
+                # 未指定size时读取全部文档
+                max_rows = query_params.query_body.get("size")
+                if limit_num > 0:
+                    max_rows = min(max_rows or limit_num, limit_num)
+                pages = self._search_pages(query_params, max_rows)
+                first_docs = [self._hit_to_row(hit) for hit in next(pages, [])]
+                # 列名在读取数据前确定，后续页中新出现的字段不会输出
+                column_list = self._stream_columns(query_params, first_docs)
+                docs = itertools.chain(
+                    first_docs,
+                    (self._hit_to_row(hit) for hits in pages for hit in hits),
+                )
+                rows = (tuple(doc.get(key) for key in column_list) for doc in docs)
+            result_set.column_list = column_list
+
+            def on_close(completed):
+                # 关闭翻页生成器，释放 PIT 或 SQL 游标
+                pages.close()
+
+            result_set.set_source(
+                lambda size: list(itertools.islice(rows, size)), on_close
+            )
+        except Exception as e:
+            logger.warning(
+                f"{self.name}语句执行报错，语句：{sql}，错误信息{traceback.format_exc()}"
+            )
+            result_set.error = str(e)
+            if pages is not None:
+                pages.close()
+        return result_set
+
+    @staticmethod
+    def _format_value(value):
+        """列表和字典转换为 JSON 字符串"""
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+        return value
+
+    def _hit_to_row(self, hit):
+        """将一条命中的文档转换为 {字段名: 值}，_id 在最前"""
+        row = {"_id": hit.get("_id")}
+        for key, value in hit.get("_source", {}).items():
+            row[key] = self._format_value(value)
+        return row
+
+    def _stream_columns(self, query_params: QueryParamsSearch, first_docs):
+        """流式查询的列名：_id、首页出现的字段，未指定_source时补充mapping中的字段"""
+        columns = {"_id": None}
+        for doc in first_docs:
+            columns.update(dict.fromkeys(doc))
+        if "_source" not in query_params.query_body:
+            try:
+                mappings = self.conn.indices.get_mapping(index=query_params.index)
+                for mapping in mappings.values():
+                    properties = mapping.get("mappings", {}).get("properties", {})
+                    columns.update(dict.fromkeys(properties))
+            except Exception as e:
+                logger.warning(f"获取索引mapping失败，仅使用首页字段作为列名：{e}")
+        return list(columns.keys())
+
+    def _search_pages(self, query_params: QueryParamsSearch, max_rows=None):
+        """
+        按页返回 DSL 查询的命中文档列表，max_rows 为 None 时读取全部文档
+        不超过一页，或者语句中自行指定了 from、search_after、pit 时，直接查询一次；
+        否则打开 point in time，按 sort + search_after 翻页，结束后关闭 PIT
+        """
+        body = dict(query_params.query_body)
+        page_size = self.search_page_size
+        if (max_rows is not None and max_rows <= page_size) or any(
+            key in body for key in ("from", "search_after", "pit")
+        ):
+            if max_rows is not None:
+                body["size"] = max_rows
+            response = self.conn.search(
+                index=query_params.index, body=body, params=query_params.params
+            )
+            yield response.get("hits", {}).get("hits", [])
+            return
+
+        pit_id = self._open_pit(query_params.index)
+        try:
+            body["pit"] = {"id": pit_id, "keep_alive": self.search_keep_alive}
+            body["sort"] = self._pit_sort(body.get("sort"))
+            remaining = max_rows
+            while True:
+                size = page_size if remaining is None else min(page_size, remaining)
+                body["size"] = size
+                response = self.conn.search(body=body, params=query_params.params)
+                # PIT id 在翻页过程中可能变化，使用最新的id
+                pit_id = response.get("pit_id") or pit_id
+                body["pit"]["id"] = pit_id
+                hits = response.get("hits", {}).get("hits", [])
+                if hits:
+                    yield hits
+                if remaining is not None:
+                    remaining -= len(hits)
+                if len(hits) < size or remaining == 0:
+                    break
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self._close_pit(pit_id)
+
+    def _pit_sort(self, sort):
+        """PIT 翻页的排序，追加唯一的排序字段，保证 search_after 不重复、不遗漏"""
+        if not sort:
+            sort = []
+        elif not isinstance(sort, list):
+            sort = [sort]
+        tiebreaker = self.pit_tiebreaker
+        for item in sort:
+            if item == tiebreaker or (isinstance(item, dict) and tiebreaker in item):
+                return sort
+        return sort + [{tiebreaker: "asc"}]
+
+    def _open_pit(self, index):
+        """打开 point in time，返回 PIT id"""
+        if self.name == "Elasticsearch":
+            response = self.conn.open_point_in_time(
+                index=index, keep_alive=self.search_keep_alive
+            )
+            return response["id"]
+        response = self.conn.create_point_in_time(
+            index=index, params={"keep_alive": self.search_keep_alive}
+        )
+        return response["pit_id"]
+
+    def _close_pit(self, pit_id):
+        """关闭 point in time，失败时只记录日志，PIT 超时后会自动释放"""
+        try:
+            if self.name == "Elasticsearch":
+                self.conn.close_point_in_time(body={"id": pit_id})
+            else:
+                self.conn.delete_point_in_time(body={"pit_id": [pit_id]})
+        except Exception as e:
+            logger.warning(f"关闭PIT失败：{e}")
+
+    def _sql_pages(self, sql, limit_num=0):
+        """
+        按页返回 SQL 查询结果 (列名, 行列表)，通过游标翻页直到读取完毕或达到 limit_num
+        提前结束时关闭游标
+        """
+        column_list, rows, cursor = self._sql_request(
+            {"query": sql, "fetch_size": self.search_page_size}
+        )
+        remaining = limit_num if limit_num > 0 else None
+        first_page = True
+        try:
+            while True:
+                if remaining is not None:
+                    rows = rows[:remaining]
+                    remaining -= len(rows)
+                if rows or first_page:
+                    # 列表和字典转换为 JSON 字符串。列名可能是重复的。
+                    first_page = False
+                    yield column_list, [
+                        [self._format_value(value) for value in row] for row in rows
+                    ]
+                if not cursor or remaining == 0:
+                    break
+                _, rows, cursor = self._sql_request({"cursor": cursor})
+        finally:
+            if cursor:
+                self._close_sql_cursor(cursor)
+
+    def _sql_request(self, body):
+        """执行 SQL 请求，返回 (列名, 行数据, 游标)，列名只在首页返回"""
+        if self.name == "Elasticsearch":
+            response = self.conn.sql.query(body=body)
+            columns = response.get("columns", [])
+            rows = response.get("rows", [])
+        else:
+            response = self.conn.transport.perform_request(
+                method="POST", url="/_opendistro/_sql", body=body
+            )
+            columns = response.get("schema", [])
+            rows = response.get("datarows", [])
+        return [col["name"] for col in columns], rows, response.get("cursor")
+
+    def _close_sql_cursor(self, cursor):
+        """关闭 SQL 游标，失败时只记录日志"""
+        try:
+            if self.name == "Elasticsearch":
+                self.conn.sql.clear_cursor(body={"cursor": cursor})
+            else:
+                self.conn.transport.perform_request(
+                    method="POST",
+                    url="/_opendistro/_sql/close",
+                    body={"cursor": cursor},
+                )
+        except Exception as e:
+            logger.warning(f"关闭SQL游标失败：{e}")
+
     def _security_role(self, sql, query_params: QueryParamsSearch):
         """角色查询方法。请子类实现。"""
 
@@ -509,10 +683,8 @@ class ElasticsearchEngineBase(EngineBase):
             if not index_pattern:
                 raise Exception("未找到索引名称。")
 
-            size = limit_num if limit_num > 0 else 100
-            # 检查 JSON 中是否已经有 size，如果没有就设置
-            if "size" not in json_body:
-                json_body["size"] = size
+            # 返回条数，JSON 中没有 size 时使用 limit_num。查询体不做修改，由翻页时设置
+            size = json_body.get("size", limit_num if limit_num > 0 else 100)
             # 构建 QueryParams 对象
             query_params = QueryParamsSearch(
                 index=index_pattern,
@@ -764,7 +936,16 @@ class ElasticsearchEngineBase(EngineBase):
         line = 0
         try:
             conn = self.get_connection(db_name=workflow.db_name)
-            for doc in docs:
+            for doc in self.__bulk_groups(docs):
+                if isinstance(doc, list):
+                    # 连续的文档写入，通过 _bulk 批量执行
+                    bulk_rows, bulk_error = self.__execute_bulk(conn, doc, line)
+                    execute_result.rows.extend(bulk_rows)
+                    line += len(doc)
+                    if bulk_error:
+                        execute_result.error = bulk_error
+                        break
+                    continue
                 line += 1
                 if re.match(r"^#", doc.sql, re.I):
                     execute_result.rows.append(
@@ -839,6 +1020,179 @@ class ElasticsearchEngineBase(EngineBase):
                 )
         return execute_result
 
+    def __bulk_action(self, doc):
+        """可以合并到 _bulk 请求的文档写入，返回 action 行，否则返回 None"""
+        if re.match(r"^#", doc.sql, re.I):
+            return None
+        if doc.method == "DELETE":
+            if doc.doc_id:
+                return {"delete": {"_index": doc.index_name, "_id": doc.doc_id}}
+            return None
+        if not isinstance(doc.doc_data_body, dict):
+            return None
+        if doc.api_endpoint == "_doc":
+            meta = {"_index": doc.index_name}
+            if doc.doc_id:
+                meta["_id"] = doc.doc_id
+            return {"index": meta}
+        if doc.api_endpoint == "_update" and doc.doc_id:
+            return {"update": {"_index": doc.index_name, "_id": doc.doc_id}}
+        return None
+
+    def __bulk_groups(self, docs):
+        """
+        将连续2条以上的文档写入合并为一组(list)，其他语句保持原样，顺序不变
+        单条的文档写入仍然调用对应的接口执行
+        """
+        groups, run = [], []
+        for doc in docs:
+            if self.__bulk_action(doc):
+                run.append(doc)
+                continue
+            groups.extend([run] if len(run) > 1 else run)
+            run = []
+            groups.append(doc)
+        groups.extend([run] if len(run) > 1 else run)
+        return groups
+
+    def __execute_bulk(self, conn, docs, line):
+        """
+        通过 _bulk 批量执行文档写入，按文档数和请求体大小切分批次
+        配置了 es_bulk_workers 时，不同索引的批次并行发送，同一个索引的批次按顺序发送
+        某个文档执行失败后所有索引都不再发送后续批次，已发送批次中的文档按实际结果返回，
+        并行时失败语句之后的文档可能已经执行，失败语句之前未发送的文档标记为其他索引失败未执行
+        :return: (每条语句的ReviewResult, 错误信息)
+        """
+        config = SysConfig()
+        batch_size = int(config.get("es_bulk_batch_size") or 500)
+        max_bytes = int(config.get("es_bulk_max_bytes") or 5 * 1024 * 1024)
+        workers = int(config.get("es_bulk_workers") or 1)
+
+        items = [(pos, doc, self.__bulk_action(doc)) for pos, doc in enumerate(docs)]
+        if workers > 1:
+            lanes = {}
+            for item in items:
+                lanes.setdefault(item[1].index_name, []).append(item)
+            lanes = list(lanes.values())
+        else:
+            lanes = [items]
+
+        results = [None] * len(docs)
+        failed = threading.Event()
+
+        def run_lane(lane):
+            for batch in self.__bulk_batches(lane, batch_size, max_bytes):
+                if failed.is_set():
+                    return
+                for pos, result in self.__send_bulk(conn, batch).items():
+                    results[pos] = result
+                    if result.errlevel == 2:
+                        failed.set()
+
+        if len(lanes) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(lanes))) as executor:
+                list(executor.map(run_lane, lanes))
+        else:
+            run_lane(lanes[0])
+
+        failed_pos = [
+            pos for pos, result in enumerate(results) if result and result.errlevel == 2
+        ]
+        error = results[failed_pos[0]].errormessage if failed_pos else None
+        for pos, doc in enumerate(docs):
+            if results[pos] is None:
+                results[pos] = ReviewResult(
+                    errlevel=0,
+                    stagestatus="Audit completed",
+                    errormessage=(
+                        "前序语句失败, 未执行"
+                        if failed_pos and pos > failed_pos[0]
+                        else "其他索引的语句执行失败, 未执行"
+                    ),
+                    sql=doc.sql,
+                    affected_rows=0,
+                    execute_time=0,
+                )
+            results[pos].id = line + pos + 1
+        return results, error
+
+    @staticmethod
+    def __bulk_batches(items, batch_size, max_bytes):
+        """按文档数和请求体大小切分批次，单个文档超过大小限制时单独发送"""
+        batch, batch_bytes = [], 0
+        for item in items:
+            _, doc, action = item
+            size = len(json.dumps(action)) + 1
+            if "delete" not in action:
+                size += len(json.dumps(doc.doc_data_body).encode("utf-8")) + 1
+            if batch and (len(batch) >= batch_size or batch_bytes + size > max_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def __send_bulk(self, conn, batch):
+        """发送一个 _bulk 请求，返回 {位置: ReviewResult}"""
+        body = []
+        for _, doc, action in batch:
+            body.append(action)
+            if "delete" not in action:
+                body.append(doc.doc_data_body)
+        error = None
+        with FuncTimer() as t:
+            try:
+                response = conn.bulk(body=body)
+            except Exception as e:
+                logger.warning(
+                    f"ES _bulk请求执行报错，错误信息：{traceback.format_exc()}"
+                )
+                error = e
+        execute_time = round(t.cost / len(batch), 3)
+        if error is not None:
+            # 整个请求失败时，批次内的语句都标记为失败
+            return {
+                pos: ReviewResult(
+                    errlevel=2,
+                    stagestatus="Execute Failed",
+                    errormessage=f"异常信息：{error}",
+                    sql=doc.sql,
+                    affected_rows=0,
+                    execute_time=execute_time,
+                )
+                for pos, doc, _ in batch
+            }
+        return {
+            pos: self.__bulk_item_result(doc, item, execute_time)
+            for (pos, doc, _), item in zip(batch, response.get("items", []))
+        }
+
+    @staticmethod
+    def __bulk_item_result(doc, item, execute_time):
+        """_bulk 返回的单个文档结果转换为 ReviewResult，文档不存在时与单条执行一致，只做警告"""
+        op_type, info = next(iter(item.items()))
+        status = info.get("status", 500)
+        errlevel, stagestatus, affected_rows = 0, "Execute Successfully", 0
+        if "error" not in info and status < 300:
+            errormessage = str(info)
+            affected_rows = info.get("_shards", {}).get("successful", None)
+        elif status == 404 and op_type == "update":
+            errlevel, errormessage = 1, f"document missing: {info}"
+        elif status == 404 and op_type == "delete":
+            errlevel, errormessage = 1, f"Document not found: {info}"
+        else:
+            errlevel, stagestatus = 2, "Execute Failed"
+            errormessage = f"异常信息：{info.get('error', info)}"
+        return ReviewResult(
+            errlevel=errlevel,
+            stagestatus=stagestatus,
+            errormessage=errormessage,
+            sql=doc.sql,
+            affected_rows=affected_rows,
+            execute_time=execute_time,
+        )
+
     def __update(self, conn, doc):
         """ES的  update方法"""
         errlevel = 0
@@ -1139,6 +1493,7 @@ class OpenSearchEngine(ElasticsearchEngineBase):
 
     name: str = "OpenSearch"
     info: str = "OpenSearch 引擎"
+    pit_tiebreaker = "_id"
 
     def get_connection(self, db_name=None):
         if self.conn:
@@ -1,9 +1,26 @@
 # -*- coding: UTF-8 -*-
 """engine 结果集定义"""
 
+import itertools
 import json
 
 
+def column_values(column):
+    """
+    将一列数据转换为python对象的列表, 支持numpy数组、pandas的时间索引和普通序列,
+    numpy数组整列调用 tolist() 转换, 避免逐个单元格转换numpy标量,
+    纳秒精度的时间列先转换为微秒精度, 保证转换结果为datetime而不是整数
+    """
+    if hasattr(column, "to_pydatetime"):
+        return list(column.to_pydatetime())
+    dtype = getattr(column, "dtype", None)
+    if dtype is not None and dtype.kind == "M" and dtype.str.endswith("[ns]"):
+        column = column.astype("datetime64[us]")
+    if hasattr(column, "tolist"):
+        return column.tolist()
+    return list(column)
+
+
 class SqlItem:
     def __init__(
         self,
@@ -144,6 +161,8 @@ class ResultSet:
         self.warning = None
         self.error = None
         self.is_critical = False
+        # 取数指标, 如网络往返次数、传输字节数、每秒行数, 用于诊断
+        self.fetch_metrics = {}
         # rows 为普通列表
         self.rows = rows or []
         self.column_list = column_list if column_list else []
@@ -168,3 +187,203 @@ class ResultSet:
 
     def to_sep_dict(self):
         return {"column_list": self.column_list, "rows": self.rows}
+
+
+class ColumnarRows:
+    """
+    列式存储的结果集数据, 每列为一个数组(numpy数组或列表), 按需组合成行,
+    支持 len、下标、切片和遍历, 可以替代行列表使用, 遍历、脱敏和序列化时按列整体转换
+    """
+
+    # 遍历时每次按列转换的行数
+    chunk_size = 1000
+
+    def __init__(self, columns=None):
+        self.columns = list(columns or [])
+
+    @classmethod
+    def concat(cls, parts):
+        """按列合并多个 ColumnarRows, numpy数组使用 numpy.concatenate 合并"""
+        parts = [part for part in parts if part.columns]
+        if len(parts) <= 1:
+            return parts[0] if parts else cls()
+        columns = []
+        for column_parts in zip(*[part.columns for part in parts]):
+            if all(hasattr(c, "dtype") for c in column_parts):
+                import numpy as np
+
+                columns.append(np.concatenate(column_parts))
+            else:
+                columns.append(
+                    list(
+                        itertools.chain.from_iterable(map(column_values, column_parts))
+                    )
+                )
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        for start in range(0, len(self), self.chunk_size):
+            chunk = [
+                column_values(c[start : start + self.chunk_size]) for c in self.columns
+            ]
+            yield from zip(*chunk)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarRows([c[index] for c in self.columns])
+        index = range(len(self))[index]
+        return tuple(column_values(c[index : index + 1])[0] for c in self.columns)
+
+    def __add__(self, other):
+        return ColumnarRows.concat([self, other])
+
+    def map_columns(self, plan):
+        """
+        按列转换数据, 返回新的 ColumnarRows
+        :param plan: [(列序号, 单个值的转换函数)]
+        """
+        columns = list(self.columns)
+        for index, func in plan:
+            columns[index] = list(map(func, column_values(columns[index])))
+        return ColumnarRows(columns)
+
+    def tolist(self):
+        """整体转换为行列表, 每列只转换一次"""
+        return [list(row) for row in zip(*map(column_values, self.columns))]
+
+
+class ColumnarResultSet(ResultSet):
+    """
+    列式查询结果集, rows 为 ColumnarRows, 每列一个数组, 不逐行保存元组,
+    适用于 ClickHouse 等按列返回数据的分析型引擎, 行数多、列数多时内存占用和序列化开销更小
+    """
+
+    def __init__(self, full_sql="", columns=None, **kwargs):
+        super().__init__(full_sql=full_sql, **kwargs)
+        if columns is not None:
+            self.rows = ColumnarRows(columns)
+
+    @property
+    def columns(self):
+        if isinstance(self.rows, ColumnarRows):
+            return self.rows.columns
+        return [list(column) for column in zip(*self.rows)]
+
+    def json(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        return [dict(zip(self.column_list, r)) for r in self.rows]
+
+    def to_sep_dict(self):
+        rows = self.rows
+        if isinstance(rows, ColumnarRows):
+            rows = rows.tolist()
+        return {"column_list": self.column_list, "rows": rows}
+
+
+class StreamingResultSet(ResultSet):
+    """
+    流式查询的结果集, 结果按批次从服务端游标读取, 不在内存中保留全部结果,
+    rows 始终为空, 通过 batches() 或者迭代获取数据, 只能遍历一次, 遍历结束后释放连接
+    """
+
+    def __init__(self, full_sql="", limit_num=0, batch_size=1000, **kwargs):
+        super().__init__(full_sql=full_sql, **kwargs)
+        self.limit_num = int(limit_num or 0)
+        self.batch_size = int(batch_size)
+        self._fetchmany = None
+        self._on_close = None
+        self._consumed = False
+
+    def set_source(self, fetchmany, on_close=None):
+        """
+        :param fetchmany: 按批次读取的函数, 入参为批次大小, 读取完毕后返回空
+        :param on_close: 遍历结束或者中途关闭时调用, 入参为是否正常结束(读取完毕或达到limit),
+                         中途异常退出时为 False, 此时连接应直接丢弃
+        """
+        self._fetchmany = fetchmany
+        self._on_close = on_close
+
+    @classmethod
+    def from_result_set(cls, result_set, batch_size=1000):
+        """将普通的 ResultSet 包装为流式结果集, 用于不支持服务端游标的引擎"""
+        stream = cls(
+            full_sql=result_set.full_sql,
+            column_list=result_set.column_list,
+            column_type=result_set.column_type,
+            batch_size=batch_size,
+        )
+        stream.error = result_set.error
+        if isinstance(result_set.rows, ColumnarRows):
+            # 列式结果按切片分批, 不逐行转换
+            columnar_rows, offset = result_set.rows, [0]
+
+            def fetchmany(size):
+                batch = columnar_rows[offset[0] : offset[0] + size]
+                offset[0] += size
+                return batch
+
+            stream.set_source(fetchmany)
+            return stream
+        rows = iter(result_set.rows or [])
+        stream.set_source(lambda size: list(itertools.islice(rows, size)))
+        return stream
+
+    def batches(self):
+        """按批次返回数据, 每批为一个行列表"""
+        if self._consumed:
+            raise RuntimeError("流式结果集只能遍历一次")
+        self._consumed = True
+        completed = False
+        try:
+            if self._fetchmany is None or self.error:
+                completed = True
+                return
+            while True:
+                size = self.batch_size
+                if self.limit_num > 0:
+                    size = min(size, self.limit_num - self.affected_rows)
+                    if size <= 0:
+                        break
+                batch = self._fetchmany(size)
+                if not batch:
+                    break
+                if not isinstance(batch, ColumnarRows):
+                    batch = [tuple(row) for row in batch]
+                self.affected_rows += len(batch)
+                yield batch
+            completed = True
+        finally:
+            self.close(completed)
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self, completed=False):
+        if self._on_close:
+            on_close, self._on_close = self._on_close, None
+            on_close(completed)
+
+    def to_result_set(self):
+        """读取全部数据, 转换为普通的 ResultSet"""
+        result_set = ResultSet(
+            full_sql=self.full_sql,
+            column_list=self.column_list,
+            column_type=self.column_type,
+        )
+        result_set.error = self.error
+        if not self.error:
+            result_set.rows = [row for row in self]
+            result_set.affected_rows = self.affected_rows
+        return result_set
+
+    def json(self):
+        return json.dumps([dict(zip(self.column_list, r)) for r in self])
+
+    def to_dict(self):
+        return [dict(zip(self.column_list, r)) for r in self]
@@ -8,9 +8,21 @@ import subprocess
 import simplejson as json
 import datetime
 import tempfile
+from dataclasses import dataclass
+from typing import Callable, Optional
 from bson.son import SON
 from bson import json_util
-from pymongo.errors import OperationFailure
+from pymongo import (
+    DeleteMany,
+    DeleteOne,
+    IndexModel,
+    InsertOne,
+    ReadPreference,
+    ReplaceOne,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, OperationFailure
 from dateutil.parser import parse
 from bson.objectid import ObjectId
 from bson.int64 import Int64
@@ -26,6 +38,193 @@ logger = logging.getLogger("default")
 # mongo客户端安装在本机的位置
 mongo = "mongo"
 
+# 查询结果中字段不存在时的显示值
+MISSING_VALUE = "(N/A)"
+# 获取集合字段时随机抽样的文档数
+FIELD_SAMPLE_SIZE = 20
+
+
+def format_datetime(value):
+    """时间转换为本地时间显示，pymongo 默认返回不带时区的UTC时间"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def format_nested(value):
+    """嵌套文档中的值，ObjectId和时间转换为可读格式，其余保持repr格式"""
+    if isinstance(value, ObjectId):
+        return f"ObjectId('{value}')"
+    if isinstance(value, datetime.datetime):
+        return format_datetime(value)
+    if isinstance(value, dict):
+        items = ", ".join(f"{k!r}: {format_nested(v)}" for k, v in value.items())
+        return "{" + items + "}"
+    if isinstance(value, list):
+        return "[" + ", ".join(format_nested(v) for v in value) + "]"
+    return repr(value)
+
+
+# 按类型预先确定的单元格格式化函数，未命中时回退到 format_cell 的类型判断
+CELL_FORMATTERS = {
+    str: lambda v: v,
+    int: str,
+    float: str,
+    bool: str,
+    Int64: str,
+    ObjectId: lambda v: f"ObjectId('{v}')",
+    datetime.datetime: format_datetime,
+    list: lambda v: "(array) %d Elements" % len(v),
+    dict: format_nested,
+    SON: format_nested,
+}
+
+
+def format_cell(value):
+    """转换单个字段值为前端显示的字符串"""
+    formatter = CELL_FORMATTERS.get(type(value))
+    if formatter:
+        return formatter(value)
+    if isinstance(value, list):
+        return CELL_FORMATTERS[list](value)
+    if isinstance(value, (dict, datetime.datetime, ObjectId)):
+        return format_nested(value)
+    return str(value)
+
+
+# 连续插入同一集合的语句合并为一次bulk_write的文档数上限
+MONGO_BULK_BATCH_SIZE = 1000
+
+# 可以通过pymongo直接执行的方法，其余语句使用mongo shell执行
+NATIVE_METHODS = (
+    "insert",
+    "insertOne",
+    "insertMany",
+    "update",
+    "updateOne",
+    "updateMany",
+    "replaceOne",
+    "remove",
+    "deleteOne",
+    "deleteMany",
+    "bulkWrite",
+    "createIndex",
+    "createIndexes",
+    "ensureIndex",
+    "dropIndex",
+    "dropIndexes",
+    "drop",
+    "renameCollection",
+    "createCollection",
+)
+NATIVE_STATEMENT_PATTERN = re.compile(
+    r"""^db\.(?:getCollection\(\s*(['"])(?P<quoted>[\w.-]+)\1\s*\)|(?P<name>[\w-]+(?:\.[\w-]+)*?))\.(?P<method>[A-Za-z]+)\("""
+)
+CREATE_COLLECTION_PATTERN = re.compile(r"^db\.createCollection\(")
+
+
+class NativeUnsupported(Exception):
+    """语句不能通过pymongo直接执行，需要使用mongo shell执行"""
+
+
+@dataclass
+class NativeStatement:
+    """
+    可以通过pymongo直接执行的语句
+    :param collection: 集合名，createCollection为None
+    :param docs: 可以合并批量插入的文档列表，其余语句为None
+    :param run: 执行函数 run(db, collection) -> (affected_rows, result)
+    """
+
+    collection: Optional[str]
+    docs: Optional[list] = None
+    run: Optional[Callable] = None
+
+
+def split_arguments(text):
+    """按顶层逗号切分函数参数"""
+    args, depth, start, quote = [], 0, 0, ""
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = ""
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch in "{[(":
+            depth += 1
+        elif ch in "}])":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append(text[start:i].strip())
+            start = i + 1
+    last = text[start:].strip()
+    if last or args:
+        args.append(last)
+    return args
+
+
+def decode_argument(arg):
+    """解析单个函数参数"""
+    if arg[:1] in ("{", "["):
+        return JsonDecoder(strict=True).decode(arg)
+    if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in ("'", '"'):
+        return arg[1:-1]
+    if arg in ("true", "false"):
+        return arg == "true"
+    if re.fullmatch(r"-?\d+", arg):
+        return int(arg)
+    raise NativeUnsupported(f"不支持的参数：{arg}")
+
+
+def native_options(args, index, allowed=None):
+    """获取第index个参数作为选项，包含不支持的选项时交给mongo shell执行，allowed为None时不限制"""
+    options = args[index] if len(args) > index else {}
+    if not isinstance(options, dict) or (
+        allowed is not None and set(options) - set(allowed)
+    ):
+        raise NativeUnsupported(f"不支持的选项：{options}")
+    return options
+
+
+def write_summary(result):
+    """写入结果转换为和mongo shell相同含义的统计信息"""
+    return {
+        "nInserted": getattr(result, "inserted_count", 0),
+        "nMatched": result.matched_count,
+        "nModified": result.modified_count,
+        "nRemoved": getattr(result, "deleted_count", 0),
+        "nUpserted": getattr(result, "upserted_count", 0)
+        or int(getattr(result, "upserted_id", None) is not None),
+    }
+
+
+def bulk_request(operation):
+    """转换bulkWrite中的单个操作"""
+    if not isinstance(operation, dict) or len(operation) != 1:
+        raise NativeUnsupported(f"不支持的bulkWrite操作：{operation}")
+    name, spec = next(iter(operation.items()))
+    if name == "insertOne":
+        native_options([spec], 0, ["document"])
+        return InsertOne(spec["document"])
+    if name in ("updateOne", "updateMany"):
+        native_options([spec], 0, ["filter", "update", "upsert", "arrayFilters"])
+        request = UpdateOne if name == "updateOne" else UpdateMany
+        return request(
+            spec["filter"],
+            spec["update"],
+            upsert=bool(spec.get("upsert", False)),
+            array_filters=spec.get("arrayFilters"),
+        )
+    if name == "replaceOne":
+        native_options([spec], 0, ["filter", "replacement", "upsert"])
+        return ReplaceOne(
+            spec["filter"], spec["replacement"], upsert=bool(spec.get("upsert", False))
+        )
+    if name in ("deleteOne", "deleteMany"):
+        native_options([spec], 0, ["filter"])
+        return (DeleteOne if name == "deleteOne" else DeleteMany)(spec["filter"])
+    raise NativeUnsupported(f"不支持的bulkWrite操作：{name}")
+
 
 # 自定义异常
 class mongo_error(Exception):
@@ -38,10 +237,19 @@ class mongo_error(Exception):
 
 
 class JsonDecoder:
-    """处理传入mongodb语句中的条件，并转换成pymongo可识别的字典格式"""
+    """
+    处理传入mongodb语句中的条件，并转换成pymongo可识别的字典格式
+    :param strict: 严格模式，用于pymongo直接执行的语句，无法和mongo shell保持一致的值抛出NativeUnsupported，
+        包括未加引号的变量名(NaN、undefined等)和未指定时区的时间字符串
+    """
 
-    def __init__(self):
-        pass
+    def __init__(self, strict=False):
+        self.strict = strict
+
+    def check_value(self, tokener):
+        """严格模式下，值不能是未加引号的标识符，mongo shell中为变量引用"""
+        if self.strict and tokener.bare:
+            raise NativeUnsupported(f"未加引号的值：{tokener.cur_token()}")
 
     def __json_object(self, tokener):
         # obj = collections.OrderedDict()
@@ -70,6 +278,8 @@ class JsonDecoder:
                 val = self.__json_array(tokener)
             elif val == "{":
                 val = self.__json_object(tokener)
+            else:
+                self.check_value(tokener)
             obj[key] = val
 
             tokener.next()
@@ -101,6 +311,7 @@ class JsonDecoder:
             elif tk_temp in (",", ":", "}"):
                 raise Exception('unexpected token "%s"' % tk_temp)
             else:
+                self.check_value(tokener)
                 val = tk_temp
             arr.append(val)
 
@@ -116,7 +327,7 @@ class JsonDecoder:
         return arr
 
     def decode(self, json_str):
-        tokener = JsonDecoder.__Tokener(json_str)
+        tokener = JsonDecoder.__Tokener(json_str, strict=self.strict)
         if not tokener.next():
             return None
         first_token = tokener.cur_token()
@@ -132,10 +343,13 @@ class JsonDecoder:
         return decode_val
 
     class __Tokener:  # Tokener 作为一个内部类
-        def __init__(self, json_str):
+        def __init__(self, json_str, strict=False):
             self.__str = json_str
             self.__i = 0
             self.__cur_token = None
+            self.strict = strict
+            # 当前token是否为未加引号的标识符
+            self.bare = False
 
         def __cur_char(self):
             if self.__i < len(self.__str):
@@ -212,8 +426,10 @@ class JsonDecoder:
 
             self.__move_i(-1)
 
-            if outstr in ("true", "false", "null"):
-                return {"true": True, "false": False, "null": None}[outstr]
+            # 严格模式下忽略常量后的空格，如 {a: true }
+            const = outstr.strip() if self.strict else outstr
+            if const in ("true", "false", "null"):
+                return {"true": True, "false": False, "null": None}[const]
             elif data_type == "ObjectId":
                 ojStr = re.findall(r"ObjectId\(.*?\)", outstr)  # 单独处理ObjectId
                 if len(ojStr) > 0:
@@ -234,7 +450,11 @@ class JsonDecoder:
                 date_regex = re.compile(r'%s\("(.*)"\)' % data_type, re.IGNORECASE)
                 date_content = date_regex.findall(outstr)
                 if len(date_content) > 0:
-                    return parse(date_content[0], yearfirst=True)
+                    value = parse(date_content[0], yearfirst=True)
+                    # mongo shell按本地时区解析未指定时区的时间，pymongo按UTC保存
+                    if self.strict and value.tzinfo is None:
+                        raise NativeUnsupported(f"时间未指定时区：{date_content[0]}")
+                    return value
             elif data_type.replace(" ", "") in ("NumberLong",):
                 nuStr = re.findall(r"NumberLong\(.*?\)", outstr)  # 单独处理NumberLong
                 if len(nuStr) > 0:
@@ -242,6 +462,7 @@ class JsonDecoder:
                     nlong = id_str[0].replace(" ", "")[2:-2]
                     return Int64(nlong)
             elif outstr:
+                self.bare = True
                 return outstr
             raise Exception('Invalid symbol "%s"' % outstr)
 
@@ -253,6 +474,7 @@ class JsonDecoder:
                 "\t",
             )  # 定义一个匿名函数
 
+            self.bare = False
             while is_white_space(self.__cur_char()):
                 self.__move_i()
 
@@ -414,6 +636,19 @@ class MongoEngine(EngineBase):
             return False
 
     def get_table_conut(self, table_name, db_name):
+        """获取集合的文档数，优先通过pymongo读取集合元数据中的文档数，失败时使用mongo shell"""
+        try:
+            conn = self.get_connection(db_name)
+            try:
+                # 查询总数据要求在slave节点执行
+                collection = conn[db_name].get_collection(
+                    table_name, read_preference=ReadPreference.SECONDARY_PREFERRED
+                )
+                return collection.estimated_document_count()
+            finally:
+                self.close()
+        except Exception as e:
+            logger.debug("get_table_conut native:" + str(e))
         try:
             count_sql = f"db.{table_name}.count()"
             status = self.get_slave()  # 查询总数据要求在slave节点执行
@@ -433,126 +668,447 @@ class MongoEngine(EngineBase):
         )
 
     def execute(self, db_name=None, sql=""):
-        """mongo命令执行语句"""
-        self.get_master()
+        """
+        mongo命令执行语句
+        常用的写入和DDL语句通过pymongo执行，连续插入同一集合的语句合并为bulk_write，其余语句使用mongo shell执行
+        """
         execute_result = ReviewSet(full_sql=sql)
         sql = sql.strip()
         # 以；切分语句，逐句执行
-        sp_sql = sql.split(";")
+        statements = [s.strip() for s in sql.split(";") if s.strip()]
+        plans = [(exec_sql, self.native_statement(exec_sql)) for exec_sql in statements]
+        master_checked = False
+        db = None
         line = 0
-        for exec_sql in sp_sql:
-            if not exec_sql == "":
-                exec_sql = exec_sql.strip()
-                try:
-                    # DeprecationWarning: time.clock has been deprecated in Python 3.3 and will be removed from Python 3.8: use time.perf_counter or time.process_time instead
-                    start = time.perf_counter()
-                    r = self.exec_cmd(exec_sql, db_name)
-                    end = time.perf_counter()
+        try:
+            for group in self.batch_statements(plans):
+                exec_sql, plan = group[0]
+                if plan is None:
+                    # 使用mongo shell执行时需要连接主节点
+                    if not master_checked:
+                        self.get_master()
+                        master_checked = True
+                    line += 1
+                    try:
+                        result, error = self.execute_by_shell(line, exec_sql, db_name)
+                        if error:
+                            execute_result.error = error
+                        execute_result.rows += [result]
+                    except Exception as e:
+                        logger.warning(
+                            f"mongo语句执行报错，语句：{exec_sql}，错误信息{traceback.format_exc()}"
+                        )
+                        execute_result.error = str(e)
+                    continue
+                if db is None:
+                    db = self.get_connection(db_name)[db_name]
+                if plan.docs is not None:
+                    outcomes = self.execute_insert_batch(db, group)
+                else:
+                    outcomes = [self.execute_native(db, exec_sql, plan)]
+                for exec_sql, affected_rows, message, execute_time, error in outcomes:
                     line += 1
-                    logger.debug("执行结果：" + r)
-                    # 如果执行中有错误
-                    rz = r.replace(" ", "").replace('"', "")
-                    tr = 1
-                    if (
-                        r.lower().find("syntaxerror") >= 0
-                        or rz.find("ok:0") >= 0
-                        or rz.find("error:invalid") >= 0
-                        or rz.find("ReferenceError") >= 0
-                        or rz.find("getErrorWithCode") >= 0
-                        or rz.find("failedtoconnect") >= 0
-                        or rz.find("Error:") >= 0
-                    ):
-                        tr = 0
-                    if (rz.find("errmsg") >= 0 or tr == 0) and (
-                        r.lower().find("already exist") < 0
-                    ):
-                        execute_result.error = r
+                    if error:
+                        execute_result.error = error
                         result = ReviewResult(
                             id=line,
                             stage="Execute failed",
                             errlevel=2,
                             stagestatus="异常终止",
-                            errormessage=f"mongo语句执行报错: {r}",
+                            errormessage=f"mongo语句执行报错: {error}",
+                            affected_rows=affected_rows,
                             sql=exec_sql,
                         )
                     else:
-                        try:
-                            r = json.loads(r)
-                        except Exception as e:
-                            logger.info(str(e))
-                        finally:
-                            methodStr = exec_sql.split(").")[-1].split("(")[0].strip()
-                            if "." in methodStr:
-                                methodStr = methodStr.split(".")[-1]
-                            if methodStr == "insert":
-                                m = re.search(r'"nInserted"\s*:\s*(\d+)', r)
-                                actual_affected_rows = int(m.group(1))
-                            elif methodStr in ("insertOne", "insertMany"):
-                                if isinstance(r, dict):
-                                    # mongosh / driver JSON formats
-                                    if "nInserted" in r:  # BulkWriteResult style
-                                        actual_affected_rows = r["nInserted"]
-                                    elif (
-                                        "insertedIds" in r
-                                    ):  # CLI acknowledged + insertedIds
-                                        actual_affected_rows = len(r["insertedIds"])
-                                    elif "insertedId" in r:  # insertOne single id
-                                        actual_affected_rows = 1
-                                    else:
-                                        actual_affected_rows = 0
-                                elif isinstance(r, str):
-                                    # mongo 4.x CLI string outputs
-                                    m = re.search(r'"nInserted"\s*:\s*(\d+)', r)
-                                    actual_affected_rows = (
-                                        int(m.group(1)) if m else r.count("ObjectId")
-                                    )
-                                    actual_affected_rows = r.count("ObjectId")
-                                else:
-                                    actual_affected_rows = 0
-                            elif methodStr == "update":
-                                m = re.search(
-                                    r'(?:"modifiedCount"|"nModified")\s*:\s*(\d+)',
-                                    r,
-                                )
-                                actual_affected_rows = int(m.group(1))
-                            elif methodStr in ("updateOne", "updateMany"):
-                                if isinstance(r, dict):
-                                    actual_affected_rows = r.get(
-                                        "modifiedCount", r.get("nModified", 0)
-                                    )
-                                elif isinstance(r, str):
-                                    m = re.search(
-                                        r'(?:"modifiedCount"|"nModified")\s*:\s*(\d+)',
-                                        r,
-                                    )
-                                    actual_affected_rows = int(m.group(1)) if m else 0
-                                else:
-                                    actual_affected_rows = 0
-                            elif methodStr in ("deleteOne", "deleteMany"):
-                                actual_affected_rows = r.get("deletedCount", 0)
-                            elif methodStr == "remove":
-                                actual_affected_rows = r.get("nRemoved", 0)
-                            else:
-                                actual_affected_rows = 0
-                        # 把结果转换为ReviewSet
                         result = ReviewResult(
                             id=line,
                             errlevel=0,
                             stagestatus="执行结束",
-                            errormessage=str(r),
-                            execute_time=round(end - start, 6),
-                            affected_rows=actual_affected_rows,
+                            errormessage=str(message),
+                            execute_time=round(execute_time, 6),
+                            affected_rows=affected_rows,
                             sql=exec_sql,
                         )
                     execute_result.rows += [result]
-                except Exception as e:
-                    logger.warning(
-                        f"mongo语句执行报错，语句：{exec_sql}，错误信息{traceback.format_exc()}"
-                    )
-                    execute_result.error = str(e)
-            # result_set.column_list = [i[0] for i in fields] if fields else []
+        finally:
+            if db is not None:
+                self.close()
         return execute_result
 
+    @staticmethod
+    def batch_statements(plans):
+        """连续插入同一集合的语句合并为一组，其余语句各自一组"""
+        groups = []
+        for exec_sql, plan in plans:
+            last = groups[-1] if groups else None
+            if (
+                plan is not None
+                and plan.docs is not None
+                and last
+                and last[0][1] is not None
+                and last[0][1].docs is not None
+                and last[0][1].collection == plan.collection
+                and sum(len(p.docs) for _, p in last) + len(plan.docs)
+                <= MONGO_BULK_BATCH_SIZE
+            ):
+                last.append((exec_sql, plan))
+            else:
+                groups.append([(exec_sql, plan)])
+        return groups
+
+    def native_statement(self, sql):
+        """
+        解析可以通过pymongo直接执行的语句
+        :return: NativeStatement，不支持时返回None，由mongo shell执行
+        """
+        # 解析器不处理转义字符，不带参数的Date()按固定时区计算，和shell结果可能不一致
+        if "\\" in sql or re.search(r"Date\(\s*\)", sql):
+            return None
+        m = CREATE_COLLECTION_PATTERN.match(sql)
+        if m:
+            collection, method = None, "createCollection"
+        else:
+            m = NATIVE_STATEMENT_PATTERN.match(sql)
+            if not m or m.group("method") not in NATIVE_METHODS:
+                return None
+            collection, method = m.group("quoted") or m.group("name"), m.group("method")
+        try:
+            index, args = self.dispose_pair(sql, m.end() - 1, "(", ")")
+            # 括号后不能再有链式调用
+            if index != len(sql) - 1:
+                return None
+            args = [decode_argument(arg) for arg in split_arguments(args[1:-1])]
+            return self.native_plan(collection, method, args)
+        except Exception as e:
+            logger.debug(f"语句使用mongo shell执行，语句：{sql}，原因：{e}")
+            return None
+
+    @staticmethod
+    def native_plan(collection, method, args):
+        """把语句的方法和参数转换为pymongo操作，不支持时抛出NativeUnsupported"""
+        if method in ("insert", "insertOne", "insertMany"):
+            docs = args[0] if args else None
+            if method == "insertOne" or (method == "insert" and isinstance(docs, dict)):
+                docs = [docs]
+            options = native_options(args, 1, ["ordered"])
+            if (
+                len(args) > 2
+                or not isinstance(docs, list)
+                or not docs
+                or not all(isinstance(doc, dict) for doc in docs)
+            ):
+                raise NativeUnsupported("插入的文档格式不正确")
+            if options.get("ordered", True) is True:
+                return NativeStatement(collection, docs=docs)
+
+            def run(db, c):
+                inserted = len(c.insert_many(docs, ordered=False).inserted_ids)
+                return inserted, {"nInserted": inserted}
+
+        elif method in ("update", "updateOne", "updateMany", "replaceOne"):
+            if len(args) < 2 or len(args) > 3 or not isinstance(args[0], dict):
+                raise NativeUnsupported("更新语句的参数不正确")
+            condition, update = args[0], args[1]
+            options = native_options(args, 2, ["upsert", "multi", "arrayFilters"])
+            upsert = bool(options.get("upsert", False))
+            is_replace = isinstance(update, dict) and not any(
+                k.startswith("$") for k in update
+            )
+            if method == "replaceOne" or (method == "update" and is_replace):
+                if not is_replace or options.get("multi") or "arrayFilters" in options:
+                    raise NativeUnsupported("替换语句的参数不正确")
+                write = lambda c: c.replace_one(condition, update, upsert=upsert)
+            else:
+                if is_replace:
+                    raise NativeUnsupported("更新语句缺少更新操作符")
+                many = method == "updateMany" or (
+                    method == "update" and bool(options.get("multi"))
+                )
+                kwargs = {"upsert": upsert}
+                if "arrayFilters" in options:
+                    kwargs["array_filters"] = options["arrayFilters"]
+                write = lambda c: (c.update_many if many else c.update_one)(
+                    condition, update, **kwargs
+                )
+
+            def run(db, c):
+                r = write(c)
+                return r.modified_count, write_summary(r)
+
+        elif method in ("remove", "deleteOne", "deleteMany"):
+            if not args or len(args) > 2 or not isinstance(args[0], dict):
+                raise NativeUnsupported("删除语句的参数不正确")
+            one = method == "deleteOne"
+            if len(args) == 2:
+                if method != "remove":
+                    raise NativeUnsupported("删除语句不支持选项")
+                just_one = args[1]
+                if isinstance(just_one, dict):
+                    just_one = native_options(args, 1, ["justOne"]).get("justOne")
+                one = bool(just_one)
+            condition = args[0]
+
+            def run(db, c):
+                r = c.delete_one(condition) if one else c.delete_many(condition)
+                return r.deleted_count, {"nRemoved": r.deleted_count}
+
+        elif method == "bulkWrite":
+            if not args or len(args) > 2 or not isinstance(args[0], list):
+                raise NativeUnsupported("bulkWrite的参数不正确")
+            requests = [bulk_request(operation) for operation in args[0]]
+            ordered = native_options(args, 1, ["ordered"]).get("ordered", True)
+
+            def run(db, c):
+                r = c.bulk_write(requests, ordered=bool(ordered))
+                summary = write_summary(r)
+                affected_rows = (
+                    summary["nInserted"]
+                    + summary["nModified"]
+                    + summary["nRemoved"]
+                    + summary["nUpserted"]
+                )
+                return affected_rows, summary
+
+        elif method in ("createIndex", "ensureIndex"):
+            if (
+                not args
+                or len(args) > 2
+                or not isinstance(args[0], dict)
+                or not args[0]
+            ):
+                raise NativeUnsupported("创建索引的参数不正确")
+            keys = list(args[0].items())
+            options = native_options(args, 1)
+
+            def run(db, c):
+                return 0, {"createdIndex": c.create_index(keys, **options)}
+
+        elif method == "createIndexes":
+            if (
+                not args
+                or len(args) > 2
+                or not isinstance(args[0], list)
+                or not all(isinstance(keys, dict) and keys for keys in args[0])
+            ):
+                raise NativeUnsupported("创建索引的参数不正确")
+            options = native_options(args, 1)
+            models = [IndexModel(list(keys.items()), **options) for keys in args[0]]
+
+            def run(db, c):
+                return 0, {"createdIndexes": c.create_indexes(models)}
+
+        elif method == "dropIndex":
+            if len(args) != 1 or not isinstance(args[0], (str, dict)):
+                raise NativeUnsupported("删除索引的参数不正确")
+            index = args[0] if isinstance(args[0], str) else list(args[0].items())
+
+            def run(db, c):
+                c.drop_index(index)
+                return 0, {"ok": 1}
+
+        elif method in ("dropIndexes", "drop"):
+            if args:
+                raise NativeUnsupported(f"{method}不支持参数")
+
+            def run(db, c):
+                c.drop_indexes() if method == "dropIndexes" else c.drop()
+                return 0, {"ok": 1}
+
+        elif method == "renameCollection":
+            if not args or len(args) > 2 or not isinstance(args[0], str):
+                raise NativeUnsupported("renameCollection的参数不正确")
+            drop_target = args[1] if len(args) > 1 else False
+            if not isinstance(drop_target, bool):
+                raise NativeUnsupported("renameCollection的参数不正确")
+
+            def run(db, c):
+                c.rename(args[0], dropTarget=drop_target)
+                return 0, {"ok": 1}
+
+        elif method == "createCollection":
+            if not args or len(args) > 2 or not isinstance(args[0], str):
+                raise NativeUnsupported("createCollection的参数不正确")
+            options = native_options(args, 1)
+
+            def run(db, c):
+                db.create_collection(args[0], **options)
+                return 0, {"ok": 1}
+
+        else:
+            raise NativeUnsupported(f"不支持的方法：{method}")
+        return NativeStatement(collection, run=run)
+
+    @staticmethod
+    def execute_native(db, exec_sql, plan):
+        """
+        通过pymongo执行单个语句
+        :return: (语句, 影响行数, 执行结果, 执行时间, 错误信息)
+        """
+        start = time.perf_counter()
+        try:
+            collection = db[plan.collection] if plan.collection else None
+            affected_rows, message = plan.run(db, collection)
+            return exec_sql, affected_rows, message, time.perf_counter() - start, None
+        except Exception as e:
+            # 和mongo shell执行保持一致，对象已存在不作为错误
+            if "already exist" in str(e).lower():
+                return exec_sql, 0, str(e), time.perf_counter() - start, None
+            logger.warning(f"mongo语句执行报错，语句：{exec_sql}，错误信息{e}")
+            return exec_sql, 0, None, time.perf_counter() - start, str(e)
+
+    @staticmethod
+    def execute_insert_batch(db, group):
+        """
+        多个插入语句合并为一次有序的bulk_write执行，按文档数把结果分配到各语句
+        某个语句插入失败时，后续语句重新提交，和逐句执行时报错后继续执行的行为一致
+        :return: [(语句, 影响行数, 执行结果, 执行时间, 错误信息)]
+        """
+        outcomes = []
+        pending = group
+        while pending:
+            docs = [doc for _, plan in pending for doc in plan.docs]
+            start = time.perf_counter()
+            error = None
+            inserted = len(docs)
+            try:
+                db[pending[0][1].collection].bulk_write(
+                    [InsertOne(doc) for doc in docs], ordered=True
+                )
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                write_errors = e.details.get("writeErrors") or [{}]
+                error = write_errors[0].get("errmsg", str(e))
+            except Exception as e:
+                # 连接等异常，剩余语句都标记为失败
+                logger.warning(f"mongo批量插入报错，错误信息{e}")
+                execute_time = (time.perf_counter() - start) / len(pending)
+                outcomes += [
+                    (exec_sql, 0, None, execute_time, str(e)) for exec_sql, _ in pending
+                ]
+                break
+            execute_time = (time.perf_counter() - start) / len(pending)
+            offset = 0
+            for i, (exec_sql, plan) in enumerate(pending):
+                count = len(plan.docs)
+                if offset + count <= inserted:
+                    outcomes.append(
+                        (exec_sql, count, {"nInserted": count}, execute_time, None)
+                    )
+                    offset += count
+                else:
+                    outcomes.append(
+                        (exec_sql, inserted - offset, None, execute_time, error)
+                    )
+                    pending = pending[i + 1 :]
+                    break
+            else:
+                pending = []
+        return outcomes
+
+    def execute_by_shell(self, line, exec_sql, db_name):
+        """
+        使用mongo shell执行单个语句
+        :return: (ReviewResult, 错误信息)
+        """
+        error = None
+        start = time.perf_counter()
+        r = self.exec_cmd(exec_sql, db_name)
+        end = time.perf_counter()
+        logger.debug("执行结果：" + r)
+        # 如果执行中有错误
+        rz = r.replace(" ", "").replace('"', "")
+        tr = 1
+        if (
+            r.lower().find("syntaxerror") >= 0
+            or rz.find("ok:0") >= 0
+            or rz.find("error:invalid") >= 0
+            or rz.find("ReferenceError") >= 0
+            or rz.find("getErrorWithCode") >= 0
+            or rz.find("failedtoconnect") >= 0
+            or rz.find("Error:") >= 0
+        ):
+            tr = 0
+        if (rz.find("errmsg") >= 0 or tr == 0) and (
+            r.lower().find("already exist") < 0
+        ):
+            error = r
+            result = ReviewResult(
+                id=line,
+                stage="Execute failed",
+                errlevel=2,
+                stagestatus="异常终止",
+                errormessage=f"mongo语句执行报错: {r}",
+                sql=exec_sql,
+            )
+        else:
+            try:
+                r = json.loads(r)
+            except Exception as e:
+                logger.info(str(e))
+            finally:
+                methodStr = exec_sql.split(").")[-1].split("(")[0].strip()
+                if "." in methodStr:
+                    methodStr = methodStr.split(".")[-1]
+                if methodStr == "insert":
+                    m = re.search(r'"nInserted"\s*:\s*(\d+)', r)
+                    actual_affected_rows = int(m.group(1))
+                elif methodStr in ("insertOne", "insertMany"):
+                    if isinstance(r, dict):
+                        # mongosh / driver JSON formats
+                        if "nInserted" in r:  # BulkWriteResult style
+                            actual_affected_rows = r["nInserted"]
+                        elif "insertedIds" in r:  # CLI acknowledged + insertedIds
+                            actual_affected_rows = len(r["insertedIds"])
+                        elif "insertedId" in r:  # insertOne single id
+                            actual_affected_rows = 1
+                        else:
+                            actual_affected_rows = 0
+                    elif isinstance(r, str):
+                        # mongo 4.x CLI string outputs
+                        m = re.search(r'"nInserted"\s*:\s*(\d+)', r)
+                        actual_affected_rows = (
+                            int(m.group(1)) if m else r.count("ObjectId")
+                        )
+                        actual_affected_rows = r.count("ObjectId")
+                    else:
+                        actual_affected_rows = 0
+                elif methodStr == "update":
+                    m = re.search(
+                        r'(?:"modifiedCount"|"nModified")\s*:\s*(\d+)',
+                        r,
+                    )
+                    actual_affected_rows = int(m.group(1))
+                elif methodStr in ("updateOne", "updateMany"):
+                    if isinstance(r, dict):
+                        actual_affected_rows = r.get(
+                            "modifiedCount", r.get("nModified", 0)
+                        )
+                    elif isinstance(r, str):
+                        m = re.search(
+                            r'(?:"modifiedCount"|"nModified")\s*:\s*(\d+)',
+                            r,
+                        )
+                        actual_affected_rows = int(m.group(1)) if m else 0
+                    else:
+                        actual_affected_rows = 0
+                elif methodStr in ("deleteOne", "deleteMany"):
+                    actual_affected_rows = r.get("deletedCount", 0)
+                elif methodStr == "remove":
+                    actual_affected_rows = r.get("nRemoved", 0)
+                else:
+                    actual_affected_rows = 0
+            # 把结果转换为ReviewSet
+            result = ReviewResult(
+                id=line,
+                errlevel=0,
+                stagestatus="执行结束",
+                errormessage=str(r),
+                execute_time=round(end - start, 6),
+                affected_rows=actual_affected_rows,
+                sql=exec_sql,
+            )
+        return result, error
+
     def execute_check(self, db_name=None, sql=""):
         """上线单执行前的检查, 返回Review set"""
         line = 1
@@ -904,7 +1460,10 @@ class MongoEngine(EngineBase):
         return result
 
     def get_all_columns_by_tb(self, db_name, tb_name, **kwargs):
-        """获取所有字段, 返回一个ResultSet"""
+        """
+        获取所有字段, 返回一个ResultSet
+        合并首尾文档和随机抽样文档的字段，会访问实例，查询时通过 schema_cache 读取缓存的结果
+        """
         # https://github.com/getredash/redash/blob/master/redash/query_runner/mongodb.py
         result = ResultSet()
         db = self.get_connection()[db_name]
@@ -919,6 +1478,12 @@ class MongoEngine(EngineBase):
 
             for d in db[collection_name].find().sort([("_id", -1)]).limit(1):
                 documents_sample.append(d)
+
+            documents_sample.extend(
+                db[collection_name].aggregate(
+                    [{"$sample": {"size": FIELD_SAMPLE_SIZE}}]
+                )
+            )
         columns = []
         # _merge_property_names
         for document in documents_sample:
@@ -1176,7 +1741,6 @@ class MongoEngine(EngineBase):
                 rows = tuple(rows)
                 result_set.rows = rows
             else:
-                cursor = json.loads(json_util.dumps(cursor))
                 cols = projection if "projection" in dir() else None
                 rows, columns = self.parse_tuple(cursor, db_name, collection_name, cols)
                 result_set.rows = rows
@@ -1200,61 +1764,56 @@ class MongoEngine(EngineBase):
         return result_set
 
     def parse_tuple(self, cursor, db_name, tb_name, projection=None):
-        """前端bootstrap-table显示，需要转化mongo查询结果为tuple((),())的格式"""
-        columns = []
-        rows = []
-        row = []
+        """
+        前端bootstrap-table显示，需要转化mongo查询结果为tuple((),())的格式
+        直接读取BSON文档，每个文档只转换一次，隐藏JSON列同时生成
+        """
         if projection:
-            for k in projection.keys():
-                columns.append(k)
+            columns = list(projection.keys())
         else:
-            result = self.get_all_columns_by_tb(db_name=db_name, tb_name=tb_name)
-            columns = result.rows
+            columns = self.cached_columns(db_name, tb_name)
         columns.insert(0, "mongodballdata")  # 隐藏JSON结果列
-        columns = self.fill_query_columns(cursor, columns)
+        known = set(columns)
 
+        docs = []
         for ro in cursor:
-            json_col = json.dumps(
-                ro, ensure_ascii=False, indent=2, separators=(",", ":")
-            )
-            row.insert(0, json_col)
-            for key in columns[1:]:
-                if key in ro:
-                    value = ro[key]
-                    if isinstance(value, list):
-                        value = "(array) %d Elements" % len(value)
-                    re_oid = re.compile(r"{\'\$oid\': \'[0-9a-f]{24}\'}")
-                    re_date = re.compile(r"{\'\$date\': [0-9]{13}}")
-                    # 转换$oid
-                    ff = re.findall(re_oid, str(value))
-                    for ii in ff:
-                        value = str(value).replace(
-                            ii, "ObjectId(" + ii.split(":")[1].strip()[:-1] + ")"
-                        )
-                    # 转换时间戳$date
-                    dd = re.findall(re_date, str(value))
-                    for d in dd:
-                        t = int(d.split(":")[1].strip()[:-1])
-                        e = datetime.datetime.fromtimestamp(t / 1000)
-                        value = str(value).replace(
-                            d, e.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-                        )
-                    row.append(str(value))
-                else:
-                    row.append("(N/A)")
-            rows.append(tuple(row))
-            row.clear()
-        return tuple(rows), columns
+            cells = {"mongodballdata": self.dumps_document(ro)}
+            for key, value in ro.items():
+                cells[key] = format_cell(value)
+                # 补充结果集中`get_all_columns_by_tb`未获取的字段
+                if key not in known:
+                    known.add(key)
+                    columns.append(key)
+            docs.append(cells)
+        rows = tuple(
+            tuple(cells.get(key, MISSING_VALUE) for key in columns) for cells in docs
+        )
+        return rows, columns
+
+    def cached_columns(self, db_name, tb_name):
+        """
+        读取缓存的集合字段用于结果列排序，不在查询中抽样
+        缓存不存在时返回空列表，由后台任务抽样后写入缓存，结果列按文档中的字段顺序补充
+        """
+        instance = getattr(self, "instance", None)
+        if not (instance and instance.id):
+            return []
+        # 在函数内导入，避免 sql.engines 加载引擎时循环导入
+        from sql.utils.schema_cache import peek_resource
+
+        try:
+            result = peek_resource(instance, "column", db_name=db_name, tb_name=tb_name)
+        except Exception as e:
+            logger.warning(f"读取集合字段缓存失败：{e}")
+            return []
+        return list(result.rows) if result else []
 
     @staticmethod
-    def fill_query_columns(cursor, columns):
-        """补充结果集中`get_all_columns_by_tb`未获取的字段"""
-        cols = columns
-        for ro in cursor:
-            for key in ro.keys():
-                if key not in cols:
-                    cols.append(key)
-        return cols
+    def dumps_document(document):
+        """文档转换为扩展JSON，作为隐藏的JSON结果列"""
+        return json_util.dumps(
+            document, ensure_ascii=False, indent=2, separators=(",", ":")
+        )
 
     def processlist(self, command_type, **kwargs):
         """
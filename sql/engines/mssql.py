@@ -19,10 +19,37 @@ class MssqlEngine(EngineBase):
     name = "MsSQL"
     info = "MsSQL engine"
 
+    pool_supported = True
+
     def get_connection(self, db_name=None):
         if self.conn:
             return self.conn
+        self.conn = self.checkout_connection(db_name=db_name)
+        # 连接池按库区分连接，归还前需要切换回该库
+        self._conn_db_name = db_name or ""
+        return self.conn
+
+    def _reset_connection(self, conn):
+        """回滚未提交事务，并切换回连接建立时的库，避免USE语句切换的库被带给连接池的下一个使用者"""
+        conn.rollback()
+        cursor = conn.cursor()
+        try:
+            db_name = getattr(self, "_conn_db_name", "")
+            if not db_name:
+                # 连接字符串未指定库时使用登录名的默认库
+                cursor.execute(
+                    "SELECT default_database_name FROM sys.server_principals "
+                    "WHERE sid = SUSER_SID()"
+                )
+                row = cursor.fetchone()
+                if not row or not row[0]:
+                    raise RuntimeError("无法获取登录名的默认数据库")
+                db_name = row[0]
+            cursor.execute(f"USE [{db_name.replace(']', ']]')}]")
+        finally:
+            cursor.close()
 
+    def _connect(self, db_name=None):
         # 尝试检测可用的 ODBC 驱动
         available_drivers = []
         try:
@@ -87,11 +114,11 @@ connect timeout=10;""".format(
             connstr = f"{connstr};DATABASE={db_name}"
 
         try:
-            self.conn = pyodbc.connect(connstr)
+            conn = pyodbc.connect(connstr)
             # 不强制设置编码，让 pyodbc 使用数据库的默认编码
             # 这样插入的中文字符会使用数据库的默认编码（如 GBK、GB2312 等）
             logger.info(f"成功使用驱动 '{selected_driver}' 连接到 SQL Server")
-            return self.conn
+            return conn
         except pyodbc.Error as e:
             error_msg = str(e)
             if "Can't open lib" in error_msg or "file not found" in error_msg:
@@ -116,6 +143,12 @@ connect timeout=10;""".format(
                 # 其他连接错误，直接抛出
                 raise
 
+    def _ping(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+
     def get_all_databases(self):
         """获取数据库列表, 返回一个ResultSet"""
         sql = "SELECT name FROM master.sys.databases order by name"
@@ -272,36 +305,38 @@ i.index_id = t.index_id and t.is_included_column = 0 order by key_ordinal for xm
         tbs = []
         for row in result.rows:
             tbs.append(dict(zip(result.column_list, row)))
+        # 一次获取库内所有表的字段，在内存中按表分组
+        sql_cols = """select TABLE_NAME, COLUMN_NAME, case when ISNUMERIC(CHARACTER_MAXIMUM_LENGTH)=1 
+then DATA_TYPE + '(' + convert(varchar(max), CHARACTER_MAXIMUM_LENGTH) + ')' else DATA_TYPE end COLUMN_TYPE,
+                COLLATION_NAME,
+                IS_NULLABLE,
+                COLUMN_DEFAULT
+            from INFORMATION_SCHEMA.columns where TABLE_CATALOG=?
+            order by TABLE_NAME, ORDINAL_POSITION;"""
+        query_result = self.query(
+            db_name=db_name,
+            sql=sql_cols,
+            close_conn=False,
+            parameters=(db_name,),
+        )
+        tb_cols = {}
+        # 转换查询结果为dict
+        for row in query_result.rows:
+            column = dict(zip(query_result.column_list, row))
+            tb_cols.setdefault(column.pop("TABLE_NAME"), []).append(column)
+        engine_keys = [
+            {"key": "COLUMN_NAME", "value": "字段名"},
+            {"key": "COLUMN_TYPE", "value": "数据类型"},
+            {"key": "COLLATION_NAME", "value": "列字符集"},
+            {"key": "IS_NULLABLE", "value": "允许非空"},
+            {"key": "COLUMN_DEFAULT", "value": "默认值"},
+        ]
         table_metas = []
         for tb in tbs:
             _meta = dict()
-            engine_keys = [
-                {"key": "COLUMN_NAME", "value": "字段名"},
-                {"key": "COLUMN_TYPE", "value": "数据类型"},
-                {"key": "COLLATION_NAME", "value": "列字符集"},
-                {"key": "IS_NULLABLE", "value": "允许非空"},
-                {"key": "COLUMN_DEFAULT", "value": "默认值"},
-            ]
             _meta["ENGINE_KEYS"] = engine_keys
             _meta["TABLE_INFO"] = tb
-            sql_cols = """select COLUMN_NAME, case when ISNUMERIC(CHARACTER_MAXIMUM_LENGTH)=1 
-then DATA_TYPE + '(' + convert(varchar(max), CHARACTER_MAXIMUM_LENGTH) + ')' else DATA_TYPE end COLUMN_TYPE,
-                COLLATION_NAME,
-                IS_NULLABLE,
-                COLUMN_DEFAULT
-            from INFORMATION_SCHEMA.columns where TABLE_CATALOG=? and TABLE_NAME = ?;"""
-            query_result = self.query(
-                db_name=db_name,
-                sql=sql_cols,
-                close_conn=False,
-                parameters=(db_name, tb["TABLE_NAME"]),
-            )
-
-            columns = []
-            # 转换查询结果为dict
-            for row in query_result.rows:
-                columns.append(dict(zip(query_result.column_list, row)))
-            _meta["COLUMNS"] = tuple(columns)
+            _meta["COLUMNS"] = tuple(tb_cols.get(tb["TABLE_NAME"], []))
             table_metas.append(_meta)
         return table_metas
 
@@ -839,5 +874,4 @@ then DATA_TYPE + '(' + convert(varchar(max), CHARACTER_MAXIMUM_LENGTH) + ')' els
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            self.conn = None
+            self.release_connection()
@@ -14,7 +14,7 @@ from schemaobject.connection import build_database_url
 from sql.engines.goinception import GoInceptionEngine
 from sql.utils.sql_utils import get_syntax_type, remove_comments
 from . import EngineBase
-from .models import ResultSet, ReviewResult, ReviewSet
+from .models import ResultSet, ReviewResult, ReviewSet, StreamingResultSet
 from sql.utils.data_masking import data_masking
 from common.config import SysConfig
 
@@ -65,6 +65,7 @@ class MysqlEngine(EngineBase):
     name = "MySQL"
     info = "MySQL engine"
     test_query = "SELECT 1"
+    pool_supported = True
     _server_version = None
     _server_fork_type = None
     _server_info = None
@@ -75,14 +76,19 @@ class MysqlEngine(EngineBase):
         self.inc_engine = GoInceptionEngine()
 
     def get_connection(self, db_name=None):
-        # https://stackoverflow.com/questions/19256155/python-mysqldb-returning-x01-for-bit-values
-        conversions = MySQLdb.converters.conversions
-        conversions[FIELD_TYPE.BIT] = lambda data: data == b"\x01"
         if self.conn:
             self.thread_id = self.conn.thread_id()
             return self.conn
+        self.conn = self.checkout_connection(db_name=db_name)
+        self.thread_id = self.conn.thread_id()
+        return self.conn
+
+    def _connect(self, db_name=None):
+        # https://stackoverflow.com/questions/19256155/python-mysqldb-returning-x01-for-bit-values
+        conversions = MySQLdb.converters.conversions
+        conversions[FIELD_TYPE.BIT] = lambda data: data == b"\x01"
         if db_name:
-            self.conn = MySQLdb.connect(
+            return MySQLdb.connect(
                 host=self.host,
                 port=self.port,
                 user=self.user,
@@ -92,18 +98,23 @@ class MysqlEngine(EngineBase):
                 conv=conversions,
                 connect_timeout=10,
             )
-        else:
-            self.conn = MySQLdb.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                passwd=self.password,
-                charset=self.instance.charset or "utf8mb4",
-                conv=conversions,
-                connect_timeout=10,
-            )
-        self.thread_id = self.conn.thread_id()
-        return self.conn
+        return MySQLdb.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            passwd=self.password,
+            charset=self.instance.charset or "utf8mb4",
+            conv=conversions,
+            connect_timeout=10,
+        )
+
+    def _ping(self, conn):
+        conn.ping()
+
+    def _reset_connection(self, conn):
+        """回滚未提交事务，并恢复连接默认的非自动提交模式"""
+        conn.rollback()
+        conn.autocommit(False)
 
     def escape_string(self, value: str) -> str:
         """字符串参数转义"""
@@ -300,7 +311,7 @@ class MysqlEngine(EngineBase):
         return {"column_list": _index_data.column_list, "rows": _index_data.rows}
 
     def get_tables_metas_data(self, db_name, **kwargs):
-        """获取数据库所有表格信息，用作数据字典导出接口"""
+        """获取数据库所有表格信息，用作数据字典导出接口，表和字段各查询一次，在内存中按表分组"""
         sql_tbs = f"SELECT * FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA=%(db_name)s ORDER BY TABLE_SCHEMA,TABLE_NAME;"
         tbs = self.query(
             sql=sql_tbs,
@@ -308,26 +319,33 @@ class MysqlEngine(EngineBase):
             close_conn=False,
             parameters={"db_name": db_name},
         ).rows
+        sql_cols = f"""SELECT * FROM INFORMATION_SCHEMA.COLUMNS 
+                        WHERE TABLE_SCHEMA=%(db_name)s
+                        ORDER BY TABLE_SCHEMA,TABLE_NAME,ORDINAL_POSITION;"""
+        cols = self.query(
+            sql=sql_cols,
+            cursorclass=MySQLdb.cursors.DictCursor,
+            close_conn=False,
+            parameters={"db_name": db_name},
+        ).rows
+        tb_cols = {}
+        for col in cols:
+            tb_cols.setdefault(col["TABLE_NAME"], []).append(col)
+        engine_keys = [
+            {"key": "COLUMN_NAME", "value": "字段名"},
+            {"key": "COLUMN_TYPE", "value": "数据类型"},
+            {"key": "COLUMN_DEFAULT", "value": "默认值"},
+            {"key": "IS_NULLABLE", "value": "允许非空"},
+            {"key": "EXTRA", "value": "自动递增"},
+            {"key": "COLUMN_KEY", "value": "是否主键"},
+            {"key": "COLUMN_COMMENT", "value": "备注"},
+        ]
         table_metas = []
         for tb in tbs:
             _meta = dict()
-            engine_keys = [
-                {"key": "COLUMN_NAME", "value": "字段名"},
-                {"key": "COLUMN_TYPE", "value": "数据类型"},
-                {"key": "COLUMN_DEFAULT", "value": "默认值"},
-                {"key": "IS_NULLABLE", "value": "允许非空"},
-                {"key": "EXTRA", "value": "自动递增"},
-                {"key": "COLUMN_KEY", "value": "是否主键"},
-                {"key": "COLUMN_COMMENT", "value": "备注"},
-            ]
             _meta["ENGINE_KEYS"] = engine_keys
             _meta["TABLE_INFO"] = tb
-            sql_cols = f"""SELECT * FROM INFORMATION_SCHEMA.COLUMNS 
-                            WHERE TABLE_SCHEMA='{tb['TABLE_SCHEMA']}' AND TABLE_NAME='{tb['TABLE_NAME']}'
-                            ORDER BY TABLE_SCHEMA,TABLE_NAME,ORDINAL_POSITION;"""
-            _meta["COLUMNS"] = self.query(
-                sql=sql_cols, cursorclass=MySQLdb.cursors.DictCursor, close_conn=False
-            ).rows
+            _meta["COLUMNS"] = tb_cols.get(tb["TABLE_NAME"], [])
             table_metas.append(_meta)
         return table_metas
 
@@ -483,6 +501,65 @@ class MysqlEngine(EngineBase):
         result.rows = column_list
         return result
 
+    def get_int_primary_key(self, db_name, tb_name, **kwargs):
+        """获取单列整数主键的列名，不存在时返回 None"""
+        sql = """SELECT k.COLUMN_NAME, c.DATA_TYPE
+                    FROM information_schema.KEY_COLUMN_USAGE k
+                    JOIN information_schema.COLUMNS c
+                        ON c.TABLE_SCHEMA = k.TABLE_SCHEMA
+                        AND c.TABLE_NAME = k.TABLE_NAME
+                        AND c.COLUMN_NAME = k.COLUMN_NAME
+                    WHERE k.TABLE_SCHEMA = %(db_name)s
+                    AND k.TABLE_NAME = %(tb_name)s
+                    AND k.CONSTRAINT_NAME = 'PRIMARY';"""
+        result = self.query(
+            db_name, sql, parameters={"db_name": db_name, "tb_name": tb_name}
+        )
+        if result.error or len(result.rows) != 1:
+            return None
+        column_name, data_type = result.rows[0]
+        if data_type.lower() not in (
+            "tinyint",
+            "smallint",
+            "mediumint",
+            "int",
+            "bigint",
+        ):
+            return None
+        return column_name
+
+    def get_table_rows(self, db_name, tb_name, **kwargs):
+        """获取表统计信息中的行数，InnoDB 为估算值"""
+        sql = """SELECT TABLE_ROWS FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = %(db_name)s AND TABLE_NAME = %(tb_name)s;"""
+        result = self.query(
+            db_name, sql, parameters={"db_name": db_name, "tb_name": tb_name}
+        )
+        if result.error or not result.rows or result.rows[0][0] is None:
+            return None
+        return int(result.rows[0][0])
+
+    def estimate_rows(self, db_name=None, sql=""):
+        """通过 EXPLAIN 估算返回的行数，为最外层查询各表 rows*filtered 的乘积"""
+        result = self.query(db_name=db_name, sql=f"EXPLAIN {sql.rstrip(';')}")
+        if result.error or not result.rows:
+            return None
+        columns = [column.lower() for column in result.column_list]
+        if "rows" not in columns:
+            return None
+        id_index = columns.index("id")
+        rows_index = columns.index("rows")
+        filtered_index = columns.index("filtered") if "filtered" in columns else None
+        estimate = 1
+        for row in result.rows:
+            if row[id_index] != result.rows[0][id_index] or row[rows_index] is None:
+                continue
+            filtered = 100
+            if filtered_index is not None and row[filtered_index] is not None:
+                filtered = float(row[filtered_index])
+            estimate *= float(row[rows_index]) * filtered / 100
+        return int(estimate)
+
     def describe_table(self, db_name, tb_name, **kwargs):
         """return ResultSet 类似查询"""
         tb_name = self.escape_string(tb_name)
@@ -552,6 +629,73 @@ class MysqlEngine(EngineBase):
                 self.close()
         return result_set
 
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        **kwargs,
+    ):
+        """使用 SSCursor 服务端游标流式读取，返回 StreamingResultSet"""
+        result_set = StreamingResultSet(
+            full_sql=sql, limit_num=limit_num, batch_size=batch_size
+        )
+        max_execution_time = kwargs.get("max_execution_time", 0)
+        try:
+            conn = self.get_connection(db_name=db_name)
+            conn.autocommit(True)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"set session max_execution_time={max_execution_time};")
+            except MySQLdb.OperationalError:
+                pass
+            cursor.close()
+            cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+            cursor.execute(sql, parameters)
+            fields = cursor.description
+            result_set.column_list = [i[0] for i in fields] if fields else []
+            result_set.column_type = (
+                [column_types_map.get(i[1], "") for i in fields] if fields else []
+            )
+            hex_column_index = []
+            if kwargs.get("binary_as_hex"):
+                hex_column_index = [
+                    idx
+                    for idx, _type in enumerate(result_set.column_type)
+                    if _type in ["TINY_BLOB", "MEDIUM_BLOB", "LONG_BLOB", "BLOB"]
+                ]
+
+            def fetchmany(size):
+                rows = cursor.fetchmany(size)
+                if not hex_column_index:
+                    return rows
+                rows = [list(row) for row in rows]
+                for row in rows:
+                    for index in hex_column_index:
+                        row[index] = row[index].hex() if row[index] else row[index]
+                return rows
+
+            def on_close(completed):
+                # 正常结束时关闭游标会读取剩余结果(查询语句已由filter_sql限制行数)，
+                # 中途退出则直接丢弃连接，避免读取大量剩余数据
+                if completed:
+                    try:
+                        cursor.close()
+                    except Exception:
+                        completed = False
+                self.release_connection(discard=not completed)
+
+            result_set.set_source(fetchmany, on_close)
+        except Exception as e:
+            logger.warning(
+                f"{self.name}语句执行报错，语句：{sql}，错误信息{traceback.format_exc()}"
+            )
+            result_set.error = str(e)
+            self.release_connection(discard=True)
+        return result_set
+
     def query_check(self, db_name=None, sql=""):
         # 查询语句的检查、注释去除、切分
         result = {"msg": "", "bad_query": False, "filtered_sql": sql, "has_star": False}
@@ -942,5 +1086,4 @@ class MysqlEngine(EngineBase):
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            self.conn = None
+            self.release_connection()
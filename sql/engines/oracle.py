@@ -7,7 +7,8 @@ import sqlparse
 import MySQLdb
 import simplejson as json
 import threading
-import pandas as pd
+import time
+from django.db import connection as db_connection
 from common.config import SysConfig
 from common.utils.timer import FuncTimer
 from sql.utils.sql_utils import (
@@ -17,7 +18,7 @@ from sql.utils.sql_utils import (
 )
 from . import EngineBase
 import cx_Oracle
-from .models import ResultSet, ReviewSet, ReviewResult
+from .models import ResultSet, ReviewSet, ReviewResult, StreamingResultSet
 from sql.utils.data_masking import simple_column_mask
 
 logger = logging.getLogger("default")
@@ -25,9 +26,22 @@ logger = logging.getLogger("default")
 
 class OracleEngine(EngineBase):
     test_query = "SELECT 1 FROM DUAL"
+    pool_supported = True
+    # 取数调优默认值, 可通过系统配置 oracle_fetch_options 按实例覆盖
+    fetch_min_arraysize = 100
+    fetch_max_arraysize = 10000
+    fetch_max_prefetchrows = 1000
+    fetch_bytes_per_round_trip = 1024 * 1024
+    # 回滚语句每批读取和写入备份库的行数
+    backup_batch_size = 1000
+    rollback_insert_sql = (
+        "insert into sql_rollback(redo_sql,undo_sql,workflow_id) values(%s,%s,%s)"
+    )
 
     def __init__(self, instance=None):
         super(OracleEngine, self).__init__(instance=instance)
+        # 执行工单后采集回滚语句的后台线程
+        self.backup_thread = None
         if instance:
             self.service_name = instance.service_name
             self.sid = instance.sid
@@ -35,21 +49,31 @@ class OracleEngine(EngineBase):
     def get_connection(self, db_name=None):
         if self.conn:
             return self.conn
+        # oracle 通过 current_schema 切换库, 连接与库无关
+        self.conn = self.checkout_connection()
+        return self.conn
+
+    def _connect(self, db_name=None):
         if self.sid:
             dsn = cx_Oracle.makedsn(self.host, self.port, self.sid)
-            self.conn = cx_Oracle.connect(
-                self.user, self.password, dsn=dsn, encoding="UTF-8", nencoding="UTF-8"
-            )
         elif self.service_name:
             dsn = cx_Oracle.makedsn(
                 self.host, self.port, service_name=self.service_name
             )
-            self.conn = cx_Oracle.connect(
-                self.user, self.password, dsn=dsn, encoding="UTF-8", nencoding="UTF-8"
-            )
         else:
             raise ValueError("sid 和 dsn 均未填写, 请联系管理页补充该实例配置.")
-        return self.conn
+        return cx_Oracle.connect(
+            self.user, self.password, dsn=dsn, encoding="UTF-8", nencoding="UTF-8"
+        )
+
+    def _ping(self, conn):
+        conn.ping()
+
+    def _reset_connection(self, conn):
+        """回滚未提交事务，并切换回登录用户的默认schema"""
+        conn.rollback()
+        if conn.current_schema:
+            conn.current_schema = self.user.upper()
 
     name = "Oracle"
 
@@ -372,44 +396,40 @@ class OracleEngine(EngineBase):
         ).rows
 
         # 给查询结果定义列名，query_engine.query的游标是0 1 2
-        cols_df = pd.DataFrame(
-            cols_req,
-            columns=[
-                "TABLE_NAME",
-                "TABLE_COMMENTS",
-                "COLUMN_NAME",
-                "COLUMN_TYPE",
-                "COLUMN_DEFAULT",
-                "IS_NULLABLE",
-                "COLUMN_KEY",
-                "COLUMN_COMMENT",
-            ],
-        )
-
-        # 获得表名称去重
-        col_list = cols_df.drop_duplicates("TABLE_NAME").to_dict("records")
-        for cl in col_list:
-            _meta = dict()
-            engine_keys = [
-                {"key": "COLUMN_NAME", "value": "字段名"},
-                {"key": "COLUMN_TYPE", "value": "数据类型"},
-                {"key": "COLUMN_DEFAULT", "value": "默认值"},
-                {"key": "IS_NULLABLE", "value": "允许非空"},
-                {"key": "COLUMN_KEY", "value": "是否主键"},
-                {"key": "COLUMN_COMMENT", "value": "备注"},
-            ]
-            _meta["ENGINE_KEYS"] = engine_keys
-            _meta["TABLE_INFO"] = {
-                "TABLE_NAME": cl["TABLE_NAME"],
-                "TABLE_COMMENTS": cl["TABLE_COMMENTS"],
-            }
-            table_name = cl["TABLE_NAME"]
-            # 查询DataFrame中满足表名的记录，并转为list
-            _meta["COLUMNS"] = cols_df.query("TABLE_NAME == @table_name").to_dict(
-                "records"
-            )
-
-            table_metas.append(_meta)
+        column_names = [
+            "TABLE_NAME",
+            "TABLE_COMMENTS",
+            "COLUMN_NAME",
+            "COLUMN_TYPE",
+            "COLUMN_DEFAULT",
+            "IS_NULLABLE",
+            "COLUMN_KEY",
+            "COLUMN_COMMENT",
+        ]
+        engine_keys = [
+            {"key": "COLUMN_NAME", "value": "字段名"},
+            {"key": "COLUMN_TYPE", "value": "数据类型"},
+            {"key": "COLUMN_DEFAULT", "value": "默认值"},
+            {"key": "IS_NULLABLE", "value": "允许非空"},
+            {"key": "COLUMN_KEY", "value": "是否主键"},
+            {"key": "COLUMN_COMMENT", "value": "备注"},
+        ]
+        # 一次遍历按表名分组，保持表第一次出现的顺序
+        metas = {}
+        for row in cols_req:
+            col = dict(zip(column_names, row))
+            table_name = col["TABLE_NAME"]
+            if table_name not in metas:
+                metas[table_name] = {
+                    "ENGINE_KEYS": engine_keys,
+                    "TABLE_INFO": {
+                        "TABLE_NAME": table_name,
+                        "TABLE_COMMENTS": col["TABLE_COMMENTS"],
+                    },
+                    "COLUMNS": [],
+                }
+            metas[table_name]["COLUMNS"].append(col)
+        table_metas.extend(metas.values())
         return table_metas
 
     def get_all_objects(self, db_name, **kwargs):
@@ -646,6 +666,17 @@ class OracleEngine(EngineBase):
                 self.close()
             return result
 
+    def estimate_rows(self, db_name=None, sql=""):
+        """通过执行计划的 CARDINALITY 估算返回的行数"""
+        result = self.explain_check(db_name=db_name, sql=sql, close_conn=True)
+        if result["msg"]:
+            return None
+        return int(result["rows"])
+
+    def get_probe_sql(self, sql, limit_num):
+        """oracle 使用 rownum 限制探测语句的行数"""
+        return f"SELECT 1 FROM ({sql.rstrip(';')}) WHERE ROWNUM <= {int(limit_num)}"
+
     def query_check(self, db_name=None, sql=""):
         # 查询语句的检查、注释去除、切分
         result = {"msg": "", "bad_query": False, "filtered_sql": sql, "has_star": False}
@@ -672,6 +703,128 @@ class OracleEngine(EngineBase):
             result["msg"] = keyword_warning
         return result
 
+    @staticmethod
+    def _lob_output_type_handler(preview_length=0):
+        """
+        CLOB/NCLOB 以 LONG_STRING 方式随行批量获取，避免逐个 LOB 调用 read() 产生额外的网络往返，
+        preview_length 大于 0 时在取回后立即截断，超长的 LOB 不会整段保留在结果集中
+        """
+
+        def truncate(value):
+            if value is None or len(value) <= preview_length:
+                return value
+            return f"{value[:preview_length]}...(已截断，共{len(value)}个字符)"
+
+        def handler(cursor, name, default_type, size, precision, scale):
+            if default_type in (cx_Oracle.CLOB, cx_Oracle.NCLOB):
+                return cursor.var(
+                    cx_Oracle.LONG_STRING,
+                    arraysize=cursor.arraysize,
+                    outconverter=truncate if preview_length > 0 else None,
+                )
+
+        return handler
+
+    def _fetch_options(self):
+        """
+        读取当前实例的取数参数, 系统配置 oracle_fetch_options 为 JSON 格式, 按实例名配置, "*" 为全部实例的默认值,
+        如 {"*": {"bytes_per_round_trip": 2097152}, "rac_prod": {"arraysize": 5000, "prefetchrows": 5000}}
+        """
+        try:
+            options = json.loads(SysConfig().get("oracle_fetch_options") or "{}")
+        except ValueError:
+            logger.warning("oracle_fetch_options 配置不是合法的JSON, 使用默认取数参数")
+            return {}
+        return {**options.get("*", {}), **options.get(self.instance_name, {})}
+
+    @staticmethod
+    def _row_width(fields, lob_preview_length=0):
+        """按 cursor.description 估算单行的字节数, LOB 字段按预览长度(不截断时按4000)计算"""
+        width = 0
+        for field in fields or []:
+            if field[1] in (cx_Oracle.CLOB, cx_Oracle.NCLOB, cx_Oracle.BLOB):
+                width += lob_preview_length or 4000
+            else:
+                width += max(field[2] or 0, field[3] or 0) or 22
+        return width
+
+    def _tune_cursor(self, cursor, sql, limit_num=0, lob_preview_length=0):
+        """
+        按 limit_num 和列宽设置 arraysize/prefetchrows, 返回取数参数和已产生的网络往返次数,
+        limit_num 不超过 fetch_min_arraysize 时一次往返即可取完, 否则先解析语句获取列宽,
+        按每次往返期望传输的字节数推算 arraysize, 实例配置了 arraysize/prefetchrows 时直接使用配置值
+        """
+        options = self._fetch_options()
+        limit_num = int(limit_num)
+        max_arraysize = int(options.get("max_arraysize", self.fetch_max_arraysize))
+        round_trips = 0
+        arraysize = int(options.get("arraysize", 0))
+        if not arraysize and 0 < limit_num <= self.fetch_min_arraysize:
+            arraysize = limit_num
+        elif not arraysize:
+            arraysize = self.fetch_min_arraysize
+            try:
+                # 查询语句仅解析不执行, 用于获取列信息
+                cursor.parse(sql)
+                round_trips += 1
+                row_width = self._row_width(cursor.description, lob_preview_length)
+            except cx_Oracle.Error:
+                row_width = 0
+            if row_width:
+                bytes_per_round_trip = int(
+                    options.get("bytes_per_round_trip", self.fetch_bytes_per_round_trip)
+                )
+                arraysize = min(
+                    max(bytes_per_round_trip // row_width, self.fetch_min_arraysize),
+                    max_arraysize,
+                )
+            if limit_num > 0:
+                arraysize = min(arraysize, limit_num)
+        # 行数确定时多预取一行, 执行时即可确认结果集结束, 省去一次往返
+        prefetchrows = int(
+            options.get(
+                "prefetchrows",
+                min(
+                    limit_num + 1 if 0 < limit_num <= arraysize else arraysize,
+                    self.fetch_max_prefetchrows,
+                ),
+            )
+        )
+        cursor.arraysize = arraysize
+        # prefetchrows 需要 cx_Oracle 8 及以上版本
+        if hasattr(cursor, "prefetchrows"):
+            cursor.prefetchrows = prefetchrows
+        else:
+            prefetchrows = 0
+        return {
+            "arraysize": arraysize,
+            "prefetchrows": prefetchrows,
+            "round_trips": round_trips,
+        }
+
+    @staticmethod
+    def _fetch_metrics(tuning, row_count, elapsed, sample=None):
+        """
+        汇总取数指标, 网络往返次数按 arraysize/prefetchrows 估算(执行一次, 预取之外每 arraysize 行一次),
+        传输字节数按样本行的平均大小估算
+        """
+        remaining = max(row_count - tuning["prefetchrows"], 0)
+        round_trips = tuning["round_trips"] + 1 + -(-remaining // tuning["arraysize"])
+        sample = sample or []
+        sample_bytes = sum(
+            len(v) if isinstance(v, (str, bytes)) else len(str(v))
+            for row in sample
+            for v in row
+            if v is not None
+        )
+        return {
+            **tuning,
+            "round_trips": round_trips,
+            "bytes": sample_bytes * row_count // len(sample) if sample else 0,
+            "rows_per_second": round(row_count / elapsed) if elapsed else row_count,
+            "fetch_time": round(elapsed, 3),
+        }
+
     def query(
         self,
         db_name=None,
@@ -679,9 +832,10 @@ class OracleEngine(EngineBase):
         limit_num=0,
         close_conn=True,
         parameters=None,
+        lob_preview_length=None,
         **kwargs,
     ):
-        """返回 ResultSet"""
+        """返回 ResultSet，lob_preview_length 为 LOB 字段的预览长度，不传时读取系统配置，0 表示不截断"""
         result_set = ResultSet(full_sql=sql)
         try:
             conn = self.get_connection()
@@ -694,23 +848,29 @@ class OracleEngine(EngineBase):
                 cursor.execute(sql)
                 # 重置SQL文本，获取SQL执行计划
                 sql = f"select PLAN_TABLE_OUTPUT from table(dbms_xplan.display)"
+            # CLOB/NCLOB 随结果集批量按字符串返回，超出预览长度的部分截断
+            if lob_preview_length is None:
+                lob_preview_length = int(
+                    SysConfig().get("oracle_lob_preview_length", 0) or 0
+                )
+            cursor.outputtypehandler = self._lob_output_type_handler(lob_preview_length)
+            start = time.perf_counter()
+            tuning = self._tune_cursor(cursor, sql, limit_num, lob_preview_length)
             cursor.execute(sql, parameters or [])
             fields = cursor.description
-            if any(x[1] == cx_Oracle.CLOB for x in fields):
-                rows = [
-                    tuple([(c.read() if type(c) == cx_Oracle.LOB else c) for c in r])
-                    for r in cursor
-                ]
-                if int(limit_num) > 0:
-                    rows = rows[0 : int(limit_num)]
+            if int(limit_num) > 0:
+                rows = cursor.fetchmany(int(limit_num))
             else:
-                if int(limit_num) > 0:
-                    rows = cursor.fetchmany(int(limit_num))
-                else:
-                    rows = cursor.fetchall()
+                rows = cursor.fetchall()
             result_set.column_list = [i[0] for i in fields] if fields else []
             result_set.rows = [tuple(x) for x in rows]
             result_set.affected_rows = len(result_set.rows)
+            result_set.fetch_metrics = self._fetch_metrics(
+                tuning,
+                result_set.affected_rows,
+                time.perf_counter() - start,
+                sample=result_set.rows[: tuning["arraysize"]],
+            )
         except Exception as e:
             logger.warning(
                 f"Oracle 语句执行报错，语句：{sql}，错误信息{traceback.format_exc()}"
@@ -721,6 +881,69 @@ class OracleEngine(EngineBase):
                 self.close()
         return result_set
 
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        lob_preview_length=None,
+        **kwargs,
+    ):
+        """按调优后的 arraysize 分批读取游标, 返回 StreamingResultSet, 遍历结束后记录取数指标"""
+        result_set = StreamingResultSet(
+            full_sql=sql, limit_num=limit_num, batch_size=batch_size
+        )
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            if db_name:
+                conn.current_schema = db_name
+            sql = sql.rstrip(";")
+            if re.match(r"^explain", sql, re.I):
+                cursor.execute(sql)
+                sql = f"select PLAN_TABLE_OUTPUT from table(dbms_xplan.display)"
+            if lob_preview_length is None:
+                lob_preview_length = int(
+                    SysConfig().get("oracle_lob_preview_length", 0) or 0
+                )
+            cursor.outputtypehandler = self._lob_output_type_handler(lob_preview_length)
+            start = time.perf_counter()
+            tuning = self._tune_cursor(cursor, sql, limit_num, lob_preview_length)
+            cursor.execute(sql, parameters or [])
+            fields = cursor.description
+            result_set.column_list = [i[0] for i in fields] if fields else []
+            sample = []
+
+            def fetchmany(size):
+                rows = cursor.fetchmany(size)
+                if not sample:
+                    sample.extend(rows[: tuning["arraysize"]])
+                return rows
+
+            def on_close(completed):
+                result_set.fetch_metrics = self._fetch_metrics(
+                    tuning,
+                    result_set.affected_rows,
+                    time.perf_counter() - start,
+                    sample=sample,
+                )
+                try:
+                    cursor.close()
+                except Exception:
+                    completed = False
+                self.release_connection(discard=not completed)
+
+            result_set.set_source(fetchmany, on_close)
+        except Exception as e:
+            logger.warning(
+                f"Oracle 语句执行报错，语句：{sql}，错误信息{traceback.format_exc()}"
+            )
+            result_set.error = str(e)
+            self.close()
+        return result_set
+
     def query_masking(self, db_name=None, sql="", resultset=None):
         """简单字段脱敏规则, 仅对select有效"""
         if re.match(r"^select", sql, re.I):
@@ -1117,6 +1340,7 @@ class OracleEngine(EngineBase):
 
         line = 1
         statement = None
+        begin_time = None
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
@@ -1229,26 +1453,46 @@ class OracleEngine(EngineBase):
                 )
                 line += 1
         finally:
-            # 备份
-            if workflow.is_backup:
-                try:
-                    cursor.execute(f"select sysdate from dual")
-                    rows = cursor.fetchone()
-                    end_time = rows[0]
-                    self.backup(
-                        workflow,
-                        cursor=cursor,
-                        begin_time=begin_time,
-                        end_time=end_time,
-                    )
-                except Exception as e:
-                    logger.error(
-                        f"Oracle工单备份异常，工单id：{workflow.id}， 错误信息：{traceback.format_exc()}"
-                    )
-            if close_conn:
-                self.close()
+            # 备份，日志挖掘只能在执行语句的会话中进行，需要关闭连接时转到后台线程采集回滚语句，执行结果先行返回
+            if workflow.is_backup and begin_time and close_conn:
+                self.backup_thread = threading.Thread(
+                    target=self._backup_in_background,
+                    args=(workflow, cursor, begin_time),
+                    name=f"oracle-backup-{workflow.id}",
+                )
+                self.backup_thread.start()
+            else:
+                if workflow.is_backup and begin_time:
+                    self._capture_rollback(workflow, cursor, begin_time)
+                if close_conn:
+                    self.close()
         return execute_result
 
+    def _capture_rollback(self, workflow, cursor, begin_time):
+        """以当前时间为结束时间，挖掘工单执行期间的日志并保存回滚语句"""
+        try:
+            cursor.execute(f"select sysdate from dual")
+            rows = cursor.fetchone()
+            end_time = rows[0]
+            self.backup(
+                workflow,
+                cursor=cursor,
+                begin_time=begin_time,
+                end_time=end_time,
+            )
+        except Exception as e:
+            logger.error(
+                f"Oracle工单备份异常，工单id：{workflow.id}， 错误信息：{traceback.format_exc()}"
+            )
+
+    def _backup_in_background(self, workflow, cursor, begin_time):
+        """后台线程中采集回滚语句，完成后释放执行工单的连接"""
+        try:
+            self._capture_rollback(workflow, cursor, begin_time)
+        finally:
+            self.close()
+            db_connection.close()
+
     def backup(self, workflow, cursor, begin_time, end_time):
         """
         :param workflow: 工单对象，作为备份记录与工单的关联列
@@ -1295,21 +1539,28 @@ class OracleEngine(EngineBase):
                                     dbms_logmnr.end_logmnr;
                                  end;"""
             cursor.execute(logmnr_start_sql)
-            cursor.execute(undo_sql)
-            rows = cursor.fetchall()
-            cursor.execute(logmnr_end_sql)
-            if len(rows) > 0:
-                for row in rows:
-                    redo_sql = f"{row[0]}"
-                    redo_sql = redo_sql.replace("'", "\\'")
-                    if row[1] is None:
-                        undo_sql = f" "
-                    else:
-                        undo_sql = f"{row[1]}"
-                    undo_sql = undo_sql.replace("'", "\\'")
-                    # 回滚SQL入库
-                    sql = f"""insert into sql_rollback(redo_sql,undo_sql,workflow_id) values('{redo_sql}','{undo_sql}',{workflow_id});"""
-                    backup_cursor.execute(sql)
+            try:
+                # 挖掘结果按批次读取，CLOB 随行返回，每批使用 executemany 参数化写入备份库
+                cursor.outputtypehandler = self._lob_output_type_handler()
+                cursor.arraysize = self.backup_batch_size
+                cursor.execute(undo_sql)
+                while True:
+                    rows = cursor.fetchmany(self.backup_batch_size)
+                    if not rows:
+                        break
+                    backup_cursor.executemany(
+                        self.rollback_insert_sql,
+                        [
+                            (
+                                f"{row[0]}",
+                                " " if row[1] is None else row[1],
+                                workflow_id,
+                            )
+                            for row in rows
+                        ],
+                    )
+            finally:
+                cursor.execute(logmnr_end_sql)
         except Exception as e:
             logger.warning(f"备份失败，错误信息{traceback.format_exc()}")
             return False
@@ -1343,15 +1594,14 @@ class OracleEngine(EngineBase):
                                      ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""")
             rows = cursor.fetchall()
             if len(rows) > 0:
-                for row in rows:
-                    if row[0] is None:
-                        undo_sql = f" "
-                    else:
-                        undo_sql = f"{row[0]}"
-                    undo_sql = undo_sql.replace("'", "\\'")
-                    # 回滚SQL入库
-                    sql = f"""insert into sql_rollback(redo_sql,undo_sql,workflow_id) values('{redo_sql}','{undo_sql}',{workflow_id});"""
-                    backup_cursor.execute(sql)
+                # 回滚SQL入库
+                backup_cursor.executemany(
+                    self.rollback_insert_sql,
+                    [
+                        (redo_sql, " " if row[0] is None else f"{row[0]}", workflow_id)
+                        for row in rows
+                    ],
+                )
         except Exception as e:
             logger.warning(f"备份失败，错误信息{traceback.format_exc()}")
             return False
@@ -1599,5 +1849,4 @@ class OracleEngine(EngineBase):
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            self.conn = None
+            self.release_connection()
@@ -8,6 +8,7 @@
 
 import json
 import re
+import uuid
 import psycopg2
 import logging
 import traceback
@@ -17,7 +18,7 @@ from common.config import SysConfig
 from common.utils.timer import FuncTimer
 from sql.utils.sql_utils import get_syntax_type
 from . import EngineBase
-from .models import ResultSet, ReviewSet, ReviewResult
+from .models import ResultSet, ReviewSet, ReviewResult, StreamingResultSet
 from sql.utils.data_masking import simple_column_mask
 
 __author__ = "hhyo、yyukai"
@@ -27,12 +28,17 @@ logger = logging.getLogger("default")
 
 class PgSQLEngine(EngineBase):
     test_query = "SELECT 1"
+    pool_supported = True
 
     def get_connection(self, db_name=None):
         db_name = db_name or self.db_name or "postgres"
         if self.conn:
             return self.conn
-        self.conn = psycopg2.connect(
+        self.conn = self.checkout_connection(db_name=db_name)
+        return self.conn
+
+    def _connect(self, db_name=None):
+        return psycopg2.connect(
             host=self.host,
             port=self.port,
             user=self.user,
@@ -41,7 +47,17 @@ class PgSQLEngine(EngineBase):
             dbname=db_name,
             connect_timeout=10,
         )
-        return self.conn
+
+    def _ping(self, conn):
+        if conn.closed:
+            return False
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+
+    def _reset_connection(self, conn):
+        """回滚未提交事务，并通过 RESET ALL 清理 search_path、statement_timeout 等会话参数"""
+        conn.reset()
 
     name = "PgSQL"
 
@@ -122,6 +138,70 @@ class PgSQLEngine(EngineBase):
         result.rows = column_list
         return result
 
+    def get_int_primary_key(self, db_name, tb_name, **kwargs):
+        """
+        获取单列整数主键的列名，不存在时返回 None
+        :param db_name:
+        :param tb_name:
+        :param schema_name:
+        :return:
+        """
+        schema_name = kwargs.get("schema_name") or "public"
+        sql = """SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_index i
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(i.indkey)
+        WHERE i.indisprimary
+        and t.relname=%(tb_name)s
+        and n.nspname=%(schema_name)s;"""
+        result = self.query(
+            db_name=db_name,
+            sql=sql,
+            parameters={"schema_name": schema_name, "tb_name": tb_name},
+        )
+        if result.error or len(result.rows) != 1:
+            return None
+        column_name, data_type = result.rows[0]
+        if data_type not in ("smallint", "integer", "bigint"):
+            return None
+        return column_name
+
+    def get_table_rows(self, db_name, tb_name, **kwargs):
+        """
+        获取表统计信息中的行数(pg_class.reltuples)，未做过统计时返回 None
+        :param db_name:
+        :param tb_name:
+        :param schema_name:
+        :return:
+        """
+        schema_name = kwargs.get("schema_name") or "public"
+        sql = """SELECT c.reltuples::bigint
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        where c.relname=%(tb_name)s
+        and n.nspname=%(schema_name)s;"""
+        result = self.query(
+            db_name=db_name,
+            sql=sql,
+            parameters={"schema_name": schema_name, "tb_name": tb_name},
+        )
+        if result.error or not result.rows or result.rows[0][0] < 0:
+            return None
+        return int(result.rows[0][0])
+
+    def estimate_rows(self, db_name=None, sql=""):
+        """通过 EXPLAIN (FORMAT JSON) 获取执行计划估算的行数"""
+        result = self.query(
+            db_name=db_name, sql=f"EXPLAIN (FORMAT JSON) {sql.rstrip(';')}"
+        )
+        if result.error or not result.rows:
+            return None
+        plan = result.rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
     def describe_table(self, db_name, tb_name, **kwargs):
         """
         获取表结构信息
@@ -209,29 +289,7 @@ class PgSQLEngine(EngineBase):
             conn.commit()
             fields = cursor.description
             column_type_codes = [i[1] for i in fields] if fields else []
-            # 定义 JSON 和 JSONB 的 type_code,# 114 是 json，3802 是 jsonb
-            JSON_TYPE_CODE = 114
-            JSONB_TYPE_CODE = 3802
-            # 对 rows 进行循环处理，判断是否是 jsonb 或 json 类型
-            converted_rows = []
-            for row in rows:
-                new_row = []
-                for idx, col_value in enumerate(row):
-                    # 理论上, 下标不会越界的
-                    column_type_code = (
-                        column_type_codes[idx] if idx < len(column_type_codes) else None
-                    )
-                    # 只在列类型为 json 或 jsonb 时转换
-                    if column_type_code in [JSON_TYPE_CODE, JSONB_TYPE_CODE]:
-                        if isinstance(col_value, (dict, list)):
-                            new_row.append(
-                                json.dumps(col_value, ensure_ascii=False)
-                            )  # 转为 JSON 字符串
-                        else:
-                            new_row.append(col_value)
-                    else:
-                        new_row.append(col_value)
-                converted_rows.append(tuple(new_row))
+            converted_rows = self.convert_json_rows(rows, column_type_codes)
 
             result_set.column_list = [i[0] for i in fields] if fields else []
             result_set.rows = converted_rows
@@ -247,6 +305,99 @@ class PgSQLEngine(EngineBase):
                 self.close()
         return result_set
 
+    @staticmethod
+    def convert_json_rows(rows, column_type_codes):
+        """json 和 jsonb 类型的列转为 JSON 字符串"""
+        # 定义 JSON 和 JSONB 的 type_code,# 114 是 json，3802 是 jsonb
+        JSON_TYPE_CODE = 114
+        JSONB_TYPE_CODE = 3802
+        json_column_index = [
+            idx
+            for idx, column_type_code in enumerate(column_type_codes)
+            if column_type_code in [JSON_TYPE_CODE, JSONB_TYPE_CODE]
+        ]
+        if not json_column_index:
+            return [tuple(row) for row in rows]
+        converted_rows = []
+        for row in rows:
+            new_row = list(row)
+            for idx in json_column_index:
+                # 理论上, 下标不会越界的
+                if idx < len(new_row) and isinstance(new_row[idx], (dict, list)):
+                    new_row[idx] = json.dumps(new_row[idx], ensure_ascii=False)
+            converted_rows.append(tuple(new_row))
+        return converted_rows
+
+    def query_stream(
+        self,
+        db_name=None,
+        sql="",
+        limit_num=0,
+        parameters=None,
+        batch_size=1000,
+        **kwargs,
+    ):
+        """使用命名游标(服务端游标)流式读取，返回 StreamingResultSet，非查询语句回退为普通查询"""
+        if not re.match(r"^\s*(select|with|values)", sql, re.I):
+            return super().query_stream(
+                db_name=db_name,
+                sql=sql,
+                limit_num=limit_num,
+                parameters=parameters,
+                batch_size=batch_size,
+                **kwargs,
+            )
+        schema_name = kwargs.get("schema_name")
+        result_set = StreamingResultSet(
+            full_sql=sql, limit_num=limit_num, batch_size=batch_size
+        )
+        try:
+            conn = self.get_connection(db_name=db_name)
+            conn.autocommit = False
+            max_execution_time = kwargs.get("max_execution_time", 0)
+            with conn.cursor() as cursor:
+                cursor.execute(f"SET statement_timeout TO {int(max_execution_time)};")
+                cursor.execute(
+                    "SET transaction ISOLATION LEVEL READ COMMITTED READ ONLY;"
+                )
+                if schema_name:
+                    cursor.execute(
+                        f"SET search_path TO %(schema_name)s;",
+                        {"schema_name": schema_name},
+                    )
+            cursor = conn.cursor(name=f"archery_stream_{uuid.uuid4().hex}")
+            cursor.itersize = batch_size
+            cursor.execute(sql, parameters)
+            # 命名游标在第一次fetch后才有description
+            first_batch = cursor.fetchmany(
+                min(batch_size, int(limit_num)) if int(limit_num) > 0 else batch_size
+            )
+            fields = cursor.description
+            column_type_codes = [i[1] for i in fields] if fields else []
+            result_set.column_list = [i[0] for i in fields] if fields else []
+            pending = [first_batch]
+
+            def fetchmany(size):
+                rows = pending.pop() if pending else cursor.fetchmany(size)
+                return self.convert_json_rows(rows, column_type_codes)
+
+            def on_close(completed):
+                try:
+                    cursor.close()
+                    conn.commit()
+                except Exception:
+                    completed = False
+                self.release_connection(discard=not completed)
+
+            result_set.set_source(fetchmany, on_close)
+        except Exception as e:
+            logger.warning(
+                f"PgSQL命令执行报错，语句：{sql}， 错误信息：{traceback.format_exc()}"
+            )
+            result_set.error = str(e)
+            self.release_connection(discard=True)
+        return result_set
+
     def filter_sql(self, sql="", limit_num=0):
         # 对查询sql增加limit限制，# TODO limit改写待优化
         sql_lower = sql.lower().rstrip(";").strip()
@@ -392,8 +543,7 @@ class PgSQLEngine(EngineBase):
 
     def close(self):
         if self.conn:
-            self.conn.close()
-            self.conn = None
+            self.release_connection()
 
     def processlist(self, command_type, **kwargs):
         """获取连接信息"""
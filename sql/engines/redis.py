@@ -6,6 +6,7 @@
 @time: 2019/03/26
 """
 
+import itertools
 import json
 import re
 import shlex
@@ -14,6 +15,7 @@ import redis
 import logging
 import traceback
 
+from common.config import SysConfig
 from common.utils.timer import FuncTimer
 from . import EngineBase
 from .models import ResultSet, ReviewSet, ReviewResult
@@ -22,6 +24,14 @@ __author__ = "hhyo"
 
 logger = logging.getLogger("default")
 
+# 每次 SCAN 的 COUNT 上限，以及单次请求最多调用 SCAN 的次数，避免阻塞 Redis
+SCAN_COUNT = 1000
+SCAN_MAX_CALLS = 100
+# 浏览key时每页返回的key数量
+SCAN_PAGE_SIZE = 100
+# KEYS 改写为 SCAN 后最多返回的key数量
+KEYS_LIMIT = 10000
+
 
 class RedisEngine(EngineBase):
     def get_connection(self, db_name=None):
@@ -91,21 +101,95 @@ class RedisEngine(EngineBase):
     def get_all_tables(self, db_name, **kwargs):
         """获取表列表。Redis的key可以理为表。方法只扫描部分表。起到预览作用。"""
         result = ResultSet(full_sql="")
-        max_results = 100
-        table_info_list = []
         try:
             conn = self.get_connection(db_name)
-            scan_rows = conn.scan_iter(match=None, count=20)
-            for idx, key in enumerate(scan_rows):
-                if idx >= max_results:
-                    break
-                table_info_list.append(key)
+            scan_rows = conn.scan_iter(match=None, count=SCAN_COUNT)
+            result.rows = list(itertools.islice(scan_rows, SCAN_PAGE_SIZE))
         except Exception as e:
             logger.error(f"get_all_tables执行报错，异常信息：{e}")
             result.message = f"{e}"
-        result.rows = table_info_list
         return result
 
+    def scan_keys(
+        self,
+        db_name=None,
+        cursor=0,
+        match=None,
+        key_type=None,
+        page_size=SCAN_PAGE_SIZE,
+    ):
+        """
+        按页浏览key，返回 ResultSet，rows 为 (key, type, ttl, memory)，key的信息每页通过一次 pipeline 获取
+        result.cursor 为下一页的游标，为 0 时表示扫描结束
+        单页最多调用 SCAN_MAX_CALLS 次 SCAN，匹配的key较少时可能返回不足一页的数据和非0游标
+        集群模式各节点的游标无法合并，只返回第一页
+        """
+        result = ResultSet(
+            full_sql=f"SCAN {cursor} MATCH {match or '*'} COUNT {SCAN_COUNT}",
+            column_list=["key", "type", "ttl", "memory"],
+        )
+        result.cursor = 0
+        try:
+            conn = self.get_connection(db_name)
+            if self.mode == "cluster":
+                keys = list(
+                    itertools.islice(
+                        conn.scan_iter(match=match, count=SCAN_COUNT, _type=key_type),
+                        page_size,
+                    )
+                )
+            else:
+                keys, cursor = [], int(cursor)
+                for _ in range(SCAN_MAX_CALLS):
+                    cursor, batch = conn.scan(
+                        cursor=cursor, match=match, count=SCAN_COUNT, _type=key_type
+                    )
+                    keys.extend(batch)
+                    if cursor == 0 or len(keys) >= page_size:
+                        break
+                result.cursor = cursor
+            result.rows = self._key_meta(conn, keys)
+            result.affected_rows = len(result.rows)
+        except Exception as e:
+            logger.warning(f"Redis SCAN 执行报错，错误信息：{traceback.format_exc()}")
+            result.error = str(e)
+        return result
+
+    @staticmethod
+    def _key_meta(conn, keys):
+        """通过一次 pipeline 获取key的 TYPE、TTL、MEMORY USAGE，获取失败的信息返回 None"""
+        if not keys:
+            return []
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+        replies = [
+            None if isinstance(reply, Exception) else reply
+            for reply in pipe.execute(raise_on_error=False)
+        ]
+        return [
+            (key, *replies[index * 3 : index * 3 + 3]) for index, key in enumerate(keys)
+        ]
+
+    def _scan_instead_of_keys(self, conn, pattern, limit_num):
+        """KEYS 会阻塞 Redis，改写为 SCAN 迭代，最多返回 limit_num 或 KEYS_LIMIT 个key"""
+        limit = min(limit_num, KEYS_LIMIT) if limit_num > 0 else KEYS_LIMIT
+        keys = list(
+            itertools.islice(conn.scan_iter(match=pattern, count=SCAN_COUNT), limit + 1)
+        )
+        return keys[:limit], len(keys) > limit
+
+    @staticmethod
+    def _bound_scan_args(args):
+        """SCAN 的 COUNT 超过 SCAN_COUNT 时改为 SCAN_COUNT"""
+        args = list(args)
+        for index, arg in enumerate(args[:-1]):
+            if arg.lower() == "count" and args[index + 1].isdigit():
+                args[index + 1] = str(min(int(args[index + 1]), SCAN_COUNT))
+        return args
+
     def query_check(self, db_name=None, sql="", limit_num=0):
         """提交查询前的检查"""
         result = {"msg": "", "bad_query": True, "filtered_sql": sql, "has_star": False}
@@ -170,7 +254,19 @@ class RedisEngine(EngineBase):
         result_set = ResultSet(full_sql=sql)
         try:
             conn = self.get_connection(db_name=db_name)
-            rows = conn.execute_command(*shlex.split(sql))
+            args = shlex.split(sql)
+            command = args[0].lower() if args else ""
+            if command == "keys" and len(args) == 2:
+                keys, truncated = self._scan_instead_of_keys(conn, args[1], limit_num)
+                result_set.column_list = ["Result"]
+                result_set.rows = tuple([key] for key in keys)
+                result_set.affected_rows = len(keys)
+                if truncated:
+                    result_set.warning = f"KEYS 已改写为 SCAN，仅返回前{len(keys)}个key"
+                return result_set
+            if command == "scan":
+                args = self._bound_scan_args(args)
+            rows = conn.execute_command(*args)
             result_set.column_list = ["Result"]
             if isinstance(rows, list) or isinstance(rows, tuple):
                 if re.match(rf"^scan", sql.strip(), re.I):
@@ -239,6 +335,16 @@ class RedisEngine(EngineBase):
         """执行上线单，返回Review set"""
         sql = workflow.sqlworkflowcontent.sql_content
         split_sql = [cmd.strip() for cmd in sql.split("\n") if cmd.strip()]
+        config = SysConfig()
+        pipeline_size = int(config.get("redis_pipeline_size") or 0)
+        if pipeline_size > 1 and len(split_sql) > 1:
+            return self.execute_pipeline(
+                db_name=workflow.db_name,
+                sql=sql,
+                split_sql=split_sql,
+                pipeline_size=pipeline_size,
+                transaction=config.get("redis_pipeline_transaction", False),
+            )
         execute_result = ReviewSet(full_sql=sql)
         line = 1
         cmd = None
@@ -292,3 +398,88 @@ class RedisEngine(EngineBase):
                 )
                 line += 1
         return execute_result
+
+    def execute_pipeline(
+        self, db_name, sql, split_sql, pipeline_size=1000, transaction=False
+    ):
+        """
+        按 pipeline_size 条命令一个批次通过 pipeline 执行，transaction=True 时每个批次使用 MULTI/EXEC
+        批次内的命令会全部发送，某条命令报错时，同批次的其他命令按实际结果返回，后续批次不再执行
+        :return: ReviewSet，每行对应一条命令，包含返回值和批次的吞吐量
+        """
+        execute_result = ReviewSet(full_sql=sql)
+        rows = [None] * len(split_sql)
+        errors = {}
+        start, batch_no, executed, total_cost = 0, 0, 0, 0
+        batch = []
+        try:
+            conn = self.get_connection(db_name=db_name)
+            while start < len(split_sql) and not errors:
+                batch = []
+                for index in range(start, min(start + pipeline_size, len(split_sql))):
+                    try:
+                        batch.append((index, shlex.split(split_sql[index])))
+                    except ValueError as e:
+                        errors[index] = e
+                        break
+                start += pipeline_size
+                if not batch:
+                    break
+                batch_no += 1
+                pipe = conn.pipeline(transaction=transaction)
+                for _, args in batch:
+                    pipe.execute_command(*args)
+                with FuncTimer() as t:
+                    try:
+                        replies = pipe.execute(raise_on_error=False)
+                    except Exception as e:
+                        # 事务被放弃或者连接异常，整个批次视为失败
+                        replies = [e] * len(batch)
+                executed += len(batch)
+                total_cost += t.cost
+                rate = int(len(batch) / t.cost) if t.cost else len(batch)
+                for (index, _), reply in zip(batch, replies):
+                    if isinstance(reply, Exception):
+                        errors[index] = reply
+                        continue
+                    rows[index] = ReviewResult(
+                        errlevel=0,
+                        stagestatus="Execute Successfully",
+                        errormessage=f"批次{batch_no}：{len(batch)}条命令，{rate}条/秒，返回：{reply}",
+                        sql=split_sql[index],
+                        affected_rows=0,
+                        execute_time=round(t.cost / len(batch), 6),
+                    )
+        except Exception as e:
+            errors.setdefault(batch[0][0] if batch else start, e)
+        if errors:
+            index = min(errors)
+            logger.warning(
+                f"Redis命令执行报错，语句：{split_sql[index]}， 错误信息：{errors[index]}"
+            )
+            execute_result.error = str(errors[index])
+        logger.info(
+            f"Redis pipeline执行{executed}条命令，{batch_no}个批次，耗时{round(total_cost, 3)}秒"
+        )
+        for index, statement in enumerate(split_sql):
+            if rows[index] is None and index in errors:
+                rows[index] = ReviewResult(
+                    errlevel=2,
+                    stagestatus="Execute Failed",
+                    errormessage=f"异常信息：{errors[index]}",
+                    sql=statement,
+                    affected_rows=0,
+                    execute_time=0,
+                )
+            elif rows[index] is None:
+                rows[index] = ReviewResult(
+                    errlevel=0,
+                    stagestatus="Audit completed",
+                    errormessage=f"前序语句失败, 未执行",
+                    sql=statement,
+                    affected_rows=0,
+                    execute_time=0,
+                )
+            rows[index].id = index + 1
+        execute_result.rows = rows
+        return execute_result
@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 import unittest
 from unittest.mock import patch, Mock
 from elasticsearch import Elasticsearch
@@ -140,6 +142,100 @@ class TestElasticsearchEngine(unittest.TestCase):
         self.assertEqual(result.rows, expected_rows)
         self.assertEqual(result.column_list, expected_columns)
 
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_query_search_after(self, mockElasticsearch):
+        """超过一页时通过 PIT + search_after 翻页"""
+        mock_conn = Mock()
+        mock_conn.open_point_in_time.return_value = {"id": "pit1"}
+        pages = [
+            {
+                "pit_id": "pit2",
+                "hits": {
+                    "hits": [
+                        {"_id": "1", "_source": {"a": 1}, "sort": [1]},
+                        {"_id": "2", "_source": {"a": 2}, "sort": [2]},
+                    ]
+                },
+            },
+            {
+                "pit_id": "pit2",
+                "hits": {"hits": [{"_id": "3", "_source": {"b": [3]}, "sort": [3]}]},
+            },
+        ]
+        bodies = []
+
+        def search(body, params):
+            bodies.append(json.loads(json.dumps(body)))
+            return pages[len(bodies) - 1]
+
+        mock_conn.search.side_effect = search
+        mockElasticsearch.return_value = mock_conn
+        self.engine.search_page_size = 2
+
+        result = self.engine.query(sql="GET /test_index/_search", limit_num=3)
+        self.assertEqual(result.column_list, ["_id", "a", "b"])
+        self.assertEqual(
+            result.rows, [("1", 1, None), ("2", 2, None), ("3", None, "[3]")]
+        )
+        self.assertEqual(bodies[0]["sort"], [{"_shard_doc": "asc"}])
+        self.assertNotIn("search_after", bodies[0])
+        self.assertEqual(bodies[1]["search_after"], [2])
+        self.assertEqual(bodies[1]["pit"]["id"], "pit2")
+        self.assertEqual(bodies[1]["size"], 1)
+        mock_conn.close_point_in_time.assert_called_once_with(body={"id": "pit2"})
+
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_query_sql_cursor(self, mockElasticsearch):
+        """SQL语句通过游标翻页"""
+        mock_conn = Mock()
+        mock_conn.sql.query.side_effect = [
+            {"columns": [{"name": "a"}], "rows": [[1], [2]], "cursor": "c1"},
+            {"rows": [[3]]},
+        ]
+        mockElasticsearch.return_value = mock_conn
+
+        result = self.engine.query(sql="select a from test_index", db_name="")
+        self.assertEqual(result.column_list, ["a"])
+        self.assertEqual(result.rows, [[1], [2], [3]])
+        self.assertEqual(result.affected_rows, 3)
+        mock_conn.sql.query.assert_called_with(body={"cursor": "c1"})
+        mock_conn.sql.clear_cursor.assert_not_called()
+
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_query_stream(self, mockElasticsearch):
+        """流式查询达到 limit_num 后关闭游标"""
+        mock_conn = Mock()
+        mock_conn.sql.query.side_effect = [
+            {"columns": [{"name": "a"}], "rows": [[1], [2]], "cursor": "c1"},
+            {"rows": [[3], [4]], "cursor": "c2"},
+        ]
+        mockElasticsearch.return_value = mock_conn
+
+        result = self.engine.query_stream(
+            sql="select a from test_index", limit_num=3, batch_size=2
+        )
+        self.assertEqual(result.column_list, ["a"])
+        self.assertEqual(list(result.batches()), [[(1,), (2,)], [(3,)]])
+        mock_conn.sql.clear_cursor.assert_called_once_with(body={"cursor": "c2"})
+
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_query_stream_search(self, mockElasticsearch):
+        """DSL 流式查询，列名包含 mapping 中的字段"""
+        mock_conn = Mock()
+        mock_conn.open_point_in_time.return_value = {"id": "pit1"}
+        mock_conn.search.return_value = {
+            "hits": {"hits": [{"_id": "1", "_source": {"a": 1}, "sort": [1]}]}
+        }
+        mock_conn.indices.get_mapping.return_value = {
+            "test_index": {"mappings": {"properties": {"a": {}, "b": {}}}}
+        }
+        mockElasticsearch.return_value = mock_conn
+
+        result = self.engine.query_stream(sql="GET /test_index/_search")
+        self.assertEqual(result.column_list, ["_id", "a", "b"])
+        self.assertEqual(list(result), [("1", 1, None)])
+        mock_conn.close_point_in_time.assert_called_once_with(body={"id": "pit1"})
+
     @patch("sql.engines.elasticsearch.Elasticsearch")
     def test_query_cat_indices(self, mock_elasticsearch):
         """test_query_cat_indices"""
@@ -580,6 +676,160 @@ class TestElasticsearchEngine(unittest.TestCase):
         self.assertIn("Execute Successfully", result.rows[0].stagestatus)
         self.assertIn("POST", result.rows[0].sql)
 
+    @patch("sql.engines.elasticsearch.SysConfig")
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_execute_workflow_bulk(self, mockElasticsearch, _config):
+        """测试连续的文档写入合并为 _bulk 请求"""
+        mock_conn = Mock()
+        mockElasticsearch.return_value = mock_conn
+        _config.return_value.get.side_effect = lambda key, default=None: {
+            "es_bulk_batch_size": 2
+        }.get(key, default)
+        mock_conn.bulk.side_effect = [
+            {
+                "errors": True,
+                "items": [
+                    {
+                        "index": {
+                            "_id": "1",
+                            "status": 201,
+                            "_shards": {"successful": 1},
+                        }
+                    },
+                    {
+                        "update": {
+                            "_id": "2",
+                            "status": 404,
+                            "error": {"type": "document_missing_exception"},
+                        }
+                    },
+                ],
+            },
+            {"errors": False, "items": [{"delete": {"_id": "3", "status": 200}}]},
+        ]
+
+        workflow = Mock()
+        workflow.sqlworkflowcontent.sql_content = """
+        POST /test_index/_doc/1 {"name": "a"}
+        POST /test_index/_update/2 {"doc": {"name": "b"}}
+        DELETE /test_index/_doc/3
+        """
+        workflow.db_name = "test_db"
+        result = self.engine.execute_workflow(workflow)
+
+        self.assertIsNone(result.error)
+        self.assertEqual([r.id for r in result.rows], [1, 2, 3])
+        self.assertEqual([r.errlevel for r in result.rows], [0, 1, 0])
+        self.assertEqual(result.rows[0].affected_rows, 1)
+        self.assertEqual(mock_conn.bulk.call_count, 2)
+        self.assertEqual(
+            mock_conn.bulk.call_args_list[0].kwargs["body"],
+            [
+                {"index": {"_index": "test_index", "_id": "1"}},
+                {"name": "a"},
+                {"update": {"_index": "test_index", "_id": "2"}},
+                {"doc": {"name": "b"}},
+            ],
+        )
+        mock_conn.index.assert_not_called()
+
+    @patch("sql.engines.elasticsearch.SysConfig")
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_execute_workflow_bulk_error(self, mockElasticsearch, _config):
+        """测试 _bulk 中文档失败后，后续批次和语句不再执行"""
+        mock_conn = Mock()
+        mockElasticsearch.return_value = mock_conn
+        _config.return_value.get.side_effect = lambda key, default=None: {
+            "es_bulk_batch_size": 1
+        }.get(key, default)
+        mock_conn.bulk.return_value = {
+            "errors": True,
+            "items": [
+                {
+                    "index": {
+                        "status": 400,
+                        "error": {"type": "mapper_parsing_exception"},
+                    }
+                }
+            ],
+        }
+
+        workflow = Mock()
+        workflow.sqlworkflowcontent.sql_content = """
+        POST /test_index/_doc {"name": "a"}
+        POST /test_index/_doc {"name": "b"}
+        PUT /test_index2 {"settings": {"number_of_shards": 1}}
+        """
+        workflow.db_name = "test_db"
+        result = self.engine.execute_workflow(workflow)
+
+        self.assertIn("mapper_parsing_exception", result.error)
+        self.assertEqual([r.errlevel for r in result.rows], [2, 0, 0])
+        self.assertEqual(result.rows[1].errormessage, "前序语句失败, 未执行")
+        self.assertEqual(result.rows[2].errormessage, "前序语句失败, 未执行")
+        mock_conn.bulk.assert_called_once()
+        mock_conn.indices.create.assert_not_called()
+
+    @patch("sql.engines.elasticsearch.SysConfig")
+    @patch("sql.engines.elasticsearch.Elasticsearch")
+    def test_execute_workflow_bulk_parallel_error(self, mockElasticsearch, _config):
+        """测试并行 _bulk 中某个索引失败后，其他索引停止发送，并按实际执行情况返回"""
+        mock_conn = Mock()
+        mockElasticsearch.return_value = mock_conn
+        _config.return_value.get.side_effect = lambda key, default=None: {
+            "es_bulk_batch_size": 1,
+            "es_bulk_workers": 2,
+        }.get(key, default)
+        index_b_sent = threading.Event()
+
+        def bulk(body):
+            if body[0]["index"]["_index"] == "index_b":
+                index_b_sent.set()
+                return {
+                    "errors": True,
+                    "items": [
+                        {
+                            "index": {
+                                "status": 400,
+                                "error": {"type": "mapper_parsing_exception"},
+                            }
+                        }
+                    ],
+                }
+            # index_a 的第一个批次在 index_b 失败后才返回
+            index_b_sent.wait(5)
+            time.sleep(0.2)
+            return {
+                "errors": False,
+                "items": [{"index": {"status": 201, "_shards": {"successful": 1}}}],
+            }
+
+        mock_conn.bulk.side_effect = bulk
+        workflow = Mock()
+        workflow.sqlworkflowcontent.sql_content = """
+        POST /index_a/_doc {"name": "a1"}
+        POST /index_a/_doc {"name": "a2"}
+        POST /index_b/_doc {"name": "b1"}
+        POST /index_b/_doc {"name": "b2"}
+        """
+        workflow.db_name = "test_db"
+        result = self.engine.execute_workflow(workflow)
+
+        self.assertIn("mapper_parsing_exception", result.error)
+        self.assertEqual([r.id for r in result.rows], [1, 2, 3, 4])
+        self.assertEqual(
+            [r.stagestatus for r in result.rows],
+            [
+                "Execute Successfully",
+                "Audit completed",
+                "Execute Failed",
+                "Audit completed",
+            ],
+        )
+        self.assertEqual(result.rows[1].errormessage, "其他索引的语句执行失败, 未执行")
+        self.assertEqual(result.rows[3].errormessage, "前序语句失败, 未执行")
+        self.assertEqual(mock_conn.bulk.call_count, 2)
+
     @patch("sql.engines.elasticsearch.Elasticsearch")
     def test_execute_workflow_update_by_query_request(self, mockElasticsearch):
         """测试 execute_workflow 方法的 _update_by_query 请求执行"""
@@ -194,6 +194,23 @@ class TestMssql(TestCase):
         call_args = mock_connect.call_args[0][0]
         self.assertIn("DATABASE=test_db", call_args)
 
+    @patch("sql.engines.mssql.pyodbc.connect")
+    def test_reset_connection(self, mock_connect):
+        """归还连接前切换回连接建立时的库"""
+        cursor = mock_connect.return_value.cursor.return_value
+        new_engine = MssqlEngine(instance=self.ins1)
+        conn = new_engine.get_connection(db_name="test_db")
+        new_engine._reset_connection(conn)
+        conn.rollback.assert_called_once()
+        cursor.execute.assert_called_once_with("USE [test_db]")
+        # 未指定库时切换回登录名的默认库
+        cursor.reset_mock()
+        cursor.fetchone.return_value = ("master",)
+        new_engine = MssqlEngine(instance=self.ins1)
+        conn = new_engine.get_connection()
+        new_engine._reset_connection(conn)
+        cursor.execute.assert_called_with("USE [master]")
+
     @patch("sql.engines.mssql.pyodbc.drivers")
     @patch("sql.engines.mssql.pyodbc.connect")
     def test_get_connection_driver_selection(self, mock_connect, mock_drivers):
@@ -2,13 +2,14 @@ from datetime import datetime, timedelta
 from unittest.mock import patch, Mock, ANY
 
 import MySQLdb
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from common.config import SysConfig
 from sql.engines import ResultSet, ReviewSet
 from sql.engines.models import ReviewResult
 from sql.engines.mysql import MysqlEngine
 from sql.models import Instance, SqlWorkflow, SqlWorkflowContent
+from sql.utils.connection_pool import pool_manager
 
 
 class TestMysql(TestCase):
@@ -74,6 +75,49 @@ class TestMysql(TestCase):
         connect.return_value.close.assert_called_once()
         self.assertIsInstance(query_result, ResultSet)
 
+    @override_settings(ENGINE_CONNECTION_POOL={"enabled": True, "max_size": 2})
+    @patch("MySQLdb.connect")
+    def test_query_with_connection_pool(self, connect):
+        cur = Mock()
+        connect.return_value.cursor = cur
+        cur.return_value.fetchall.return_value = ((1,),)
+        cur.return_value.description = (("1", 8),)
+        for _ in range(2):
+            new_engine = MysqlEngine(instance=self.ins1)
+            query_result = new_engine.query(sql="select 1")
+            self.assertEqual(query_result.rows, ((1,),))
+        # 第二次查询复用连接池中的连接
+        connect.assert_called_once()
+        connect.return_value.close.assert_not_called()
+        pool_manager.close_instance(self.ins1.pk)
+        connect.return_value.close.assert_called_once()
+
+    @override_settings(ENGINE_CONNECTION_POOL={"enabled": True, "max_size": 2})
+    @patch("MySQLdb.connect")
+    def test_query_stream(self, connect):
+        cur = Mock()
+        connect.return_value.cursor = cur
+        cur.return_value.fetchmany.side_effect = [((1,), (2,)), ((3,),)]
+        cur.return_value.description = (("1", 8),)
+        new_engine = MysqlEngine(instance=self.ins1)
+        query_result = new_engine.query_stream(
+            sql="select 1", limit_num=3, batch_size=2
+        )
+        cur.assert_called_with(MySQLdb.cursors.SSCursor)
+        self.assertEqual(list(query_result.batches()), [[(1,), (2,)], [(3,)]])
+        self.assertEqual(query_result.affected_rows, 3)
+        # 读取完毕后连接归还到连接池
+        connect.return_value.close.assert_not_called()
+        # 中途退出的连接直接丢弃
+        cur.return_value.fetchmany.side_effect = [((1,), (2,))]
+        query_result = MysqlEngine(instance=self.ins1).query_stream(
+            sql="select 1", batch_size=2
+        )
+        next(query_result.batches())
+        query_result.close()
+        connect.return_value.close.assert_called_once()
+        pool_manager.close_instance(self.ins1.pk)
+
     @patch("MySQLdb.connect")
     def test_get_tables_metas_data(self, connect):
         """增加单元测试方法。test_get_tables_metas_data"""
@@ -87,6 +131,7 @@ class TestMysql(TestCase):
 
         columns_result = [
             {
+                "TABLE_NAME": "test_table",
                 "COLUMN_NAME": "id",
                 "COLUMN_TYPE": "int",
                 "COLUMN_DEFAULT": None,
@@ -96,6 +141,7 @@ class TestMysql(TestCase):
                 "COLUMN_COMMENT": "",
             },
             {
+                "TABLE_NAME": "test_table",
                 "COLUMN_NAME": "name",
                 "COLUMN_TYPE": "varchar(255)",
                 "COLUMN_DEFAULT": None,
@@ -131,6 +177,7 @@ class TestMysql(TestCase):
                 "TABLE_INFO": {"TABLE_SCHEMA": "test_db", "TABLE_NAME": "test_table"},
                 "COLUMNS": [
                     {
+                        "TABLE_NAME": "test_table",
                         "COLUMN_NAME": "id",
                         "COLUMN_TYPE": "int",
                         "COLUMN_DEFAULT": None,
@@ -140,6 +187,7 @@ class TestMysql(TestCase):
                         "COLUMN_COMMENT": "",
                     },
                     {
+                        "TABLE_NAME": "test_table",
                         "COLUMN_NAME": "name",
                         "COLUMN_TYPE": "varchar(255)",
                         "COLUMN_DEFAULT": None,
@@ -153,6 +201,8 @@ class TestMysql(TestCase):
         ]
 
         self.assertEqual(result, expected_result)
+        # 字段信息一次查询获取
+        self.assertEqual(new_engine.query.call_count, 2)
 
     @patch.object(MysqlEngine, "query")
     def testAllDb(self, mock_query):
@@ -182,6 +232,17 @@ class TestMysql(TestCase):
         dbs = new_engine.get_all_columns_by_tb("some_db", "some_tb")
         self.assertEqual(dbs.rows, ["col_1", "col_2"])
 
+    @patch.object(MysqlEngine, "query")
+    def test_get_int_primary_key(self, mock_query):
+        mock_query.return_value = ResultSet(rows=[("id", "bigint")])
+        new_engine = MysqlEngine(instance=self.ins1)
+        self.assertEqual(new_engine.get_int_primary_key("some_db", "some_tb"), "id")
+        # 非整数主键或者联合主键
+        mock_query.return_value = ResultSet(rows=[("code", "varchar")])
+        self.assertIsNone(new_engine.get_int_primary_key("some_db", "some_tb"))
+        mock_query.return_value = ResultSet(rows=[("a", "int"), ("b", "int")])
+        self.assertIsNone(new_engine.get_int_primary_key("some_db", "some_tb"))
+
     @patch.object(MysqlEngine, "query")
     def testDescribe(self, mock_query):
         new_engine = MysqlEngine(instance=self.ins1)
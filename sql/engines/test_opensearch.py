@@ -66,6 +66,46 @@ class TestOpenSearchEngine(unittest.TestCase):
         self.assertEqual(result.rows, expected_rows)
         self.assertEqual(result.column_list, expected_columns)
 
+    @patch("sql.engines.elasticsearch.OpenSearch")
+    def test_query_sql_cursor(self, mockElasticsearch):
+        """SQL语句通过游标翻页，达到 limit_num 后关闭游标"""
+        mock_conn = Mock()
+        mock_conn.transport.perform_request.side_effect = [
+            {"schema": [{"name": "a"}], "datarows": [[1], [2]], "cursor": "c1"},
+            {"datarows": [[3], [4]], "cursor": "c2"},
+            {"succeeded": True},
+        ]
+        mockElasticsearch.return_value = mock_conn
+
+        result = self.engine.query(sql="select a from test_index", limit_num=3)
+        self.assertEqual(result.rows, [[1], [2], [3]])
+        mock_conn.transport.perform_request.assert_called_with(
+            method="POST", url="/_opendistro/_sql/close", body={"cursor": "c2"}
+        )
+
+    @patch("sql.engines.elasticsearch.OpenSearch")
+    def test_query_search_after(self, mockElasticsearch):
+        """超过一页时通过 PIT + search_after 翻页"""
+        mock_conn = Mock()
+        mock_conn.create_point_in_time.return_value = {"pit_id": "pit1"}
+        mock_conn.search.side_effect = [
+            {"hits": {"hits": [{"_id": "1", "_source": {"a": 1}, "sort": [1, "1"]}]}},
+            {"hits": {"hits": []}},
+        ]
+        mockElasticsearch.return_value = mock_conn
+        self.engine.search_page_size = 1
+
+        result = self.engine.query(
+            sql='GET /test_index/_search\n{"sort": [{"a": "asc"}]}', limit_num=10
+        )
+        self.assertEqual(result.rows, [("1", 1)])
+        body = mock_conn.search.call_args.kwargs["body"]
+        self.assertEqual(body["sort"], [{"a": "asc"}, {"_id": "asc"}])
+        self.assertEqual(body["search_after"], [1, "1"])
+        mock_conn.delete_point_in_time.assert_called_once_with(
+            body={"pit_id": ["pit1"]}
+        )
+
     @patch("sql.engines.elasticsearch.OpenSearch")
     def test_security_role(self, mockElasticsearch):
         """测试 _security_role 方法"""
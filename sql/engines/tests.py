@@ -1,20 +1,32 @@
 import json
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
 from unittest.mock import MagicMock, patch, Mock, ANY
 from pytest_mock import MockerFixture
 
+import cx_Oracle
+import numpy as np
 import sqlparse
+from bson.objectid import ObjectId
+from clickhouse_driver.block import ColumnOrientedBlock
+from pymongo.errors import BulkWriteError
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 
 from common.config import SysConfig
 from sql.engines import EngineBase
 from sql.engines.goinception import GoInceptionEngine
-from sql.engines.models import ResultSet, ReviewSet, ReviewResult
+from sql.engines.models import (
+    ResultSet,
+    ReviewSet,
+    ReviewResult,
+    StreamingResultSet,
+    ColumnarRows,
+    ColumnarResultSet,
+)
 from sql.engines.redis import RedisEngine
 from sql.engines.pgsql import PgSQLEngine
 from sql.engines.oracle import OracleEngine
-from sql.engines.mongo import MongoEngine
+from sql.engines.mongo import MongoEngine, format_datetime
 from sql.engines.clickhouse import ClickHouseEngine
 from sql.engines.odps import ODPSEngine
 from sql.models import (
@@ -119,21 +131,21 @@ class TestRedis(TestCase):
     @patch("redis.Redis.execute_command", return_value=[1, 2, 3])
     def test_query_return_list(self, _execute_command):
         new_engine = RedisEngine(instance=self.ins)
-        query_result = new_engine.query(db_name=0, sql="keys *", limit_num=100)
+        query_result = new_engine.query(db_name=0, sql="lrange l 0 -1", limit_num=100)
         self.assertIsInstance(query_result, ResultSet)
         self.assertTupleEqual(query_result.rows, ([1], [2], [3]))
 
     @patch("redis.Redis.execute_command", return_value="text")
     def test_query_return_str(self, _execute_command):
         new_engine = RedisEngine(instance=self.ins)
-        query_result = new_engine.query(db_name=0, sql="keys *", limit_num=100)
+        query_result = new_engine.query(db_name=0, sql="get k", limit_num=100)
         self.assertIsInstance(query_result, ResultSet)
         self.assertTupleEqual(query_result.rows, (["text"],))
 
     @patch("redis.Redis.execute_command", return_value="text")
     def test_query_execute(self, _execute_command):
         new_engine = RedisEngine(instance=self.ins)
-        query_result = new_engine.query(db_name=0, sql="keys *", limit_num=100)
+        query_result = new_engine.query(db_name=0, sql="get k", limit_num=100)
         self.assertIsInstance(query_result, ResultSet)
         self.assertTupleEqual(query_result.rows, (["text"],))
 
@@ -147,7 +159,7 @@ class TestRedis(TestCase):
         }
         _execute_command.return_value = dict_response
         new_engine = RedisEngine(instance=self.ins)
-        query_result = new_engine.query(db_name=0, sql="keys *", limit_num=100)
+        query_result = new_engine.query(db_name=0, sql="hgetall k", limit_num=100)
 
         # 验证结果集
         expected_rows = [
@@ -160,6 +172,54 @@ class TestRedis(TestCase):
         self.assertEqual(query_result.rows, tuple(expected_rows))
         self.assertEqual(query_result.affected_rows, len(expected_rows))
 
+    @patch("redis.Redis.execute_command")
+    @patch("redis.Redis.scan_iter", return_value=iter(["k1", "k2", "k3"]))
+    def test_query_keys_rewrite_to_scan(self, _scan_iter, _execute_command):
+        new_engine = RedisEngine(instance=self.ins)
+        query_result = new_engine.query(db_name=0, sql="keys k*", limit_num=2)
+        self.assertTupleEqual(query_result.rows, (["k1"], ["k2"]))
+        self.assertIsNotNone(query_result.warning)
+        _scan_iter.assert_called_once_with(match="k*", count=1000)
+        _execute_command.assert_not_called()
+
+    @patch("redis.Redis.execute_command", return_value=[0, ["k1"]])
+    def test_query_scan_count_bounded(self, _execute_command):
+        new_engine = RedisEngine(instance=self.ins)
+        query_result = new_engine.query(
+            db_name=0, sql="scan 0 match k* count 1000000", limit_num=100
+        )
+        _execute_command.assert_called_once_with(
+            "scan", "0", "match", "k*", "count", "1000"
+        )
+        self.assertTupleEqual(query_result.rows, ([0], ["k1"]))
+
+    @patch("redis.Redis.pipeline")
+    @patch("redis.Redis.scan")
+    def test_scan_keys(self, _scan, _pipeline):
+        _scan.side_effect = [(12, ["k1"]), (0, ["k2"])]
+        _pipeline.return_value.execute.return_value = [
+            "string",
+            -1,
+            56,
+            "hash",
+            100,
+            Exception("ERR unknown command"),
+        ]
+        new_engine = RedisEngine(instance=self.ins)
+        result = new_engine.scan_keys(db_name=0, match="k*", key_type="string")
+        self.assertEqual(result.cursor, 0)
+        self.assertEqual(result.column_list, ["key", "type", "ttl", "memory"])
+        self.assertEqual(
+            result.rows, [("k1", "string", -1, 56), ("k2", "hash", 100, None)]
+        )
+        _scan.assert_called_with(cursor=12, match="k*", count=1000, _type="string")
+        _pipeline.assert_called_once_with(transaction=False)
+        # 达到一页的数量后返回游标，继续扫描时从游标开始
+        _scan.side_effect = [(34, ["k%s" % i for i in range(100)])]
+        result = new_engine.scan_keys(db_name=0, cursor="12")
+        self.assertEqual(result.cursor, 34)
+        self.assertEqual(len(result.rows), 100)
+
     @patch("redis.Redis.config_get", return_value={"databases": 4})
     def test_get_all_databases(self, _config_get):
         new_engine = RedisEngine(instance=self.ins)
@@ -353,6 +413,47 @@ class TestRedis(TestCase):
         self.assertIsInstance(execute_result, ReviewSet)
         self.assertEqual(execute_result.rows[0].__dict__.keys(), row.__dict__.keys())
 
+    @patch("sql.engines.redis.RedisEngine.get_connection")
+    def test_execute_pipeline(self, _get_connection):
+        pipe = _get_connection.return_value.pipeline.return_value
+        pipe.execute.side_effect = [
+            [True, 1],
+            [True, Exception("WRONGTYPE Operation")],
+        ]
+        split_sql = ["set a 1", "expire a 10", "set b 1", "hset b f 1", "set c 1"]
+        new_engine = RedisEngine(instance=self.ins)
+        execute_result = new_engine.execute_pipeline(
+            db_name=0,
+            sql="\n".join(split_sql),
+            split_sql=split_sql,
+            pipeline_size=2,
+            transaction=True,
+        )
+        _get_connection.return_value.pipeline.assert_called_with(transaction=True)
+        pipe.execute_command.assert_any_call("hset", "b", "f", "1")
+        self.assertEqual(pipe.execute.call_count, 2)
+        self.assertEqual(execute_result.error, "WRONGTYPE Operation")
+        self.assertEqual([row.errlevel for row in execute_result.rows], [0, 0, 0, 2, 0])
+        self.assertEqual([row.id for row in execute_result.rows], [1, 2, 3, 4, 5])
+        self.assertIn("返回：1", execute_result.rows[1].errormessage)
+        self.assertEqual(execute_result.rows[4].stagestatus, "Audit completed")
+
+    @patch("sql.engines.redis.RedisEngine.get_connection")
+    def test_execute_pipeline_parse_error(self, _get_connection):
+        pipe = _get_connection.return_value.pipeline.return_value
+        pipe.execute.return_value = [True]
+        split_sql = ["set a 1", "set b 'x", "set c 1"]
+        new_engine = RedisEngine(instance=self.ins)
+        execute_result = new_engine.execute_pipeline(
+            db_name=0, sql="\n".join(split_sql), split_sql=split_sql
+        )
+        # 无法解析的命令之前的命令正常执行，之后的命令不再执行
+        pipe.execute_command.assert_called_once_with("set", "a", "1")
+        self.assertEqual(
+            [row.stagestatus for row in execute_result.rows],
+            ["Execute Successfully", "Execute Failed", "Audit completed"],
+        )
+
     @patch("sql.engines.redis.RedisEngine.get_connection")
     def test_processlist(self, mock_get_connection):
         """测试 processlist 方法，模拟获取连接并返回客户端列表"""
@@ -756,6 +857,23 @@ class TestPgSQL(TestCase):
         result = new_engine.processlist(command_type="Idle")
         self.assertEqual(result.rows, mock_cursor.fetchall.return_value)
 
+    @patch("psycopg2.connect")
+    def test_query_stream(self, _conn):
+        cursor = _conn.return_value.cursor.return_value
+        cursor.fetchmany.side_effect = [[({"key": "value"}, 1)], [(None, 2)], []]
+        cursor.description = [("json_column", 3802), ("number_column", 23)]
+        new_engine = PgSQLEngine(instance=self.ins)
+        query_result = new_engine.query_stream(
+            db_name="some_dbname", sql="select * from some_table", batch_size=1
+        )
+        self.assertIsInstance(query_result, StreamingResultSet)
+        self.assertEqual(query_result.column_list, ["json_column", "number_column"])
+        self.assertEqual(list(query_result), [('{"key": "value"}', 1), (None, 2)])
+        # 使用命名游标
+        self.assertIn("name", _conn.return_value.cursor.call_args.kwargs)
+        _conn.return_value.commit.assert_called()
+        _conn.return_value.close.assert_called_once()
+
 
 class TestModel(TestCase):
     def setUp(self):
@@ -779,6 +897,71 @@ class TestModel(TestCase):
         brand_new_review_set = ReviewSet()
         self.assertEqual(brand_new_review_set.rows, [])
 
+    def test_streaming_result_set(self):
+        rows = iter([(1,), (2,), (3,)])
+        on_close = Mock()
+        result_set = StreamingResultSet(limit_num=2, batch_size=1)
+        result_set.set_source(lambda size: [next(rows) for _ in range(size)], on_close)
+        self.assertEqual(list(result_set.batches()), [[(1,)], [(2,)]])
+        self.assertEqual(result_set.affected_rows, 2)
+        on_close.assert_called_once_with(True)
+        # 只能遍历一次
+        with self.assertRaises(RuntimeError):
+            list(result_set)
+
+    def test_streaming_result_set_close(self):
+        on_close = Mock()
+        result_set = StreamingResultSet(batch_size=1)
+        result_set.set_source(lambda size: [(1,)], on_close)
+        batches = result_set.batches()
+        next(batches)
+        batches.close()
+        # 中途退出
+        on_close.assert_called_once_with(False)
+
+    def test_streaming_result_set_from_result_set(self):
+        result_set = ResultSet(column_list=["id"], rows=[(1,), (2,), (3,)])
+        stream = StreamingResultSet.from_result_set(result_set, batch_size=2)
+        self.assertEqual(list(stream.batches()), [[(1,), (2,)], [(3,)]])
+        stream = StreamingResultSet.from_result_set(result_set, batch_size=2)
+        self.assertEqual(stream.to_result_set().rows, [(1,), (2,), (3,)])
+
+    def test_columnar_rows(self):
+        rows = ColumnarRows([np.array([1, 2, 3], dtype="int32"), ["a", None, "c"]])
+        rows.chunk_size = 2
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows), [(1, "a"), (2, None), (3, "c")])
+        self.assertEqual(rows[-1], (3, "c"))
+        self.assertIsInstance(rows[1:], ColumnarRows)
+        self.assertEqual(rows[1:].tolist(), [[2, None], [3, "c"]])
+        # 合并时numpy数组按列拼接
+        merged = rows[:1] + ColumnarRows([np.array([4], dtype="int32"), ["d"]])
+        self.assertIsInstance(merged.columns[0], np.ndarray)
+        self.assertEqual(merged.tolist(), [[1, "a"], [4, "d"]])
+        self.assertEqual(
+            rows.map_columns([(1, lambda v: v or "")]).tolist(),
+            [[1, "a"], [2, ""], [3, "c"]],
+        )
+
+    def test_columnar_result_set(self):
+        result_set = ColumnarResultSet(
+            column_list=["id", "name"],
+            columns=[np.array([1, 2], dtype="uint64"), np.array(["a", "b"])],
+        )
+        self.assertEqual(
+            json.loads(result_set.json()),
+            [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}],
+        )
+        self.assertEqual(
+            result_set.to_sep_dict(),
+            {"column_list": ["id", "name"], "rows": [[1, "a"], [2, "b"]]},
+        )
+        stream = StreamingResultSet.from_result_set(result_set, batch_size=1)
+        batches = list(stream.batches())
+        self.assertEqual(len(batches), 2)
+        self.assertIsInstance(batches[0], ColumnarRows)
+        self.assertEqual(stream.affected_rows, 2)
+
 
 class TestGoInception(TestCase):
     def setUp(self):
@@ -1096,6 +1279,117 @@ class TestOracle(TestCase):
         self.assertIsInstance(query_result, ResultSet)
         self.assertListEqual(query_result.rows, [(1,)])
 
+    @patch("cx_Oracle.connect")
+    def test_query_clob_limit(self, _conn):
+        """含 CLOB 字段时同样按 limit_num 取数，不读取整个游标"""
+        cursor = _conn.return_value.cursor.return_value
+        cursor.description = [("C", cx_Oracle.CLOB, None, None, None, None, 1)]
+        cursor.fetchmany.return_value = [("text",)]
+        self.sys_config.set("oracle_lob_preview_length", "10")
+        self.sys_config.get_all_config()
+        new_engine = OracleEngine(instance=self.ins)
+        query_result = new_engine.query(sql="select c from t", limit_num=100)
+        self.assertListEqual(query_result.rows, [("text",)])
+        cursor.fetchmany.assert_called_once_with(100)
+        cursor.fetchall.assert_not_called()
+        self.assertTrue(callable(cursor.outputtypehandler))
+
+    def test_lob_output_type_handler(self):
+        """CLOB 转为 LONG_STRING 获取，超过预览长度时截断"""
+        cursor = Mock(arraysize=100)
+        handler = OracleEngine._lob_output_type_handler(preview_length=3)
+        handler(cursor, "C", cx_Oracle.CLOB, 0, 0, 0)
+        kwargs = cursor.var.call_args.kwargs
+        self.assertEqual(cursor.var.call_args.args, (cx_Oracle.LONG_STRING,))
+        self.assertEqual(kwargs["arraysize"], 100)
+        self.assertEqual(kwargs["outconverter"]("ab"), "ab")
+        self.assertEqual(kwargs["outconverter"]("abcdef"), "abc...(已截断，共6个字符)")
+        # 非 LOB 字段保持默认处理
+        cursor.var.reset_mock()
+        self.assertIsNone(handler(cursor, "N", cx_Oracle.NUMBER, 0, 0, 0))
+        cursor.var.assert_not_called()
+        # 不限制预览长度
+        handler = OracleEngine._lob_output_type_handler()
+        handler(cursor, "C", cx_Oracle.NCLOB, 0, 0, 0)
+        self.assertIsNone(cursor.var.call_args.kwargs["outconverter"])
+
+    def test_tune_cursor(self):
+        """小结果集按 limit_num 一次取完，否则按列宽推算 arraysize"""
+        new_engine = OracleEngine(instance=self.ins)
+        cursor = Mock()
+        tuning = new_engine._tune_cursor(cursor, "select 1 from dual", limit_num=10)
+        self.assertEqual(tuning["round_trips"], 0)
+        self.assertEqual((cursor.arraysize, cursor.prefetchrows), (10, 11))
+        cursor.parse.assert_not_called()
+        # 单行约 1000 字节，每次往返 1MB
+        cursor = Mock()
+        cursor.description = [
+            ("A", cx_Oracle.STRING, 600, 800, None, None, 1),
+            ("B", cx_Oracle.NUMBER, 0, 0, 10, 0, 1),
+            ("C", cx_Oracle.TIMESTAMP, 23, 11, None, None, 1),
+            ("D", cx_Oracle.STRING, 100, 155, None, None, 1),
+        ]
+        tuning = new_engine._tune_cursor(cursor, "select a,b,c,d from t", limit_num=0)
+        cursor.parse.assert_called_once_with("select a,b,c,d from t")
+        self.assertEqual(tuning["round_trips"], 1)
+        self.assertEqual((cursor.arraysize, cursor.prefetchrows), (1048, 1000))
+        # 超过 limit_num 时按 limit_num
+        new_engine._tune_cursor(cursor, "select a,b,c,d from t", limit_num=500)
+        self.assertEqual((cursor.arraysize, cursor.prefetchrows), (500, 501))
+
+    def test_tune_cursor_instance_options(self):
+        """实例级别的取数参数优先"""
+        self.sys_config.set(
+            "oracle_fetch_options",
+            json.dumps(
+                {
+                    "*": {"arraysize": 200},
+                    "some_ins": {"arraysize": 5000, "prefetchrows": 300},
+                }
+            ),
+        )
+        self.sys_config.get_all_config()
+        cursor = Mock()
+        OracleEngine(instance=self.ins)._tune_cursor(cursor, "select 1", limit_num=0)
+        cursor.parse.assert_not_called()
+        self.assertEqual((cursor.arraysize, cursor.prefetchrows), (5000, 300))
+
+    @patch("cx_Oracle.connect")
+    def test_query_fetch_metrics(self, _conn):
+        """查询结果记录取数指标"""
+        cursor = _conn.return_value.cursor.return_value
+        cursor.description = [("A", cx_Oracle.STRING, 2, 8, None, None, 1)]
+        cursor.fetchall.return_value = [("ab",)] * 250
+        self.sys_config.set(
+            "oracle_fetch_options",
+            json.dumps({"some_ins": {"arraysize": 100, "prefetchrows": 100}}),
+        )
+        self.sys_config.get_all_config()
+        new_engine = OracleEngine(instance=self.ins)
+        query_result = new_engine.query(sql="select a from t", limit_num=0)
+        metrics = query_result.fetch_metrics
+        self.assertEqual(metrics["arraysize"], 100)
+        self.assertEqual(metrics["round_trips"], 3)
+        self.assertEqual(metrics["bytes"], 500)
+        self.assertIn("rows_per_second", metrics)
+
+    @patch("cx_Oracle.connect")
+    def test_query_stream(self, _conn):
+        """流式读取按批次取数，遍历结束后记录取数指标并关闭游标"""
+        cursor = _conn.return_value.cursor.return_value
+        cursor.description = [("A", cx_Oracle.STRING, 2, 8, None, None, 1)]
+        cursor.fetchmany.side_effect = [[("ab",), ("cd",)], [("ef",)], []]
+        new_engine = OracleEngine(instance=self.ins)
+        result = new_engine.query_stream(
+            sql="select a from t", batch_size=2, lob_preview_length=0
+        )
+        self.assertIsInstance(result, StreamingResultSet)
+        self.assertEqual(list(result), [("ab",), ("cd",), ("ef",)])
+        self.assertEqual(result.column_list, ["A"])
+        self.assertEqual(result.fetch_metrics["bytes"], 6)
+        cursor.close.assert_called_once()
+        _conn.return_value.close.assert_called_once()
+
     @patch(
         "sql.engines.oracle.OracleEngine.query",
         return_value=ResultSet(rows=[("AUD_SYS",), ("archery",), ("ANONYMOUS",)]),
@@ -1405,13 +1699,80 @@ end;"""
             sql_content=sql,
             review_content=ReviewSet(rows=[review_row]).json(),
         )
+        _conn.return_value.cursor.return_value.fetchmany.return_value = []
         new_engine = OracleEngine(instance=self.ins)
         execute_result = new_engine.execute_workflow(workflow=wf)
+        new_engine.backup_thread.join()
         self.assertIsInstance(execute_result, ReviewSet)
         self.assertEqual(
             execute_result.rows[0].__dict__.keys(), execute_row.__dict__.keys()
         )
 
+    @patch("sql.engines.oracle.OracleEngine.backup")
+    @patch("cx_Oracle.connect")
+    def test_execute_workflow_backup_in_background(self, _conn, _backup):
+        """关闭连接时在后台线程采集回滚语句，采集完成后释放连接"""
+        sql = "update user set id=1"
+        review_row = ReviewResult(
+            id=1,
+            sql=sql,
+            stmt_type="SQL",
+            object_owner="",
+            object_type="",
+            object_name="",
+        )
+        SqlWorkflowContent.objects.filter(workflow=self.wf).update(
+            sql_content=sql, review_content=ReviewSet(rows=[review_row]).json()
+        )
+        wf = SqlWorkflow.objects.get(id=self.wf.id)
+        wf.syntax_type = 2
+        _conn.return_value.cursor.return_value.fetchone.return_value = (
+            "2020-01-01 00:00:00",
+        )
+        new_engine = OracleEngine(instance=self.ins)
+        execute_result = new_engine.execute_workflow(workflow=wf)
+        self.assertEqual(execute_result.rows[0].stagestatus, "Execute Successfully")
+        new_engine.backup_thread.join()
+        _backup.assert_called_once()
+        _conn.return_value.close.assert_called_once()
+        # 不关闭连接时在当前线程中采集
+        _backup.reset_mock()
+        new_engine = OracleEngine(instance=self.ins)
+        new_engine.execute_workflow(workflow=wf, close_conn=False)
+        self.assertIsNone(new_engine.backup_thread)
+        _backup.assert_called_once()
+
+    @patch("sql.engines.oracle.OracleEngine.get_backup_connection")
+    def test_backup(self, _backup_conn):
+        """日志挖掘结果按批次读取，参数化批量写入备份库"""
+        cursor = Mock()
+        cursor.fetchmany.side_effect = [
+            [("insert 1", "delete 1"), ("insert 2", None)],
+            [("update 3", "update 'x'")],
+            [],
+        ]
+        new_engine = OracleEngine(instance=self.ins)
+        new_engine.backup_batch_size = 2
+        self.assertTrue(
+            new_engine.backup(
+                self.wf, cursor, "2020-01-01 00:00:00", "2020-01-01 00:01:00"
+            )
+        )
+        backup_cursor = _backup_conn.return_value.cursor.return_value
+        self.assertEqual(backup_cursor.executemany.call_count, 2)
+        insert_sql, params = backup_cursor.executemany.call_args_list[0].args
+        self.assertIn("values(%s,%s,%s)", insert_sql)
+        self.assertEqual(
+            params,
+            [("insert 1", "delete 1", self.wf.id), ("insert 2", " ", self.wf.id)],
+        )
+        self.assertEqual(
+            backup_cursor.executemany.call_args_list[1].args[1],
+            [("update 3", "update 'x'", self.wf.id)],
+        )
+        cursor.fetchmany.assert_called_with(2)
+        self.assertIn("end_logmnr", cursor.execute.call_args.args[0])
+
     @patch("cx_Oracle.connect.cursor.execute")
     @patch("cx_Oracle.connect.cursor")
     @patch("cx_Oracle.connect", return_value=RuntimeError)
@@ -1661,31 +2022,67 @@ class MongoTest(TestCase):
         flag = self.engine.get_slave()
         self.assertEqual(True, flag)
 
-    @patch("sql.engines.mongo.MongoEngine.get_all_columns_by_tb")
-    def test_parse_tuple(self, mock_get_all_columns_by_tb):
+    @patch("sql.utils.schema_cache.peek_resource")
+    def test_parse_tuple(self, mock_peek_resource):
         cols = ["_id", "title", "tags", "likes"]
-        mock_get_all_columns_by_tb.return_value.rows = cols
+        mock_peek_resource.return_value.rows = cols
+        created = datetime(2020, 7, 16, 8, 0, 0, 123000)
         cursor = [
             {
-                "_id": {"$oid": "5f10162029684728e70045ab"},
+                "_id": ObjectId("5f10162029684728e70045ab"),
                 "title": "MongoDB",
-                "tags": "mongodb",
+                "tags": ["mongodb", "database"],
                 "likes": 100,
-            }
+                "created": created,
+            },
+            {"_id": ObjectId("7f10162029684728e70045ab"), "author": "archery"},
         ]
         rows, columns = self.engine.parse_tuple(cursor, "some_db", "job")
         alldata = json.dumps(
-            cursor[0], ensure_ascii=False, indent=2, separators=(",", ":")
+            {
+                "_id": {"$oid": "5f10162029684728e70045ab"},
+                "title": "MongoDB",
+                "tags": ["mongodb", "database"],
+                "likes": 100,
+                "created": {"$date": "2020-07-16T08:00:00.123Z"},
+            },
+            ensure_ascii=False,
+            indent=2,
+            separators=(",", ":"),
         )
         rerows = (
             alldata,
             "ObjectId('5f10162029684728e70045ab')",
             "MongoDB",
-            "mongodb",
+            "(array) 2 Elements",
             "100",
+            format_datetime(created),
+            "(N/A)",
+        )
+        self.assertEqual(
+            columns,
+            ["mongodballdata", "_id", "title", "tags", "likes", "created", "author"],
         )
-        self.assertEqual(columns, ["mongodballdata", "_id", "title", "tags", "likes"])
         self.assertEqual(rows[0], rerows)
+        self.assertEqual(rows[1][1], "ObjectId('7f10162029684728e70045ab')")
+        self.assertEqual(rows[1][2:6], ("(N/A)",) * 4)
+        self.assertEqual(rows[1][6], "archery")
+        mock_peek_resource.assert_called_once_with(
+            self.ins, "column", db_name="some_db", tb_name="job"
+        )
+
+    @patch("sql.engines.mongo.MongoEngine.get_all_columns_by_tb")
+    @patch("sql.utils.schema_cache.peek_resource")
+    def test_parse_tuple_without_cached_columns(
+        self, mock_peek_resource, mock_get_all_columns_by_tb
+    ):
+        # 字段缓存不存在时不在查询中抽样，按文档中的字段顺序显示
+        mock_peek_resource.return_value = None
+        cursor = [{"_id": 1, "title": "MongoDB"}, {"_id": 2, "likes": 100}]
+        rows, columns = self.engine.parse_tuple(cursor, "some_db", "job")
+        mock_get_all_columns_by_tb.assert_not_called()
+        self.assertEqual(columns, ["mongodballdata", "_id", "title", "likes"])
+        self.assertEqual(rows[1][1:], ("2", "(N/A)", "100"))
 
     @patch("sql.engines.mongo.MongoEngine.get_table_conut")
     @patch("sql.engines.mongo.MongoEngine.get_all_tables")
@@ -1833,19 +2230,96 @@ class MongoTest(TestCase):
         mock_get_master.assert_called_once()
         self.assertEqual(check_result.rows[0].__dict__["stagestatus"], "异常终止")
 
-    def test_fill_query_columns(self):
-        columns = ["_id", "title", "tags", "likes"]
-        cursor = [
-            {
-                "_id": {"$oid": "5f10162029684728e70045ab"},
-                "title": "MongoDB",
-                "text": "archery",
-                "likes": 100,
-            },
-            {"_id": {"$oid": "7f10162029684728e70045ab"}, "author": "archery"},
+    def test_native_statement(self):
+        plan = self.engine.native_statement(
+            """db.getCollection("job").insertMany([{"title":"t1"},{title:'t2'}])"""
+        )
+        self.assertEqual(plan.collection, "job")
+        self.assertEqual(plan.docs, [{"title": "t1"}, {"title": "t2"}])
+        plan = self.engine.native_statement(
+            """db.job.updateMany({"a":1},{"$set":{"b":2}},{upsert:true})"""
+        )
+        self.assertIsNone(plan.docs)
+        self.assertIsNotNone(plan.run)
+        # 链式调用、转义字符、不支持的类型和选项使用mongo shell执行
+        for sql in [
+            """db.job.find().createIndex({"skuId":1},{background:true})""",
+            """db.job.insertOne({"title":"a\\"b"})""",
+            """db.job.insertOne({"created":new Date()})""",
+            """db.job.insertOne({"n":NumberInt(1)})""",
+            """db.job.updateOne({"a":1},{"$set":{"b":2}},{collation:{locale:"fr"}})""",
+            """db.job.aggregate([{"$match":{"a":1}}])""",
+        ]:
+            self.assertIsNone(self.engine.native_statement(sql), sql)
+
+    def test_native_statement_strict(self):
+        # 未加引号的标识符在mongo shell中为变量引用，未指定时区的时间按本地时区解析，均使用mongo shell执行
+        for sql in [
+            """db.job.insertOne({"a":someVar})""",
+            """db.job.insertOne({"a":NaN})""",
+            """db.job.insertOne({"a":undefined })""",
+            """db.job.deleteMany({"a":{"$in":[x, y]}})""",
+            """db.job.insertOne({"created":new Date("2020-01-01 10:00:00")})""",
+            """db.job.insertOne({"created":ISODate("2020-01-01T10:00:00")})""",
+        ]:
+            self.assertIsNone(self.engine.native_statement(sql), sql)
+        plan = self.engine.native_statement(
+            """db.job.insertOne({"a":true ,"b":null,"c":[1, "x"],"d":ISODate("2020-01-01T10:00:00Z")})"""
+        )
+        self.assertEqual(
+            plan.docs,
+            [
+                {
+                    "a": True,
+                    "b": None,
+                    "c": [1, "x"],
+                    "d": datetime(2020, 1, 1, 10, tzinfo=timezone.utc),
+                }
+            ],
+        )
+
+    @patch("sql.engines.mongo.MongoEngine.exec_cmd")
+    @patch("sql.engines.mongo.MongoEngine.get_master")
+    @patch("sql.engines.mongo.MongoEngine.get_connection")
+    def test_execute_native(self, mock_get_connection, mock_get_master, mock_exec_cmd):
+        sql = """db.job.insertOne({"title":"t1"});
+        db.job.insertMany([{"title":"t2"},{"title":"t3"}]);
+        db.job.deleteMany({"title":"t1"});"""
+        collection = mock_get_connection.return_value["some_db"]["job"]
+        collection.delete_many.return_value.deleted_count = 1
+        execute_result = self.engine.execute("some_db", sql)
+        # 连续插入合并为一次bulk_write，不再调用mongo shell
+        collection.bulk_write.assert_called_once()
+        self.assertEqual(len(collection.bulk_write.call_args.args[0]), 3)
+        collection.delete_many.assert_called_once_with({"title": "t1"})
+        mock_get_master.assert_not_called()
+        mock_exec_cmd.assert_not_called()
+        self.assertEqual(
+            [r.affected_rows for r in execute_result.rows],
+            [1, 2, 1],
+        )
+        self.assertEqual([r.id for r in execute_result.rows], [1, 2, 3])
+
+    @patch("sql.engines.mongo.MongoEngine.get_connection")
+    def test_execute_native_bulk_write_error(self, mock_get_connection):
+        sql = """db.job.insertOne({"_id":1});
+        db.job.insertOne({"_id":1});
+        db.job.insertOne({"_id":2});"""
+        collection = mock_get_connection.return_value["some_db"]["job"]
+        collection.bulk_write.side_effect = [
+            BulkWriteError(
+                {"nInserted": 1, "writeErrors": [{"index": 1, "errmsg": "E11000"}]}
+            ),
+            None,
         ]
-        cols = self.engine.fill_query_columns(cursor, columns=columns)
-        self.assertEqual(cols, ["_id", "title", "tags", "likes", "text", "author"])
+        execute_result = self.engine.execute("some_db", sql)
+        # 失败语句之后的语句重新提交执行
+        self.assertEqual(collection.bulk_write.call_count, 2)
+        self.assertEqual(
+            [r.stagestatus for r in execute_result.rows],
+            ["执行结束", "异常终止", "执行结束"],
+        )
+        self.assertIn("E11000", execute_result.error)
 
     @patch("sql.engines.mongo.MongoEngine.get_connection")
     def test_processlist(self, mock_get_connection):
@@ -2089,6 +2563,85 @@ class TestClickHouse(TestCase):
             ],
         )
 
+    @staticmethod
+    def _blocks(*data):
+        """表头块和数据块"""
+        columns_with_types = [("a", "UInt8"), ("b", "String")]
+        yield ColumnOrientedBlock(columns_with_types=columns_with_types)
+        for columns in data:
+            yield ColumnOrientedBlock(
+                columns_with_types=columns_with_types, data=columns
+            )
+
+    @patch.object(ClickHouseEngine, "_execute_blocks")
+    @patch.object(ClickHouseEngine, "get_connection")
+    def test_query_blocks_limit(self, _conn, _blocks):
+        """按数据块读取，达到 limit_num 后断开连接，不再读取剩余数据块"""
+        blocks = self._blocks([[1, 2], ["x", "y"]], [[3, 4], ["z", "w"]], [[5], ["v"]])
+        _blocks.return_value = blocks
+        new_engine = ClickHouseEngine(instance=self.ins1)
+        query_result = new_engine.query(sql="select a, b from t", limit_num=3)
+        self.assertEqual(query_result.column_list, ["a", "b"])
+        self.assertEqual(query_result.column_type, ["UInt8", "String"])
+        self.assertEqual(query_result.rows, [(1, "x"), (2, "y"), (3, "z")])
+        _conn.return_value.client.disconnect.assert_called_once()
+        self.assertEqual(len(list(blocks)), 1)
+        self.assertEqual(_blocks.call_args.kwargs["settings"], {"use_numpy": False})
+
+    @patch.object(ClickHouseEngine, "_execute_blocks")
+    @patch.object(ClickHouseEngine, "get_connection")
+    def test_query_stream(self, _conn, _blocks):
+        """流式读取按数据块组成批次，数据块大小与批次一致"""
+        _blocks.return_value = self._blocks([[1, 2, 3], ["x", "y", "z"]], [[4], ["w"]])
+        new_engine = ClickHouseEngine(instance=self.ins1)
+        result = new_engine.query_stream(sql="select a, b from t", batch_size=2)
+        self.assertEqual(result.column_list, ["a", "b"])
+        self.assertEqual(
+            list(result.batches()), [[(1, "x"), (2, "y")], [(3, "z"), (4, "w")]]
+        )
+        self.assertEqual(
+            _blocks.call_args.kwargs["settings"],
+            {"max_block_size": 2, "use_numpy": False},
+        )
+        # 全部读取完毕，连接正常释放
+        _conn.return_value.client.disconnect.assert_not_called()
+
+    @patch.object(ClickHouseEngine, "_execute_blocks")
+    @patch.object(ClickHouseEngine, "get_connection")
+    def test_query_columnar(self, _conn, _blocks):
+        """按列读取时返回列式结果集，按数据块合并列后截取 limit_num 行"""
+        _blocks.return_value = self._blocks(
+            [np.array([1, 2], dtype="uint8"), np.array(["x", "y"])],
+            [np.array([3, 4], dtype="uint8"), np.array(["z", "w"])],
+        )
+        new_engine = ClickHouseEngine(instance=self.ins1)
+        query_result = new_engine.query(
+            sql="select a, b from t", limit_num=3, columnar=True
+        )
+        self.assertIsInstance(query_result, ColumnarResultSet)
+        self.assertEqual(query_result.affected_rows, 3)
+        self.assertEqual(list(query_result.rows), [(1, "x"), (2, "y"), (3, "z")])
+        self.assertEqual(query_result.to_sep_dict()["rows"][2], [3, "z"])
+
+    @patch.object(ClickHouseEngine, "_execute_blocks")
+    @patch.object(ClickHouseEngine, "get_connection")
+    def test_query_stream_columnar(self, _conn, _blocks):
+        """按列读取时数据块为numpy数组，整列转换为python对象"""
+        _blocks.return_value = self._blocks(
+            [
+                np.array([1, 2], dtype="uint8"),
+                np.array(["2024-01-02T03:04:05", "NaT"], dtype="datetime64[ns]"),
+            ]
+        )
+        new_engine = ClickHouseEngine(instance=self.ins1)
+        result = new_engine.query_stream(
+            sql="select a, b from t", limit_num=1, columnar=True
+        )
+        self.assertEqual(list(result), [(1, datetime(2024, 1, 2, 3, 4, 5))])
+        self.assertTrue(_blocks.call_args.kwargs["settings"]["use_numpy"])
+        # 达到 limit_num 时还有未读取的数据，断开连接
+        _conn.return_value.client.disconnect.assert_called_once()
+
     @patch.object(ClickHouseEngine, "query")
     def testAllDb(self, mock_query):
         db_result = ResultSet()
@@ -2416,14 +2969,28 @@ def test_ssh(db_instance, mocker: MockerFixture):
     db_instance.save()
 
     class FakeTunnel:
+        is_active = True
+
         def get_ssh(self):
             return "remote_host", "remote_password"
 
-    mocker.patch("sql.engines.SSHConnection", return_value=FakeTunnel())
+        def close(self):
+            pass
+
+    mock_ssh = mocker.patch(
+        "sql.utils.ssh_tunnel.SSHConnection", return_value=FakeTunnel()
+    )
     from sql.engines import EngineBase
+    from sql.utils.ssh_tunnel import ssh_tunnel_manager
 
     engine = EngineBase(instance=db_instance)
     remote_host, remote_password, _, _ = engine.remote_instance_conn(
         instance=engine.instance
     )
     assert (remote_host, remote_password) == ("remote_host", "remote_password")
+    # 同一隧道在engine之间共享
+    mock_ssh.assert_called_once()
+    assert ssh_tunnel_manager.stats()["tunnels"][0]["refcount"] == 2
+    del engine
+    assert ssh_tunnel_manager.stats()["tunnels"][0]["refcount"] == 0
+    ssh_tunnel_manager.close()
@@ -8,12 +8,13 @@ import simplejson as json
 from django.conf import settings
 from django.contrib.auth.decorators import permission_required
 from django.http import HttpResponse
-from django.views.decorators.cache import cache_page
 
 from common.utils.extend_json_encoder import ExtendJSONEncoder
 from common.utils.convert import Convert
 from sql.engines import get_engine
 from sql.plugins.schemasync import SchemaSync
+from sql.utils.resource_group import user_instances
+from sql.utils.schema_cache import get_resource
 from sql.utils.sql_utils import filter_db_list
 from .models import Instance, ParamTemplate, ParamHistory
 
@@ -306,7 +307,6 @@ def schemasync(request):
     return HttpResponse(json.dumps(result), content_type="application/json")
 
 
-@cache_page(60 * 5, key_prefix="insRes")
 def instance_resource(request):
     """
     获取实例内的资源信息，database、schema、table、column
@@ -318,6 +318,7 @@ def instance_resource(request):
     db_name = request.GET.get("db_name", "")
     schema_name = request.GET.get("schema_name", "")
     tb_name = request.GET.get("tb_name", "")
+    refresh = request.GET.get("refresh") in ("1", "true")
 
     resource_type = request.GET.get("resource_type")
     if instance_id:
@@ -331,34 +332,31 @@ def instance_resource(request):
     result = {"status": 0, "msg": "ok", "data": []}
 
     try:
-        query_engine = get_engine(instance=instance)
-        db_name = query_engine.escape_string(db_name)
-        schema_name = query_engine.escape_string(schema_name)
-        tb_name = query_engine.escape_string(tb_name)
+        if not (
+            resource_type == "database"
+            or (resource_type in ("schema", "table") and db_name)
+            or (resource_type == "column" and db_name and tb_name)
+        ):
+            raise TypeError("不支持的资源类型或者参数不完整！")
+        resource = get_resource(
+            instance,
+            resource_type,
+            db_name=db_name,
+            schema_name=schema_name,
+            tb_name=tb_name,
+            refresh=refresh,
+        )
         if resource_type == "database":
-            resource = query_engine.get_all_databases()
             resource.rows = filter_db_list(
                 db_list=resource.rows,
-                db_name_regex=query_engine.instance.show_db_name_regex,
+                db_name_regex=instance.show_db_name_regex,
                 is_match_regex=True,
             )
             resource.rows = filter_db_list(
                 db_list=resource.rows,
-                db_name_regex=query_engine.instance.denied_db_name_regex,
+                db_name_regex=instance.denied_db_name_regex,
                 is_match_regex=False,
             )
-        elif resource_type == "schema" and db_name:
-            resource = query_engine.get_all_schemas(db_name=db_name)
-        elif resource_type == "table" and db_name:
-            resource = query_engine.get_all_tables(
-                db_name=db_name, schema_name=schema_name
-            )
-        elif resource_type == "column" and db_name and tb_name:
-            resource = query_engine.get_all_columns_by_tb(
-                db_name=db_name, tb_name=tb_name, schema_name=schema_name
-            )
-        else:
-            raise TypeError("不支持的资源类型或者参数不完整！")
     except Exception as msg:
         result["status"] = 1
         result["msg"] = str(msg)
@@ -386,12 +384,13 @@ def describe(request):
     result = {"status": 0, "msg": "ok", "data": []}
 
     try:
-        query_engine = get_engine(instance=instance)
-        db_name = query_engine.escape_string(db_name)
-        schema_name = query_engine.escape_string(schema_name)
-        tb_name = query_engine.escape_string(tb_name)
-        query_result = query_engine.describe_table(
-            db_name, tb_name, schema_name=schema_name
+        query_result = get_resource(
+            instance,
+            "describe",
+            db_name=db_name,
+            schema_name=schema_name,
+            tb_name=tb_name,
+            refresh=request.POST.get("refresh") in ("1", "true"),
         )
         result["data"] = query_result.__dict__
     except Exception as msg:
@@ -401,3 +400,37 @@ def describe(request):
         result["status"] = 1
         result["msg"] = result["data"]["error"]
     return HttpResponse(json.dumps(result), content_type="application/json")
+
+
+@permission_required("sql.menu_sqlquery", raise_exception=True)
+def redis_keys(request):
+    """Redis按页浏览key，返回key的类型、TTL、内存占用以及下一页的游标"""
+    instance_name = request.GET.get("instance_name")
+    try:
+        instance = user_instances(request.user, db_type=["redis"]).get(
+            instance_name=instance_name
+        )
+    except Instance.DoesNotExist:
+        result = {"status": 1, "msg": "你所在组未关联该实例", "data": []}
+        return HttpResponse(json.dumps(result), content_type="application/json")
+
+    query_engine = get_engine(instance=instance)
+    keys = query_engine.scan_keys(
+        db_name=request.GET.get("db_name") or 0,
+        cursor=request.GET.get("cursor") or 0,
+        match=request.GET.get("match") or None,
+        key_type=request.GET.get("key_type") or None,
+    )
+    if keys.error:
+        result = {"status": 1, "msg": keys.error, "data": []}
+    else:
+        result = {
+            "status": 0,
+            "msg": "ok",
+            "data": {
+                "column_list": keys.column_list,
+                "rows": keys.rows,
+                "cursor": str(keys.cursor),
+            },
+        }
+    return HttpResponse(json.dumps(result), content_type="application/json")
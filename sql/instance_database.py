@@ -11,12 +11,12 @@ import MySQLdb
 import simplejson as json
 from django.contrib.auth.decorators import permission_required
 from django.http import JsonResponse, HttpResponse
-from django_redis import get_redis_connection
 
 from common.utils.extend_json_encoder import ExtendJSONEncoder
 from sql.engines import get_engine, ResultSet
 from sql.models import Instance, InstanceDatabase, Users
 from sql.utils.resource_group import user_instances
+from sql.utils.schema_cache import invalidate_schema_cache
 
 __author__ = "hhyo"
 
@@ -124,10 +124,8 @@ def create(request):
             owner_display=owner_display,
             remark=remark,
         )
-        # 清空实例资源缓存
-        r = get_redis_connection("default")
-        for key in r.scan_iter(match="*insRes*", count=2000):
-            r.delete(key)
+        # 失效实例库列表缓存
+        invalidate_schema_cache(instance.id, db_names=[db_name])
 
     return JsonResponse({"status": 0, "msg": "", "data": []})
 
@@ -1,6 +1,9 @@
 # -*- coding: UTF-8 -*-
+import io
 import logging
+import math
 import os
+import re
 import tempfile
 import csv
 import hashlib
@@ -10,21 +13,51 @@ import xml.etree.ElementTree as ET
 import zipfile
 import sqlparse
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from contextlib import contextmanager
 
 import simplejson as json
-import pandas as pd
+from openpyxl import Workbook
+from django.core.cache import cache
+from django.db import connection as db_connection
 from django.http import JsonResponse, FileResponse
 
 
 from sql.models import SqlWorkflow, AuditEntry
 from sql.engines import EngineBase
-from sql.engines.models import ReviewSet, ReviewResult
+from sql.engines.models import ResultSet, ReviewSet, ReviewResult, ColumnarRows
 from sql.storage import DynamicStorage
 from sql.engines import get_engine
 from common.config import SysConfig
 
 logger = logging.getLogger("default")
 
+# 离线导出时每批次从服务端游标读取的行数
+EXPORT_BATCH_SIZE = 5000
+# Excel 单个sheet最大行数(包含表头)
+EXCEL_MAX_ROWS = 1048576
+# 并行导出时实例并发槽位的过期时间(秒)，防止进程异常退出后槽位无法释放
+EXPORT_SLOT_TIMEOUT = 6 * 3600
+# 导出前行数统计策略
+COUNT_STRATEGIES = ("table_rows", "explain", "probe", "count")
+# 并行导出的分片数上限，主键稀疏时避免切分出大量空分片
+MAX_EXPORT_CHUNKS = 256
+
+# 单表查询语句: SELECT 列 FROM 表 [WHERE 条件]，用于并行导出和按表统计行数
+SINGLE_TABLE_SELECT_RE = re.compile(
+    r"^\s*select\s+(?P<columns>.+?)\s+from\s+"
+    r"(?P<table>[`\"]?[\w$]+[`\"]?(?:\.[`\"]?[\w$]+[`\"]?)?)"
+    r"(?:\s+where\s+(?P<where>.+?))?\s*;?\s*$",
+    re.I | re.S,
+)
+# 按主键范围切分后结果会变化、或者返回行数和表行数无关的语句
+SINGLE_TABLE_EXCLUDED_RE = re.compile(
+    r"\b(join|union|intersect|except|group\s+by|order\s+by|having|limit|offset|fetch"
+    r"|distinct|over|count|sum|avg|min|max|group_concat|string_agg|array_agg)\b"
+    r"|\(\s*select\b",
+    re.I,
+)
+
 
 class OffLineDownLoad(EngineBase):
     """
@@ -45,6 +78,9 @@ class OffLineDownLoad(EngineBase):
             max_execution_time = (
                 int(max_execution_time_str) if max_execution_time_str else 60
             )
+            # 提交时的行数统计可能是估算值，执行时按阈值限制实际读取的行数
+            max_export_rows_str = config.get("max_export_rows", "10000")
+            max_export_rows = int(max_export_rows_str) if max_export_rows_str else 10000
             # 获取前端提交的 SQL 和其他工单信息
             full_sql = workflow.sqlworkflowcontent.sql_content
             full_sql = sqlparse.format(full_sql, strip_comments=True)
@@ -57,25 +93,42 @@ class OffLineDownLoad(EngineBase):
             start_time = time.time()
 
             try:
-                # 执行 SQL 查询
                 storage = DynamicStorage()
-                results = check_engine.query(
-                    db_name=workflow.db_name,
-                    sql=sql,
-                    max_execution_time=max_execution_time * 1000,
+                # 单表查询按主键范围切分并行导出
+                parallel_result = self.execute_parallel_export(
+                    workflow, sql, temp_dir, max_execution_time * 1000, max_export_rows
                 )
-                if results.error:
-                    raise Exception(results.error)
-                if results:
-                    columns = results.column_list
-                    result = results.rows
+                if parallel_result:
+                    file_name, actual_rows = parallel_result
+                else:
+                    # 执行 SQL 查询，通过服务端游标按批次读取，边读取边写入压缩文件
+                    results = check_engine.query_stream(
+                        db_name=workflow.db_name,
+                        sql=sql,
+                        max_execution_time=max_execution_time * 1000,
+                        # 多读取一行用于判断是否超过阈值
+                        limit_num=max_export_rows + 1 if max_export_rows else 0,
+                        batch_size=EXPORT_BATCH_SIZE,
+                        # 导出完整内容，不截断LOB字段
+                        lob_preview_length=0,
+                    )
+                    if results.error:
+                        raise Exception(results.error)
+
+                    # 保存查询结果为 CSV or JSON or XML or XLSX or SQL 文件
+                    get_format_type = workflow.export_format
+                    try:
+                        file_name = save_to_format_file(
+                            get_format_type,
+                            results,
+                            workflow,
+                            results.column_list,
+                            temp_dir,
+                        )
+                    finally:
+                        results.close()
                     actual_rows = results.affected_rows
-
-                # 保存查询结果为 CSV or JSON or XML or XLSX or SQL 文件
-                get_format_type = workflow.export_format
-                file_name = save_to_format_file(
-                    get_format_type, result, workflow, columns, temp_dir
-                )
+                    check_export_rows(actual_rows, max_export_rows)
 
                 # 将导出的文件保存到存储
                 tmp_file = os.path.join(temp_dir, file_name)
@@ -121,6 +174,86 @@ class OffLineDownLoad(EngineBase):
                 # 清理本地文件和临时目录
                 shutil.rmtree(temp_dir)
 
+    def execute_parallel_export(
+        self, workflow, sql, temp_dir, max_execution_time, max_export_rows=0
+    ):
+        """
+        尝试并行导出，语句不满足并行条件时返回 None
+        :return: (压缩文件名, 导出行数)
+        """
+        config = SysConfig()
+        if not config.get("offline_export_parallel"):
+            return None
+        parallel_export = ParallelExport(
+            workflow,
+            sql,
+            config,
+            max_execution_time=max_execution_time,
+            max_export_rows=max_export_rows,
+        )
+        if not parallel_export.plan():
+            return None
+        return parallel_export.export(temp_dir)
+
+    @staticmethod
+    def get_count_strategy(engine):
+        """
+        获取行数统计策略，系统配置 export_count_strategy 可以是策略名，
+        也可以是按实例类型配置的json，如 {"mysql": "explain", "default": "probe"}，
+        未配置时使用引擎默认的策略
+        """
+        config_value = SysConfig().get("export_count_strategy", "")
+        strategy = None
+        if config_value:
+            try:
+                mapping = json.loads(config_value)
+            except ValueError:
+                strategy = config_value.strip()
+            else:
+                if isinstance(mapping, dict):
+                    strategy = mapping.get(engine.instance.db_type) or mapping.get(
+                        "default"
+                    )
+        strategy = strategy or engine.export_count_strategy
+        return strategy if strategy in COUNT_STRATEGIES else "probe"
+
+    @staticmethod
+    def count_rows(engine, db_name, sql, max_export_rows, strategy):
+        """
+        统计导出行数，table_rows、explain 无法统计时使用 probe
+        table_rows: 使用表统计信息中的行数，仅用于单表查询，带条件时只在行数未超过阈值时采用
+        explain: 使用执行计划估算的行数
+        probe: 最多读取 max_export_rows+1 行，超过阈值时行数为 max_export_rows+1
+        count: 使用 COUNT(*) 统计全部行数
+        :return: ResultSet，rows 为 [(行数,)]
+        """
+        sql = sql.rstrip(";")
+        result_set = ResultSet(full_sql=sql)
+        rows = None
+        if strategy == "table_rows":
+            parsed = parse_single_table_select(sql, engine.instance.db_type, db_name)
+            if parsed:
+                rows = engine.get_table_rows(
+                    tb_name=parsed["tb_name"], **parsed["kwargs"]
+                )
+                if rows is not None and parsed["where"] and rows > max_export_rows:
+                    rows = None
+        elif strategy == "explain":
+            rows = engine.estimate_rows(db_name=db_name, sql=sql)
+        elif strategy == "count":
+            return engine.query(db_name=db_name, sql=f"SELECT COUNT(*) FROM ({sql}) t")
+        if rows is not None:
+            result_set.rows = [(rows,)]
+            return result_set
+        probe_result = engine.query(
+            db_name=db_name,
+            sql=engine.get_probe_sql(sql, max_export_rows + 1),
+            limit_num=max_export_rows + 1,
+        )
+        result_set.error = probe_result.error
+        result_set.rows = [(len(probe_result.rows),)]
+        return result_set
+
     def pre_count_check(self, workflow):
         """
         提交工单时进行后端检查，检查行数是否符合阈值 以及 是否允许的查询语句
@@ -134,14 +267,10 @@ class OffLineDownLoad(EngineBase):
         full_sql = sqlparse.format(full_sql, strip_comments=True)
         full_sql = sqlparse.split(full_sql)[0]
         sql = full_sql.strip()
-        count_sql = f"SELECT COUNT(*) FROM ({sql.rstrip(';')}) t"
         clean_sql = sql.strip().lower()
         instance = workflow
         check_result = ReviewSet(full_sql=sql)
         check_result.syntax_type = 3
-        check_engine = get_engine(instance=instance)
-        result_set = check_engine.query(db_name=workflow.db_name, sql=count_sql)
-        actual_rows_check = result_set.rows[0][0]
         max_export_rows_str = config.get("max_export_rows", "10000")
         max_export_rows = int(max_export_rows_str) if max_export_rows_str else 10000
 
@@ -152,35 +281,50 @@ class OffLineDownLoad(EngineBase):
                 errlevel=2,
                 stagestatus="检查未通过！",
                 errormessage=f"违规语句！",
-                affected_rows=actual_rows_check,
-                sql=full_sql,
-            )
-        elif result_set.error:
-            result = ReviewResult(
-                stage="自动审核失败",
-                errlevel=2,
-                stagestatus="检查未通过！",
-                errormessage=result_set.error,
-                affected_rows=actual_rows_check,
-                sql=full_sql,
-            )
-        elif actual_rows_check > max_export_rows:
-            result = ReviewResult(
-                errlevel=2,
-                stagestatus="检查未通过！",
-                errormessage=f"导出数据行数({actual_rows_check})超过阈值({max_export_rows})。",
-                affected_rows=actual_rows_check,
+                affected_rows=0,
                 sql=full_sql,
             )
         else:
-            result = ReviewResult(
-                errlevel=0,
-                stagestatus="行数统计完成",
-                errormessage="None",
-                sql=full_sql,
-                affected_rows=actual_rows_check,
-                execute_time=0,
+            check_engine = get_engine(instance=instance)
+            strategy = self.get_count_strategy(check_engine)
+            result_set = self.count_rows(
+                check_engine,
+                workflow.db_name,
+                sql,
+                max_export_rows,
+                strategy,
             )
+            actual_rows_check = 0 if result_set.error else result_set.rows[0][0]
+            if result_set.error:
+                result = ReviewResult(
+                    stage="自动审核失败",
+                    errlevel=2,
+                    stagestatus="检查未通过！",
+                    errormessage=result_set.error,
+                    affected_rows=actual_rows_check,
+                    sql=full_sql,
+                )
+            elif actual_rows_check > max_export_rows:
+                # probe 只读取到超过阈值的一行
+                rows_desc = (
+                    f">{max_export_rows}" if strategy == "probe" else actual_rows_check
+                )
+                result = ReviewResult(
+                    errlevel=2,
+                    stagestatus="检查未通过！",
+                    errormessage=f"导出数据行数({rows_desc})超过阈值({max_export_rows})。",
+                    affected_rows=actual_rows_check,
+                    sql=full_sql,
+                )
+            else:
+                result = ReviewResult(
+                    errlevel=0,
+                    stagestatus="行数统计完成",
+                    errormessage="None",
+                    sql=full_sql,
+                    affected_rows=actual_rows_check,
+                    execute_time=0,
+                )
         check_result.rows = [result]
         # 统计警告和错误数量
         for r in check_result.rows:
@@ -195,57 +339,396 @@ def save_to_format_file(
     format_type=None, result=None, workflow=None, columns=None, temp_dir=None
 ):
     """
-    保存查询结果为指定格式的文件。
+    保存查询结果为指定格式的文件，数据直接写入压缩文件，不生成未压缩的中间文件。
     :param format_type: 文件格式类型（csv、json、xml、xlsx、sql）
-    :param result: 查询结果
+    :param result: 查询结果，行列表或者可迭代的流式结果集
     :param workflow: 工单实例
     :param columns: 列名
     :param temp_dir: 临时目录路径
     :return: 压缩后的文件名
     """
-    # 生成唯一的文件名（包含工单ID、日期和随机哈希值）
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    hash_value = hashlib.sha256(os.urandom(32)).hexdigest()[:8]  # 使用前8位作为哈希值
-    base_name = f"{workflow.db_name}_{timestamp}_{hash_value}"
-    file_name = f"{base_name}.{format_type}"
-    file_path = os.path.join(temp_dir, file_name)
-    # 将查询结果写入 CSV 文件
-    if format_type == "csv":
-        save_csv(file_path, result, columns)
-    elif format_type == "json":
-        save_json(file_path, result, columns)
-    elif format_type == "xml":
-        save_xml(file_path, result, columns)
-    elif format_type == "xlsx":
-        save_xlsx(file_path, result, columns)
-    elif format_type == "sql":
-        save_sql(file_path, result, columns)
-    else:
+    writer = FORMAT_WRITERS.get(format_type)
+    if writer is None:
         raise ValueError(f"Unsupported format type: {format_type}")
+    base_name = export_base_name(workflow)
+    file_name = f"{base_name}.{format_type}"
 
     zip_file_name = f"{base_name}.zip"
     zip_file_path = os.path.join(temp_dir, zip_file_name)
     with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(file_path, os.path.basename(file_path))
+        # 写入时无法预知文件大小，强制使用zip64以支持超过2G的文件
+        with zipf.open(file_name, "w", force_zip64=True) as f:
+            writer(f, result, columns)
     return zip_file_name
 
 
-def save_csv(file_path, result, columns):
+def parse_single_table_select(sql, db_type, db_name):
     """
-    保存CSV文件，将查询结果写入CSV文件。
-    :param file_path: CSV文件路径
-    :param result: 查询结果
-    :param columns: 列名
+    解析单表查询语句
+    :return: {"columns", "table", "where", "tb_name", "kwargs"}，kwargs 为获取表信息时的库名/模式名参数，
+             不是单表查询时返回 None
+    """
+    sql = sql.strip().rstrip(";").strip()
+    match = SINGLE_TABLE_SELECT_RE.match(sql)
+    if not match or SINGLE_TABLE_EXCLUDED_RE.search(sql):
+        return None
+    table = match.group("table")
+    names = [name.strip('`"') for name in table.split(".")]
+    if len(names) == 2 and db_type == "mysql":
+        kwargs = {"db_name": names[0]}
+    elif len(names) == 2:
+        kwargs = {"db_name": db_name, "schema_name": names[0]}
+    else:
+        kwargs = {"db_name": db_name}
+    return {
+        "columns": match.group("columns"),
+        "table": table,
+        "where": match.group("where"),
+        "tb_name": names[-1],
+        "kwargs": kwargs,
+    }
+
+
+def export_base_name(workflow):
+    """生成唯一的文件名（包含库名、日期和随机哈希值）"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    hash_value = hashlib.sha256(os.urandom(32)).hexdigest()[:8]  # 使用前8位作为哈希值
+    return f"{workflow.db_name}_{timestamp}_{hash_value}"
+
+
+@contextmanager
+def instance_export_slot(instance_id, limit):
     """
-    with open(file_path, "w", newline="", encoding="utf-8") as csv_file:
+    实例级别的导出并发控制，通过缓存占用 limit 个槽位中的一个，多个进程间共享
+    :param instance_id: 实例ID
+    :param limit: 单个实例同时执行的导出分片上限
+    """
+    while True:
+        for i in range(max(int(limit), 1)):
+            key = f"offline_export_slot_{instance_id}_{i}"
+            if cache.add(key, 1, EXPORT_SLOT_TIMEOUT):
+                try:
+                    yield
+                finally:
+                    cache.delete(key)
+                return
+        time.sleep(1)
+
+
+def check_export_rows(rows, max_export_rows):
+    """导出行数超过阈值时终止导出，max_export_rows 为0时不限制"""
+    if max_export_rows and rows > max_export_rows:
+        raise ValueError(f"导出数据行数超过阈值({max_export_rows})，已终止导出。")
+
+
+class ParallelExport:
+    """
+    并行离线导出，仅支持单表、单列整数主键的查询语句。
+    按主键范围切分为多个分片，每个分片使用独立的连接读取并写入单独的文件，
+    最后和 manifest.json 一起打包为一个压缩文件。
+    """
+
+    # 支持的实例类型以及标识符引用符
+    quote_chars = {"mysql": "`", "pgsql": '"'}
+
+    def __init__(self, workflow, sql, config, max_execution_time=0, max_export_rows=0):
+        self.workflow = workflow
+        self.instance = workflow.instance
+        self.db_name = workflow.db_name
+        self.sql = sql.strip().rstrip(";").strip()
+        self.format_type = workflow.export_format
+        self.max_execution_time = max_execution_time
+        # 导出行数上限，0为不限制
+        self.max_export_rows = max_export_rows
+        self.workers = int(config.get("offline_export_workers") or 4)
+        self.instance_concurrency = int(
+            config.get("offline_export_instance_concurrency") or 4
+        )
+        self.chunk_rows = int(config.get("offline_export_chunk_rows") or 500000)
+        self.columns = None
+        self.table = None
+        self.where = None
+        self.primary_key = None
+        self.chunks = []
+
+    def plan(self):
+        """
+        检查是否满足并行导出条件，并按主键范围生成分片
+        :return: 分片列表 [(lower, upper)]，左闭右开，不满足条件时为空
+        """
+        quote = self.quote_chars.get(self.instance.db_type)
+        parsed = parse_single_table_select(
+            self.sql, self.instance.db_type, self.db_name
+        )
+        if quote is None or self.format_type not in FORMAT_WRITERS or not parsed:
+            return []
+        self.columns = parsed["columns"]
+        self.table = parsed["table"]
+        self.where = parsed["where"]
+
+        engine = get_engine(instance=self.instance)
+        primary_key = engine.get_int_primary_key(
+            tb_name=parsed["tb_name"], **parsed["kwargs"]
+        )
+        if not primary_key:
+            return []
+        self.primary_key = f"{quote}{primary_key}{quote}"
+
+        range_sql = (
+            f"SELECT MIN({self.primary_key}), MAX({self.primary_key}) FROM {self.table}"
+        )
+        if self.where:
+            range_sql += f" WHERE {self.where}"
+        result = engine.query(db_name=self.db_name, sql=range_sql)
+        if result.error or not result.rows or result.rows[0][0] is None:
+            return []
+        lower, upper = int(result.rows[0][0]), int(result.rows[0][1])
+        count = min(math.ceil((upper - lower + 1) / self.chunk_rows), MAX_EXPORT_CHUNKS)
+        if count < 2:
+            return []
+        step = math.ceil((upper - lower + 1) / count)
+        self.chunks = [
+            (start, min(start + step, upper + 1))
+            for start in range(lower, upper + 1, step)
+        ]
+        return self.chunks
+
+    def chunk_sql(self, lower, upper):
+        """分片查询语句"""
+        condition = f"{self.primary_key} >= {lower} AND {self.primary_key} < {upper}"
+        where = f"({self.where}) AND {condition}" if self.where else condition
+        return f"SELECT {self.columns} FROM {self.table} WHERE {where}"
+
+    def export_chunk(self, index, lower, upper, temp_dir, base_name):
+        """
+        导出单个分片到单独的文件，返回分片信息
+        引擎在获取到实例导出槽位后才创建，同时持有的连接、隧道不超过实例并发数
+        """
+        file_name = f"{base_name}_part{index:05d}.{self.format_type}"
+        try:
+            with instance_export_slot(self.instance.id, self.instance_concurrency):
+                start_time = time.time()
+                engine = get_engine(instance=self.instance)
+                results = engine.query_stream(
+                    db_name=self.db_name,
+                    sql=self.chunk_sql(lower, upper),
+                    max_execution_time=self.max_execution_time,
+                    limit_num=self.max_export_rows + 1 if self.max_export_rows else 0,
+                    batch_size=EXPORT_BATCH_SIZE,
+                    lob_preview_length=0,
+                )
+                if results.error:
+                    raise Exception(results.error)
+                try:
+                    with open(os.path.join(temp_dir, file_name), "wb") as f:
+                        FORMAT_WRITERS[self.format_type](
+                            f, results, results.column_list
+                        )
+                finally:
+                    results.close()
+                check_export_rows(results.affected_rows, self.max_export_rows)
+        finally:
+            # get_engine 在分片线程中访问了ORM，关闭线程的数据库连接
+            db_connection.close()
+        return {
+            "file": file_name,
+            "lower": lower,
+            "upper": upper,
+            "rows": results.affected_rows,
+            "execute_time": round(time.time() - start_time, 3),
+        }
+
+    def export(self, temp_dir):
+        """
+        并行导出全部分片，打包为一个压缩文件
+        :return: (压缩文件名, 导出行数)
+        """
+        base_name = export_base_name(self.workflow)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(
+                    self.export_chunk, index, lower, upper, temp_dir, base_name
+                )
+                for index, (lower, upper) in enumerate(self.chunks, start=1)
+            ]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                if future.exception():
+                    raise future.exception()
+            parts = [future.result() for future in futures]
+
+        total_rows = sum(part["rows"] for part in parts)
+        check_export_rows(total_rows, self.max_export_rows)
+        manifest = {
+            "workflow_id": self.workflow.id,
+            "instance_name": self.instance.instance_name,
+            "db_name": self.db_name,
+            "sql": self.sql,
+            "format": self.format_type,
+            "primary_key": self.primary_key,
+            "total_rows": total_rows,
+            "chunks": parts,
+        }
+        zip_file_name = f"{base_name}.zip"
+        zip_file_path = os.path.join(temp_dir, zip_file_name)
+        with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+            for part in parts:
+                part_path = os.path.join(temp_dir, part["file"])
+                zipf.write(part_path, part["file"])
+                os.remove(part_path)
+            zipf.writestr(
+                "manifest.json", json.dumps(manifest, indent=2, ensure_ascii=False)
+            )
+        return zip_file_name, total_rows
+
+
+@contextmanager
+def text_stream(fileobj, newline=None):
+    """将二进制文件对象包装为utf-8文本流，结束后不关闭原文件对象"""
+    stream = io.TextIOWrapper(fileobj, encoding="utf-8", newline=newline)
+    try:
+        yield stream
+    finally:
+        stream.flush()
+        stream.detach()
+
+
+def export_rows(result, convert=None):
+    """
+    逐行返回导出的数据，convert 为单个值的转换函数，
+    列式批次(ColumnarRows)按列调用转换函数并整列转换为python对象，之后再组合成行
+    """
+    batches = result.batches() if hasattr(result, "batches") else [result]
+    for batch in batches:
+        if isinstance(batch, ColumnarRows):
+            if convert:
+                batch = batch.map_columns(
+                    (index, convert) for index in range(len(batch.columns))
+                )
+            yield from batch
+        elif convert:
+            for row in batch:
+                yield [convert(value) for value in row]
+        else:
+            yield from batch
+
+
+def csv_value(value):
+    return "null" if value is None else value
+
+
+def xlsx_value(value):
+    return str(value) if value is not None and value != "NULL" else ""
+
+
+def write_csv(fileobj, result, columns):
+    """逐行写入CSV"""
+    with text_stream(fileobj, newline="") as csv_file:
         csv_writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL)
 
         if columns:
             csv_writer.writerow(columns)
 
-        for row in result:
-            csv_row = ["null" if value is None else value for value in row]
-            csv_writer.writerow(csv_row)
+        csv_writer.writerows(export_rows(result, csv_value))
+
+
+def write_json(fileobj, result, columns):
+    """逐行写入JSON数组，格式和 json.dump(indent=2) 一致"""
+    with text_stream(fileobj) as json_file:
+        json_file.write("[")
+        row_id = -1
+        for row_id, row in enumerate(export_rows(result)):
+            item = json.dumps(dict(zip(columns, row)), indent=2, ensure_ascii=False)
+            json_file.write("\n" if row_id == 0 else ",\n")
+            json_file.write("  " + item.replace("\n", "\n  "))
+        json_file.write("]" if row_id == -1 else "\n]")
+
+
+def write_xml(fileobj, result, columns):
+    """逐行写入XML，每行单独构建元素后序列化，不在内存中保留整棵树"""
+    with text_stream(fileobj) as xml_file:
+        xml_file.write("<?xml version='1.0' encoding='utf-8'?>\n<tabledata>")
+
+        # Create fields element
+        fields_elem = ET.Element("fields")
+        for column in columns:
+            field_elem = ET.SubElement(fields_elem, "field")
+            field_elem.text = column
+        xml_file.write(ET.tostring(fields_elem, encoding="unicode"))
+
+        # Create data element
+        xml_file.write("<data>")
+        for row_id, row in enumerate(export_rows(result), start=1):
+            row_elem = ET.Element("row", id=str(row_id))
+            for col_idx, value in enumerate(row, start=1):
+                col_elem = ET.SubElement(row_elem, f"column-{col_idx}")
+                if value is None:
+                    col_elem.text = "(null)"
+                elif isinstance(value, (datetime.date, datetime.datetime)):
+                    col_elem.text = value.isoformat()
+                else:
+                    col_elem.text = str(value)
+            xml_file.write(ET.tostring(row_elem, encoding="unicode"))
+        xml_file.write("</data></tabledata>")
+
+
+def write_xlsx(fileobj, result, columns):
+    """使用 openpyxl write_only 模式逐行写入Excel"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    worksheet.append(columns)
+    for row_id, row in enumerate(export_rows(result, xlsx_value), start=1):
+        if row_id >= EXCEL_MAX_ROWS:
+            raise ValueError(f"Excel最大支持行数为{EXCEL_MAX_ROWS},已超出!")
+        worksheet.append(row)
+    workbook.save(fileobj)
+
+
+def write_sql(fileobj, result, columns):
+    """逐行写入INSERT语句"""
+    with text_stream(fileobj) as sql_file:
+        for row in export_rows(result):
+            table_name = "your_table_name"
+            if columns:
+                sql_file.write(
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+                )
+
+            values = ", ".join(
+                [
+                    (
+                        "'{}'".format(str(value).replace("'", "''"))
+                        if isinstance(value, str)
+                        or isinstance(value, datetime.date)
+                        or isinstance(value, datetime.datetime)
+                        else "NULL" if value is None or value == "" else str(value)
+                    )
+                    for value in row
+                ]
+            )
+            sql_file.write(f"({values});\n")
+
+
+FORMAT_WRITERS = {
+    "csv": write_csv,
+    "json": write_json,
+    "xml": write_xml,
+    "xlsx": write_xlsx,
+    "sql": write_sql,
+}
+
+
+def save_csv(file_path, result, columns):
+    """
+    保存CSV文件，将查询结果写入CSV文件。
+    :param file_path: CSV文件路径
+    :param result: 查询结果
+    :param columns: 列名
+    """
+    with open(file_path, "wb") as f:
+        write_csv(f, result, columns)
 
 
 def save_json(file_path, result, columns):
@@ -255,13 +738,8 @@ def save_json(file_path, result, columns):
     :param result: 查询结果
     :param columns: 列名
     """
-    with open(file_path, "w", encoding="utf-8") as json_file:
-        json.dump(
-            [dict(zip(columns, row)) for row in result],
-            json_file,
-            indent=2,
-            ensure_ascii=False,
-        )
+    with open(file_path, "wb") as f:
+        write_json(f, result, columns)
 
 
 def save_xml(file_path, result, columns):
@@ -271,29 +749,8 @@ def save_xml(file_path, result, columns):
     :param result: 查询结果
     :param columns: 列名
     """
-    root = ET.Element("tabledata")
-
-    # Create fields element
-    fields_elem = ET.SubElement(root, "fields")
-    for column in columns:
-        field_elem = ET.SubElement(fields_elem, "field")
-        field_elem.text = column
-
-    # Create data element
-    data_elem = ET.SubElement(root, "data")
-    for row_id, row in enumerate(result, start=1):
-        row_elem = ET.SubElement(data_elem, "row", id=str(row_id))
-        for col_idx, value in enumerate(row, start=1):
-            col_elem = ET.SubElement(row_elem, f"column-{col_idx}")
-            if value is None:
-                col_elem.text = "(null)"
-            elif isinstance(value, (datetime.date, datetime.datetime)):
-                col_elem.text = value.isoformat()
-            else:
-                col_elem.text = str(value)
-
-    tree = ET.ElementTree(root)
-    tree.write(file_path, encoding="utf-8", xml_declaration=True)
+    with open(file_path, "wb") as f:
+        write_xml(f, result, columns)
 
 
 def save_xlsx(file_path, result, columns):
@@ -303,20 +760,8 @@ def save_xlsx(file_path, result, columns):
     :param result: 查询结果
     :param columns: 列名
     """
-    try:
-        df = pd.DataFrame(
-            [
-                [
-                    str(value) if value is not None and value != "NULL" else ""
-                    for value in row
-                ]
-                for row in result
-            ],
-            columns=columns,
-        )
-        df.to_excel(file_path, index=False, header=True)
-    except ValueError as e:
-        raise ValueError(f"Excel最大支持行数为1048576,已超出!")
+    with open(file_path, "wb") as f:
+        write_xlsx(f, result, columns)
 
 
 def save_sql(file_path, result, columns):
@@ -326,27 +771,8 @@ def save_sql(file_path, result, columns):
     :param result: 查询结果
     :param columns: 列名
     """
-    with open(file_path, "w") as sql_file:
-        for row in result:
-            table_name = "your_table_name"
-            if columns:
-                sql_file.write(
-                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
-                )
-
-            values = ", ".join(
-                [
-                    (
-                        "'{}'".format(str(value).replace("'", "''"))
-                        if isinstance(value, str)
-                        or isinstance(value, datetime.date)
-                        or isinstance(value, datetime.datetime)
-                        else "NULL" if value is None or value == "" else str(value)
-                    )
-                    for value in row
-                ]
-            )
-            sql_file.write(f"({values});\n")
+    with open(file_path, "wb") as f:
+        write_sql(f, result, columns)
 
 
 class StorageFileResponse(FileResponse):
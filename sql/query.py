@@ -9,7 +9,7 @@ import simplejson as json
 from django.contrib.auth.decorators import permission_required
 from django.db import connection, close_old_connections
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from common.config import SysConfig
 from common.utils.extend_json_encoder import ExtendJSONEncoder, ExtendJSONEncoderFTime
 from common.utils.openai import OpenaiClient, check_openai_config
@@ -19,9 +19,13 @@ from sql.utils.resource_group import user_instances
 from sql.utils.tasks import add_kill_conn_schedule, del_schedule
 from .models import QueryLog, Instance
 from sql.engines import get_engine
+from sql.engines.models import ResultSet
 
 logger = logging.getLogger("default")
 
+# 流式返回时每批次读取的行数
+QUERY_STREAM_BATCH_SIZE = 1000
+
 
 @permission_required("sql.query_submit", raise_exception=True)
 def query(request):
@@ -36,6 +40,8 @@ def query(request):
     tb_name = request.POST.get("tb_name")
     limit_num = int(request.POST.get("limit_num", 0))
     schema_name = request.POST.get("schema_name", None)
+    # 流式返回格式 json/ndjson，为空时一次性返回
+    stream_format = request.POST.get("stream", "")
     user = request.user
 
     result = {"status": 0, "msg": "ok", "data": {}}
@@ -97,6 +103,22 @@ def query(request):
                 seconds=max_execution_time
             )
             add_kill_conn_schedule(schedule_name, run_date, instance.id, thread_id)
+        if stream_format in ("json", "ndjson"):
+            return _stream_query(
+                query_engine,
+                stream_format=stream_format,
+                user=user,
+                instance=instance,
+                db_name=db_name,
+                sql_content=sql_content,
+                limit_num=limit_num,
+                priv_check=priv_check,
+                schema_name=schema_name,
+                tb_name=tb_name,
+                max_execution_time=max_execution_time,
+                schedule_name=schedule_name if thread_id else None,
+                config=config,
+            )
         with FuncTimer() as t:
             # 获取主从延迟信息
             seconds_behind_master = query_engine.seconds_behind_master
@@ -209,6 +231,205 @@ def query(request):
         )
 
 
+def _dumps(obj):
+    try:
+        return json.dumps(
+            obj, use_decimal=False, cls=ExtendJSONEncoderFTime, bigint_as_string=True
+        )
+    # 虽然能正常返回，但是依然会乱码
+    except UnicodeDecodeError:
+        return json.dumps(obj, default=str, bigint_as_string=True, encoding="latin1")
+
+
+class QueryStreamEncoder:
+    """
+    流式查询结果编码，保持和普通查询一致的json结构，
+    data.rows 按批次输出，status、msg 以及统计信息在最后输出，便于中途出错时返回错误
+    """
+
+    content_type = "application/json"
+
+    def __init__(self):
+        self._first_row = True
+
+    def header(self, data):
+        # 去掉结尾的 }，继续输出 rows
+        return f'{{"data": {_dumps(data)[:-1]}, "rows": ['
+
+    def rows(self, rows):
+        if not rows:
+            return ""
+        chunk = _dumps(rows)[1:-1]
+        if self._first_row:
+            self._first_row = False
+            return chunk
+        return f", {chunk}"
+
+    def trailer(self, data, status, msg):
+        # 去掉开头的 {，接在 rows 之后
+        return (
+            f"], {_dumps(data)[1:]}, "
+            f'"status": {_dumps(status)}, "msg": {_dumps(msg)}}}'
+        )
+
+
+class QueryStreamNdjsonEncoder:
+    """
+    流式查询结果编码，每行一个json，
+    第一行为列信息对象，中间每行为一行数据(数组)，最后一行为包含 status、msg 以及统计信息的对象
+    """
+
+    content_type = "application/x-ndjson"
+
+    def header(self, data):
+        return _dumps(data) + "\n"
+
+    def rows(self, rows):
+        return "".join(_dumps(row) + "\n" for row in rows)
+
+    def trailer(self, data, status, msg):
+        return _dumps({**data, "status": status, "msg": msg}) + "\n"
+
+
+def _stream_query(
+    query_engine,
+    stream_format,
+    user,
+    instance,
+    db_name,
+    sql_content,
+    limit_num,
+    priv_check,
+    schema_name,
+    tb_name,
+    max_execution_time,
+    schedule_name,
+    config,
+):
+    """
+    流式执行查询并返回 StreamingHttpResponse，
+    结果通过服务端游标按批次读取、脱敏、输出，内存占用和结果集大小无关
+    """
+    encoder = (
+        QueryStreamNdjsonEncoder()
+        if stream_format == "ndjson"
+        else QueryStreamEncoder()
+    )
+    data_masking = config.get("data_masking")
+    query_check = config.get("query_check")
+
+    def generate():
+        status, msg = 0, "ok"
+        is_masked, mask_rule_hit, mask_time = False, False, 0
+        query_result = None
+        header_sent = False
+        with FuncTimer() as timer:
+            try:
+                # 获取主从延迟信息
+                seconds_behind_master = query_engine.seconds_behind_master
+                query_result = query_engine.query_stream(
+                    db_name,
+                    sql_content,
+                    limit_num,
+                    schema_name=schema_name,
+                    tb_name=tb_name,
+                    max_execution_time=max_execution_time * 1000,
+                    batch_size=QUERY_STREAM_BATCH_SIZE,
+                )
+                if query_result.error:
+                    status, msg = 1, query_result.error
+                yield encoder.header(
+                    {
+                        "full_sql": query_result.full_sql,
+                        "column_list": query_result.column_list,
+                        "column_type": query_result.column_type,
+                        "seconds_behind_master": seconds_behind_master,
+                    }
+                )
+                header_sent = True
+                for batch in query_result.batches():
+                    # 数据脱敏，按批次进行，并且按照query_check配置是否返回
+                    if data_masking:
+                        batch_result = ResultSet(
+                            full_sql=query_result.full_sql,
+                            rows=batch,
+                            column_list=query_result.column_list,
+                            column_type=query_result.column_type,
+                        )
+                        try:
+                            with FuncTimer() as t:
+                                masking_result = query_engine.query_masking(
+                                    db_name, sql_content, batch_result
+                                )
+                            mask_time += t.cost
+                            masking_error = masking_result.error
+                        except Exception as e:
+                            logger.error(traceback.format_exc())
+                            masking_error = f"请联系管理员，错误信息：{e}"
+                        if masking_error:
+                            # 开启query_check，直接返回异常，禁止继续输出
+                            if query_check:
+                                status, msg = 1, f"数据脱敏异常：{masking_error}"
+                                break
+                            # 关闭query_check，忽略错误信息，返回未脱敏数据
+                            logger.warning(
+                                f"数据脱敏异常，按照配置放行，查询语句：{sql_content}，错误信息：{masking_error}"
+                            )
+                        else:
+                            batch = masking_result.rows
+                            is_masked = is_masked or masking_result.is_masked
+                            mask_rule_hit = (
+                                mask_rule_hit or masking_result.mask_rule_hit
+                            )
+                    yield encoder.rows(batch)
+            except Exception as e:
+                logger.error(
+                    f"查询异常报错，查询语句：{sql_content}\n，错误信息：{traceback.format_exc()}"
+                )
+                status, msg = 1, f"查询异常报错，错误信息：{e}"
+            finally:
+                if query_result is not None:
+                    query_result.close()
+                # 返回查询结果后删除schedule
+                if schedule_name:
+                    del_schedule(schedule_name)
+
+        if not header_sent:
+            yield encoder.header(
+                {"full_sql": sql_content, "column_list": [], "column_type": []}
+            )
+        affected_rows = query_result.affected_rows if query_result else 0
+        trailer = {
+            "affected_rows": affected_rows,
+            "query_time": timer.cost,
+            "mask_time": mask_time,
+            "is_masked": is_masked,
+            "mask_rule_hit": mask_rule_hit,
+            "error": msg if status else None,
+        }
+        try:
+            # 防止查询超时
+            if connection.connection and not connection.is_usable():
+                close_old_connections()
+            QueryLog(
+                username=user.username,
+                user_display=user.display,
+                db_name=db_name,
+                instance_name=instance.instance_name,
+                sqllog=sql_content,
+                effect_row=0 if status else affected_rows,
+                cost_time=timer.cost,
+                priv_check=priv_check,
+                hit_rule=mask_rule_hit,
+                masking=is_masked,
+            ).save()
+        except Exception:
+            logger.error(f"查询日志保存失败，错误信息：{traceback.format_exc()}")
+        yield encoder.trailer(trailer, status, msg)
+
+    return StreamingHttpResponse(generate(), content_type=encoder.content_type)
+
+
 @permission_required("sql.menu_sqlquery", raise_exception=True)
 def querylog(request):
     return _querylog(request)
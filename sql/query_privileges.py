@@ -13,6 +13,7 @@ import traceback
 
 import simplejson as json
 from django.contrib.auth.decorators import permission_required
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models import Q
 from django.http import HttpResponse, HttpResponseRedirect
@@ -29,11 +30,15 @@ from sql.notify import notify_for_audit
 from sql.utils.resource_group import user_groups, user_instances
 from sql.utils.workflow_audit import Audit, AuditException, get_auditor
 from sql.utils.sql_utils import extract_tables
+from sql.utils.query_tree_cache import table_ref_cache
 
 logger = logging.getLogger("default")
 
 __author__ = "hhyo"
 
+# 用户查询权限快照缓存时间（秒）
+PRIV_SNAPSHOT_TTL = 3600
+
 
 # TODO 权限校验内的语法解析和判断独立到每个engine内
 def query_priv_check(user, instance, db_name, sql_content, limit_num):
@@ -466,17 +471,70 @@ def query_priv_audit(request):
 
 def _table_ref(sql_content, instance, db_name):
     """
-    解析语法树，获取语句涉及的表，用于查询权限限制
+    解析语法树，获取语句涉及的表，用于查询权限限制，相同指纹的语句直接使用缓存
     :param sql_content:
     :param instance:
     :param db_name:
     :return:
     """
+    table_ref = table_ref_cache.get(instance, db_name, sql_content)
+    if table_ref is not None:
+        return table_ref
     engine = GoInceptionEngine()
     query_tree = engine.query_print(
         instance=instance, db_name=db_name, sql=sql_content
     ).get("query_tree")
-    return engine.get_table_ref(json.loads(query_tree), db_name=db_name)
+    table_ref = engine.get_table_ref(json.loads(query_tree), db_name=db_name)
+    table_ref_cache.set(instance, db_name, sql_content, table_ref)
+    return table_ref
+
+
+def _priv_snapshot_key(user_name, instance_id):
+    return f"query_privileges:{instance_id}:{user_name}"
+
+
+def _user_priv_snapshot(user, instance):
+    """
+    获取用户在实例上的有效查询权限快照，一次查询加载全部权限并缓存
+    权限新增、变更、删除时清除缓存，权限按天过期，缓存最晚在当天结束时失效
+    :return: {"db": {db_name: (privilege_id, limit_num)}, "tb": {(db_name, tb_name): (privilege_id, limit_num)}}
+    """
+    key = _priv_snapshot_key(user.username, instance.id)
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+    snapshot = {"db": {}, "tb": {}}
+    user_privileges = (
+        QueryPrivileges.objects.filter(
+            user_name=user.username,
+            instance=instance,
+            valid_date__gte=datetime.datetime.now(),
+            is_deleted=0,
+            priv_type__in=[1, 2],
+        )
+        .order_by("privilege_id")
+        .values_list("privilege_id", "db_name", "table_name", "limit_num", "priv_type")
+    )
+    # 库表名按小写匹配，和MySQL默认排序规则下的查询结果保持一致，同一个库表保留最早的权限
+    for privilege_id, db_name, table_name, limit_num, priv_type in user_privileges:
+        if priv_type == 1:
+            snapshot["db"].setdefault(db_name.lower(), (privilege_id, limit_num))
+        else:
+            snapshot["tb"].setdefault(
+                (db_name.lower(), table_name.lower()), (privilege_id, limit_num)
+            )
+    now = datetime.datetime.now()
+    tomorrow = datetime.datetime.combine(
+        now.date() + datetime.timedelta(days=1), datetime.time.min
+    )
+    timeout = min(PRIV_SNAPSHOT_TTL, int((tomorrow - now).total_seconds()) + 1)
+    cache.set(key, snapshot, timeout=timeout)
+    return snapshot
+
+
+def clear_priv_snapshot(user_name, instance_id):
+    """清除用户查询权限快照缓存"""
+    cache.delete(_priv_snapshot_key(user_name, instance_id))
 
 
 def _db_priv(user, instance, db_name):
@@ -491,16 +549,12 @@ def _db_priv(user, instance, db_name):
     if user.is_superuser:
         return int(SysConfig().get("admin_query_limit", 5000))
     # 获取用户库权限
-    user_privileges = QueryPrivileges.objects.filter(
-        user_name=user.username,
-        instance=instance,
-        db_name__in=[str(db_name), str("*")],
-        valid_date__gte=datetime.datetime.now(),
-        is_deleted=0,
-        priv_type=1,
-    )
-    if user_privileges.exists():
-        return user_privileges.first().limit_num
+    db_privs = _user_priv_snapshot(user, instance)["db"]
+    user_privileges = [
+        db_privs[name] for name in {str(db_name).lower(), "*"} if name in db_privs
+    ]
+    if user_privileges:
+        return min(user_privileges)[1]
     return False
 
 
@@ -513,21 +567,14 @@ def _tb_priv(user, instance, db_name, tb_name):
     :param tb_name: 表名
     :return: 权限存在则返回对应权限的limit_num，否则返回False
     """
-    # 获取用户表权限
-    user_privileges = QueryPrivileges.objects.filter(
-        user_name=user.username,
-        instance=instance,
-        db_name=str(db_name),
-        table_name=str(tb_name),
-        valid_date__gte=datetime.datetime.now(),
-        is_deleted=0,
-        priv_type=2,
-    )
     if user.is_superuser:
         return int(SysConfig().get("admin_query_limit", 5000))
-    else:
-        if user_privileges.exists():
-            return user_privileges.first().limit_num
+    # 获取用户表权限
+    user_privilege = _user_priv_snapshot(user, instance)["tb"].get(
+        (str(db_name).lower(), str(tb_name).lower())
+    )
+    if user_privilege:
+        return user_privilege[1]
     return False
 
 
@@ -601,3 +648,5 @@ def _query_apply_audit_call_back(apply_id, workflow_status):
                 for table_name in apply_queryset.table_list.split(",")
             ]
         QueryPrivileges.objects.bulk_create(insert_list)
+        # bulk_create不会触发post_save，手动清除权限快照
+        clear_priv_snapshot(apply_queryset.user_name, apply_queryset.instance_id)
@@ -0,0 +1,29 @@
+# -*- coding: UTF-8 -*-
+"""
+模型信号处理，在 SqlConfig.ready 中注册，保证无论通过页面、admin还是API修改数据都会触发
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from sql.models import Instance, QueryPrivileges
+from sql.utils.connection_pool import pool_manager
+
+
+@receiver(post_save, sender=Instance)
+@receiver(post_delete, sender=Instance)
+def instance_changed(sender, instance, **kwargs):
+    """实例修改或删除后关闭本进程中该实例的连接池，避免继续使用旧的连接信息"""
+    instance_id = instance.pk
+    transaction.on_commit(lambda: pool_manager.close_instance(instance_id))
+
+
+@receiver(post_save, sender=QueryPrivileges)
+@receiver(post_delete, sender=QueryPrivileges)
+def query_privileges_changed(sender, instance, **kwargs):
+    """查询权限新增、变更、删除后清除用户的查询权限快照"""
+    # 视图模块依赖较多，处理信号时再导入
+    from sql.query_privileges import clear_priv_snapshot
+
+    clear_priv_snapshot(instance.user_name, instance.instance_id)
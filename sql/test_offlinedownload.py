@@ -3,6 +3,7 @@ from django.test import TestCase, Client
 from django.conf import settings
 from django.http import HttpRequest
 from datetime import datetime, date
+import itertools
 import tempfile
 import os
 import shutil
@@ -15,6 +16,8 @@ import xml.etree.ElementTree as ET
 from sql.models import SqlWorkflow, SqlWorkflowContent, Instance, Config, AuditEntry
 from sql.offlinedownload import (
     OffLineDownLoad,
+    ParallelExport,
+    instance_export_slot,
     save_to_format_file,
     save_csv,
     save_json,
@@ -23,8 +26,15 @@ from sql.offlinedownload import (
     save_sql,
     offline_file_download,
 )
-from sql.engines.models import ReviewSet, ReviewResult, ResultSet
+from sql.engines.models import (
+    ReviewSet,
+    ReviewResult,
+    ResultSet,
+    StreamingResultSet,
+    ColumnarRows,
+)
 from sql.storage import DynamicStorage
+from common.config import SysConfig
 from sql.tests import User
 
 
@@ -91,6 +101,7 @@ class TestOfflineDownload(TestCase):
         mock_result_set.rows = [(500,)]
         mock_result_set.error = None
         mock_engine.query.return_value = mock_result_set
+        mock_engine.export_count_strategy = "count"
         mock_get_engine.return_value = mock_engine
 
         # 执行测试
@@ -117,6 +128,7 @@ class TestOfflineDownload(TestCase):
         mock_result_set.rows = [(15000,)]
         mock_result_set.error = None
         mock_engine.query.return_value = mock_result_set
+        mock_engine.export_count_strategy = "count"
         mock_get_engine.return_value = mock_engine
 
         # 执行测试
@@ -129,6 +141,64 @@ class TestOfflineDownload(TestCase):
         self.assertEqual(result.warning_count, 0)
         self.assertIn("超过阈值", result.rows[0].errormessage)
 
+    @patch("sql.offlinedownload.get_engine")
+    def test_pre_count_check_probe(self, mock_get_engine):
+        """
+        测试pre_count_check方法 - 默认使用有上限的探测语句
+        """
+        mock_engine = MagicMock()
+        mock_engine.instance = self.instance
+        mock_engine.export_count_strategy = "probe"
+        mock_engine.get_probe_sql.return_value = "probe_sql"
+        mock_engine.query.return_value = ResultSet(rows=[(1,)] * 10001)
+        mock_get_engine.return_value = mock_engine
+
+        self.workflow.sql_content = "SELECT * FROM test_table"
+        result = OffLineDownLoad().pre_count_check(self.workflow)
+
+        mock_engine.get_probe_sql.assert_called_once_with(
+            "SELECT * FROM test_table", 10001
+        )
+        mock_engine.query.assert_called_once_with(
+            db_name="test_db", sql="probe_sql", limit_num=10001
+        )
+        self.assertEqual(result.error_count, 1)
+        self.assertIn("(>10000)超过阈值", result.rows[0].errormessage)
+
+    @patch("sql.offlinedownload.get_engine")
+    def test_pre_count_check_strategy(self, mock_get_engine):
+        """
+        测试pre_count_check方法 - 按实例类型配置统计策略
+        """
+        mock_engine = MagicMock()
+        mock_engine.instance = self.instance
+        mock_engine.get_table_rows.return_value = 300
+        mock_engine.estimate_rows.return_value = 200
+        mock_get_engine.return_value = mock_engine
+        offline_download = OffLineDownLoad()
+
+        Config.objects.create(
+            item="export_count_strategy", value='{"mysql": "table_rows"}'
+        )
+        self.workflow.sql_content = "SELECT * FROM test_table"
+        result = offline_download.pre_count_check(self.workflow)
+        mock_engine.get_table_rows.assert_called_once_with(
+            tb_name="test_table", db_name="test_db"
+        )
+        self.assertEqual(result.rows[0].affected_rows, 300)
+        mock_engine.query.assert_not_called()
+
+        # 多表查询无法使用表统计信息，使用探测语句
+        mock_engine.query.return_value = ResultSet(rows=[(1,)] * 5)
+        self.workflow.sql_content = "SELECT * FROM a JOIN b ON a.id = b.id"
+        result = offline_download.pre_count_check(self.workflow)
+        self.assertEqual(result.rows[0].affected_rows, 5)
+
+        SysConfig().set("export_count_strategy", "explain")
+        self.workflow.sql_content = "SELECT * FROM test_table"
+        result = offline_download.pre_count_check(self.workflow)
+        self.assertEqual(result.rows[0].affected_rows, 200)
+
     @patch("sql.offlinedownload.get_engine")
     def test_pre_count_check_invalid_sql(self, mock_get_engine):
         """
@@ -166,7 +236,7 @@ class TestOfflineDownload(TestCase):
         mock_result_set.column_list = ["id", "name"]
         mock_result_set.rows = [(1, "test1"), (2, "test2")]
         mock_result_set.affected_rows = 2
-        mock_engine.query.return_value = mock_result_set
+        mock_engine.query_stream.return_value = mock_result_set
         mock_get_engine.return_value = mock_engine
 
         mock_save_format.return_value = "test_file.zip"
@@ -202,7 +272,7 @@ class TestOfflineDownload(TestCase):
         mock_engine = MagicMock()
         mock_result_set = MagicMock()
         mock_result_set.error = "Database error"
-        mock_engine.query.return_value = mock_result_set
+        mock_engine.query_stream.return_value = mock_result_set
         mock_get_engine.return_value = mock_engine
 
         # 模拟DynamicStorage
@@ -375,8 +445,8 @@ class TestOfflineDownload(TestCase):
         # 清理
         os.unlink(temp_file.name)
 
-    @patch("sql.offlinedownload.pd.DataFrame")
-    def test_save_xlsx_large_file(self, mock_dataframe):
+    @patch("sql.offlinedownload.EXCEL_MAX_ROWS", 2)
+    def test_save_xlsx_large_file(self):
         """
         测试save_xlsx方法处理超过Excel行数限制的情况
         """
@@ -385,19 +455,14 @@ class TestOfflineDownload(TestCase):
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
         temp_file.close()
 
-        # 模拟pd.DataFrame.to_excel抛出异常
-        mock_dataframe.return_value.to_excel.side_effect = ValueError(
-            "Excel max rows exceeded"
-        )
-
-        # 测试数据（不需要实际生成大量数据）
-        result = [(1, "test1")]
+        # 测试数据（行数限制改为2，不需要实际生成大量数据）
+        result = [(1, "test1"), (2, "test2")]
         columns = ["id", "name"]
 
         # 执行测试并验证异常
         with self.assertRaises(ValueError) as context:
             save_xlsx(temp_file.name, result, columns)
-        self.assertIn("Excel最大支持行数为1048576,已超出!", str(context.exception))
+        self.assertIn("Excel最大支持行数为2,已超出!", str(context.exception))
 
         # 清理
         os.unlink(temp_file.name)
@@ -486,6 +551,55 @@ class TestOfflineDownload(TestCase):
         # 清理
         shutil.rmtree(temp_dir)
 
+    def test_save_to_format_file_streaming(self):
+        """
+        测试save_to_format_file方法 - 流式结果集直接写入压缩文件
+        """
+        temp_dir = tempfile.mkdtemp()
+        on_close = Mock()
+        rows = iter([(1, "test1"), (2, "test2"), (3, None)])
+        result = StreamingResultSet(column_list=["id", "name"], batch_size=2)
+        result.set_source(lambda size: list(itertools.islice(rows, size)), on_close)
+
+        # 空结果集
+        for format_type in ["json", "xml", "xlsx", "sql"]:
+            save_to_format_file(format_type, [], self.workflow, ["id"], temp_dir)
+        zip_file_name = save_to_format_file(
+            "json", result, self.workflow, result.column_list, temp_dir
+        )
+        with zipfile.ZipFile(os.path.join(temp_dir, zip_file_name), "r") as zipf:
+            data = json.loads(zipf.read(zipf.namelist()[0]))
+        self.assertEqual(data[2], {"id": 3, "name": None})
+        self.assertEqual(result.affected_rows, 3)
+        on_close.assert_called_once_with(True)
+
+        # 清理
+        shutil.rmtree(temp_dir)
+
+    def test_save_to_format_file_columnar(self):
+        """
+        测试save_to_format_file方法 - 列式批次按列转换后写入
+        """
+        temp_dir = tempfile.mkdtemp()
+        for format_type in ["csv", "xlsx"]:
+            columnar_rows = ColumnarRows([[1, 2, 3], ["test1", None, "test3"]])
+            result = StreamingResultSet(column_list=["id", "name"], batch_size=2)
+            offset = iter(range(0, 6, 2))
+            result.set_source(lambda size: columnar_rows[next(offset) :][:size], Mock())
+            zip_file_name = save_to_format_file(
+                format_type, result, self.workflow, result.column_list, temp_dir
+            )
+            self.assertEqual(result.affected_rows, 3)
+            with zipfile.ZipFile(os.path.join(temp_dir, zip_file_name), "r") as zipf:
+                content = zipf.read(zipf.namelist()[0])
+            if format_type == "csv":
+                rows = list(csv.reader(content.decode("utf-8").splitlines()))
+                self.assertEqual(rows[2], ["2", "null"])
+                self.assertEqual(rows[3], ["3", "test3"])
+
+        # 清理
+        shutil.rmtree(temp_dir)
+
     def test_save_to_format_file_unsupported(self):
         """
         测试save_to_format_file方法 - 不支持的格式
@@ -516,12 +630,9 @@ class TestOfflineDownload(TestCase):
 
         # 模拟依赖
         mock_engine = MagicMock()
-        mock_result_set = MagicMock()
-        mock_result_set.error = None
-        mock_result_set.column_list = ["id", "name"]
-        mock_result_set.rows = []
-        mock_result_set.affected_rows = 0
-        mock_engine.query.return_value = mock_result_set
+        mock_engine.query_stream.return_value = StreamingResultSet.from_result_set(
+            ResultSet(column_list=["id", "name"], rows=[])
+        )
         mock_get_engine.return_value = mock_engine
 
         # 执行测试
@@ -533,6 +644,134 @@ class TestOfflineDownload(TestCase):
         self.assertEqual(result.rows[0].stagestatus, "执行正常")
         self.assertIn("保存文件", result.rows[0].errormessage)
 
+    @patch("sql.offlinedownload.get_engine")
+    def test_execute_offline_download_over_limit(self, mock_get_engine):
+        """
+        测试execute_offline_download方法 - 实际行数超过阈值时终止导出
+        """
+        SysConfig().set("max_export_rows", "2")
+        mock_engine = MagicMock()
+        results = StreamingResultSet.from_result_set(
+            ResultSet(column_list=["id"], rows=[(1,), (2,), (3,), (4,)])
+        )
+        mock_engine.query_stream.return_value = results
+        mock_get_engine.return_value = mock_engine
+
+        offline_download = OffLineDownLoad()
+        result = offline_download.execute_offline_download(self.workflow)
+
+        # 多读取一行用于判断是否超过阈值
+        self.assertEqual(mock_engine.query_stream.call_args.kwargs["limit_num"], 3)
+        self.assertEqual(result.rows[0].stagestatus, "异常终止")
+        self.assertIn("超过阈值(2)", result.rows[0].errormessage)
+        self.assertFalse(SqlWorkflow.objects.get(id=self.workflow.id).file_name)
+
+    @patch("sql.offlinedownload.get_engine")
+    def test_parallel_export_plan(self, mock_get_engine):
+        """
+        测试并行导出的分片规划
+        """
+        mock_engine = MagicMock()
+        mock_engine.get_int_primary_key.return_value = "id"
+        mock_engine.query.return_value = ResultSet(rows=[(1, 25)])
+        mock_get_engine.return_value = mock_engine
+        config = {"offline_export_chunk_rows": 10}
+
+        parallel_export = ParallelExport(
+            self.workflow, "SELECT id, name FROM test_table WHERE id > 0;", config
+        )
+        self.assertEqual(parallel_export.plan(), [(1, 10), (10, 19), (19, 26)])
+        mock_engine.get_int_primary_key.assert_called_once_with(
+            tb_name="test_table", db_name="test_db"
+        )
+        self.assertEqual(
+            parallel_export.chunk_sql(1, 10),
+            "SELECT id, name FROM test_table WHERE (id > 0) AND `id` >= 1 AND `id` < 10",
+        )
+
+        # 不满足并行条件的语句
+        for sql in [
+            "SELECT * FROM a JOIN b ON a.id = b.id",
+            "SELECT * FROM test_table ORDER BY id",
+            "SELECT count(*) FROM test_table",
+            "SELECT * FROM (SELECT * FROM test_table) t",
+        ]:
+            self.assertEqual(ParallelExport(self.workflow, sql, config).plan(), [])
+
+        # 没有整数主键
+        mock_engine.get_int_primary_key.return_value = None
+        parallel_export = ParallelExport(
+            self.workflow, "SELECT * FROM test_table", config
+        )
+        self.assertEqual(parallel_export.plan(), [])
+
+    @patch("sql.offlinedownload.get_engine")
+    def test_parallel_export(self, mock_get_engine):
+        """
+        测试并行导出，分片文件和manifest打包到一个压缩文件
+        """
+        mock_engine = MagicMock()
+        mock_engine.get_int_primary_key.return_value = "id"
+        mock_engine.query.return_value = ResultSet(rows=[(1, 4)])
+        mock_engine.query_stream.side_effect = (
+            lambda sql, **kwargs: StreamingResultSet.from_result_set(
+                ResultSet(
+                    column_list=["id"],
+                    rows=[(1,), (2,)] if ">= 1 " in sql else [(3,), (4,)],
+                )
+            )
+        )
+        mock_get_engine.return_value = mock_engine
+        config = {"offline_export_chunk_rows": 2, "offline_export_workers": 2}
+        parallel_export = ParallelExport(
+            self.workflow, "SELECT id FROM test_table", config
+        )
+        self.assertEqual(len(parallel_export.plan()), 2)
+
+        temp_dir = tempfile.mkdtemp()
+        mock_get_engine.reset_mock()
+        zip_file_name, total_rows = parallel_export.export(temp_dir)
+        self.assertEqual(total_rows, 4)
+        # 每个分片在线程中单独创建引擎
+        self.assertEqual(mock_get_engine.call_count, 2)
+        with zipfile.ZipFile(os.path.join(temp_dir, zip_file_name), "r") as zipf:
+            manifest = json.loads(zipf.read("manifest.json"))
+            self.assertEqual(len(manifest["chunks"]), 2)
+            self.assertEqual(manifest["total_rows"], 4)
+            part = zipf.read(manifest["chunks"][1]["file"]).decode("utf-8")
+            self.assertEqual(part, '"id"\r\n"3"\r\n"4"\r\n')
+        # 分片文件打包后删除
+        self.assertEqual(os.listdir(temp_dir), [zip_file_name])
+
+        # 合计行数超过阈值
+        parallel_export = ParallelExport(
+            self.workflow, "SELECT id FROM test_table", config, max_export_rows=3
+        )
+        parallel_export.plan()
+        with self.assertRaises(ValueError):
+            parallel_export.export(temp_dir)
+
+        # 清理
+        shutil.rmtree(temp_dir)
+
+    @patch("sql.offlinedownload.time.sleep")
+    def test_instance_export_slot(self, mock_sleep):
+        """
+        测试实例导出并发槽位
+        """
+        with instance_export_slot(self.instance.id, 2):
+            with instance_export_slot(self.instance.id, 2):
+                # 槽位已满时等待
+                mock_sleep.side_effect = RuntimeError("slot full")
+                with self.assertRaises(RuntimeError):
+                    with instance_export_slot(self.instance.id, 2):
+                        pass
+            mock_sleep.side_effect = None
+            # 释放后可以重新获取
+            with instance_export_slot(self.instance.id, 2):
+                pass
+        mock_sleep.assert_called_once()
+
     @patch("sql.offlinedownload.DynamicStorage")
     def test_offline_file_download_error(self, mock_storage):
         """
@@ -12,6 +12,7 @@ from common.config import SysConfig
 from common.utils.const import WorkflowAction, WorkflowStatus
 from sql.models import Instance, ResourceGroup, QueryPrivilegesApply, QueryPrivileges
 from sql.tests import User
+from sql.utils.query_tree_cache import table_ref_cache
 from sql.utils.workflow_audit import AuditV2
 
 
@@ -317,6 +318,8 @@ class TestQueryPrivilegesCheck(TestCase):
         self.db_name = settings.DATABASES["default"]["TEST"]["NAME"]
         self.sys_config = SysConfig()
         self.client = Client()
+        table_ref_cache.invalidate_instance(self.slave.id)
+        sql.query_privileges.clear_priv_snapshot(self.user.username, self.slave.id)
 
     def tearDown(self):
         self.superuser.delete()
@@ -415,6 +418,46 @@ class TestQueryPrivilegesCheck(TestCase):
         )
         self.assertTrue(r)
 
+    def test_priv_snapshot(self):
+        """
+        测试用户权限快照，只查询一次数据库，权限变更后失效
+        :return:
+        """
+        privilege = QueryPrivileges.objects.create(
+            user_name=self.user.username,
+            instance=self.slave,
+            db_name=self.db_name,
+            valid_date=date.today() + timedelta(days=1),
+            limit_num=10,
+            priv_type=1,
+        )
+        QueryPrivileges.objects.create(
+            user_name=self.user.username,
+            instance=self.slave,
+            db_name=self.db_name,
+            table_name="table_name",
+            valid_date=date.today(),
+            limit_num=5,
+            priv_type=2,
+        )
+        with self.assertNumQueries(1):
+            r1 = sql.query_privileges._db_priv(
+                user=self.user, instance=self.slave, db_name=self.db_name
+            )
+            r2 = sql.query_privileges._tb_priv(
+                user=self.user,
+                instance=self.slave,
+                db_name=self.db_name,
+                tb_name="table_name",
+            )
+        self.assertEqual((r1, r2), (10, 5))
+        privilege.is_deleted = 1
+        privilege.save(update_fields=["is_deleted"])
+        r = sql.query_privileges._db_priv(
+            user=self.user, instance=self.slave, db_name=self.db_name
+        )
+        self.assertFalse(r)
+
     @patch("sql.query_privileges._db_priv")
     def test_priv_limit_from_db(self, __db_priv):
         """
@@ -459,6 +502,23 @@ class TestQueryPrivilegesCheck(TestCase):
         )
         self.assertListEqual(r, [{"schema": "test_archery", "name": "sql_users"}])
 
+    @patch("sql.engines.goinception.GoInceptionEngine.get_table_ref")
+    @patch("sql.engines.goinception.GoInceptionEngine.query_print")
+    def test_table_ref_cache(self, _query_print, _get_table_ref):
+        """
+        测试相同指纹的查询语句只请求一次goInception
+        :return:
+        """
+        _query_print.return_value = {"query_tree": "{}"}
+        _get_table_ref.return_value = [{"schema": "archery", "name": "sql_users"}]
+        for sql_content in [
+            "select * from sql_users where id=1;",
+            "select * from sql_users where id=2;",
+        ]:
+            r = sql.query_privileges._table_ref(sql_content, self.slave, self.db_name)
+            self.assertListEqual(r, [{"schema": "archery", "name": "sql_users"}])
+        _query_print.assert_called_once()
+
     @patch("sql.engines.goinception.GoInceptionEngine.query_print")
     def test_table_ref_wrong(self, _query_print):
         """
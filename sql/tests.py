@@ -1,7 +1,9 @@
+import io
 import json
 from datetime import timedelta, datetime
 from unittest.mock import MagicMock, patch, ANY, Mock
 from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 from django.contrib.auth.models import Group
 from django.contrib.auth.models import Permission
@@ -10,7 +12,8 @@ from django.test import Client, TestCase, TransactionTestCase
 from common.config import SysConfig
 from common.utils.const import WorkflowStatus, WorkflowType, WorkflowAction
 from sql.binlog import my2sql_file
-from sql.engines.models import ResultSet
+from sql.data_dictionary import export_instance_dictionary
+from sql.engines.models import ResultSet, StreamingResultSet
 from sql.utils.execute_sql import execute_callback
 from sql.query import kill_query_conn
 from sql.models import (
@@ -617,6 +620,61 @@ class TestQuery(TransactionTestCase):
         self.assertEqual(r_json["data"]["rows"], ["value"])
         self.assertEqual(r_json["data"]["column_list"], ["some"])
 
+    @patch("sql.query.user_instances")
+    @patch("sql.query.get_engine")
+    @patch("sql.query.query_priv_check")
+    def testStreamQuery(self, _priv_check, _get_engine, _user_instances):
+        c = Client()
+        some_sql = "select some from some_table limit 100;"
+        some_db = "some_db"
+        c.force_login(self.u2)
+        q_result = ResultSet(full_sql=some_sql, rows=[("value",), ("value2",)])
+        q_result.column_list = ["some"]
+        _get_engine.return_value.query_check.return_value = {
+            "msg": "",
+            "bad_query": False,
+            "filtered_sql": some_sql,
+            "has_star": False,
+        }
+        _get_engine.return_value.filter_sql.return_value = some_sql
+        _get_engine.return_value.query_stream.side_effect = (
+            lambda *args, **kwargs: StreamingResultSet.from_result_set(
+                q_result, batch_size=1
+            )
+        )
+        _get_engine.return_value.seconds_behind_master = 100
+        _priv_check.return_value = {
+            "status": 0,
+            "data": {"limit_num": 100, "priv_check": True},
+        }
+        _user_instances.return_value.get.return_value = self.slave1
+        data = {
+            "instance_name": self.slave1.instance_name,
+            "sql_content": some_sql,
+            "db_name": some_db,
+            "limit_num": 100,
+            "stream": "json",
+        }
+        r = c.post("/query/", data=data)
+        _get_engine.return_value.query.assert_not_called()
+        r_json = json.loads(b"".join(r.streaming_content))
+        self.assertEqual(r_json["status"], 0)
+        self.assertEqual(r_json["data"]["rows"], [["value"], ["value2"]])
+        self.assertEqual(r_json["data"]["column_list"], ["some"])
+        self.assertEqual(r_json["data"]["affected_rows"], 2)
+        self.assertEqual(r_json["data"]["seconds_behind_master"], 100)
+        self.assertEqual(QueryLog.objects.filter(sqllog=some_sql).first().effect_row, 2)
+
+        data["stream"] = "ndjson"
+        r = c.post("/query/", data=data)
+        lines = [
+            json.loads(line) for line in b"".join(r.streaming_content).splitlines()
+        ]
+        self.assertEqual(r["Content-Type"], "application/x-ndjson")
+        self.assertEqual(lines[0]["column_list"], ["some"])
+        self.assertEqual(lines[1:-1], [["value"], ["value2"]])
+        self.assertEqual(lines[-1]["status"], 0)
+
     @patch("sql.query.query_priv_check")
     def testStarOptionOn(self, _priv_check):
         c = Client()
@@ -1822,6 +1880,7 @@ class TestDataDictionary(TestCase):
 
     def tearDown(self):
         self.sys_config.purge()
+        cache.delete(f"data_dictionary:export:lock:{self.ins.id}")
         Instance.objects.all().delete()
         User.objects.all().delete()
 
@@ -2082,8 +2141,10 @@ class TestDataDictionary(TestCase):
         r = self.client.get(path="/data_dictionary/export/", data=data)
         self.assertEqual(r.json()["status"], 1)
 
+    @patch("sql.data_dictionary.DynamicStorage")
+    @patch("sql.data_dictionary.async_task")
     @patch("sql.data_dictionary.get_engine")
-    def test_export_instance(self, _get_engine):
+    def test_export_instance(self, _get_engine, _async_task, _storage):
         """
         测试导出
         :return:
@@ -2093,8 +2154,8 @@ class TestDataDictionary(TestCase):
             return s
 
         _get_engine.return_value.escape_string = dummy
-        _get_engine.return_value.get_all_databases.return_value.rows.return_value = (
-            ResultSet(rows=(("test1",), ("test2",)))
+        _get_engine.return_value.get_all_databases.return_value = ResultSet(
+            rows=["test1", "test2"]
         )
         _get_engine.return_value.query.return_value = ResultSet(
             rows=(
@@ -2149,14 +2210,35 @@ class TestDataDictionary(TestCase):
         data = {"instance_name": self.ins.instance_name, "db_type": "mysql"}
         r = self.client.get(path="/data_dictionary/export/", data=data)
         self.assertEqual(r.status_code, 200)
-        self.assertDictEqual(
-            json.loads(r.content),
-            {
-                "data": [],
-                "msg": "实例test_instance数据字典导出成功，请到downloads目录下载！",
-                "status": 0,
-            },
+        self.assertEqual(r.json()["status"], 0)
+        self.assertEqual(
+            r.json()["msg"],
+            "实例test_instance数据字典导出任务已提交，请等待导出完成后下载！",
         )
+        job_id = r.json()["data"]["job_id"]
+        _async_task.assert_called_once()
+        # 同一实例同时只允许一个导出任务
+        r = self.client.get(path="/data_dictionary/export/", data=data)
+        self.assertEqual(r.json()["status"], 1)
+        self.assertEqual(r.json()["data"]["job_id"], job_id)
+        # 执行后台任务
+        _storage.return_value.exists.return_value = False
+        export_instance_dictionary(*_async_task.call_args.args[1:], incremental=False)
+        self.assertEqual(_storage.return_value.save.call_count, 2)
+        r = self.client.get(
+            path="/data_dictionary/export/status/", data={"job_id": job_id}
+        )
+        progress = r.json()["data"]
+        self.assertEqual(progress["status"], "finished")
+        self.assertEqual(progress["finished"], 2)
+        self.assertEqual(sorted(progress["generated"]), ["test1", "test2"])
+        # 增量导出，结构未变化的库跳过
+        _storage.return_value.exists.return_value = True
+        progress = export_instance_dictionary(
+            job_id, self.ins.id, ["test1", "test2"], incremental=True
+        )
+        self.assertEqual(sorted(progress["skipped"]), ["test1", "test2"])
+        self.assertEqual(_storage.return_value.save.call_count, 2)
         # 测试恶意请求
         data = {
             "instance_name": self.ins.instance_name,
@@ -2166,8 +2248,9 @@ class TestDataDictionary(TestCase):
         r = self.client.get(path="/data_dictionary/export/", data=data)
         self.assertEqual(r.json()["status"], 1)
 
+    @patch("sql.data_dictionary.async_task")
     @patch("sql.data_dictionary.get_engine")
-    def test_oracle_export_instance(self, _get_engine):
+    def test_oracle_export_instance(self, _get_engine, _async_task):
         """
         oracle元数据测试导出
         :return:
@@ -2202,14 +2285,29 @@ class TestDataDictionary(TestCase):
         data = {"instance_name": self.ins.instance_name, "db_type": "oracle"}
         r = self.client.get(path="/data_dictionary/export/", data=data)
 
-        print(r.status_code)
-        print("oracle_test_export_instance")
         self.assertEqual(r.status_code, 200)
-        self.assertDictEqual(
-            json.loads(r.content),
-            {
-                "data": [],
-                "msg": "实例test_instance数据字典导出成功，请到downloads目录下载！",
-                "status": 0,
-            },
+        self.assertEqual(r.json()["status"], 0)
+        _async_task.assert_called_once()
+
+    @patch("sql.data_dictionary.DynamicStorage")
+    def test_export_download(self, _storage):
+        """
+        测试下载导出到存储的数据字典
+        :return:
+        """
+        data = {"instance_name": self.ins.instance_name, "db_name": "test1"}
+        _storage.return_value.exists.return_value = False
+        r = self.client.get(path="/data_dictionary/export/download/", data=data)
+        self.assertEqual(r.json()["status"], 1)
+        _storage.return_value.exists.return_value = True
+        _storage.return_value.storage_type = "local"
+        _storage.return_value.open.return_value = io.BytesIO(b"dictionary")
+        r = self.client.get(path="/data_dictionary/export/download/", data=data)
+        self.assertTrue(r.streaming)
+        _storage.return_value.open.assert_called_once_with(
+            "dictionary/test_instance_test1.html", "rb"
         )
+        # 测试恶意请求
+        data["db_name"] = "/../../../etc/passwd"
+        r = self.client.get(path="/data_dictionary/export/download/", data=data)
+        self.assertEqual(r.json()["status"], 1)
@@ -119,10 +119,13 @@ urlpatterns = [
     path("instance/schemasync/", instance.schemasync),
     path("instance/instance_resource/", instance.instance_resource),
     path("instance/describetable/", instance.describe),
+    path("instance/redis_keys/", instance.redis_keys),
     path("data_dictionary/", views.data_dictionary),
     path("data_dictionary/table_list/", data_dictionary.table_list),
     path("data_dictionary/table_info/", data_dictionary.table_info),
     path("data_dictionary/export/", data_dictionary.export),
+    path("data_dictionary/export/status/", data_dictionary.export_status),
+    path("data_dictionary/export/download/", data_dictionary.export_download),
     path("param/list/", instance.param_list),
     path("param/history/", instance.param_history),
     path("param/edit/", instance.param_edit),
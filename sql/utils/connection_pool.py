@@ -0,0 +1,271 @@
+# -*- coding: UTF-8 -*-
+"""
+实例连接池，按 实例+库 维度复用数据库连接，避免每次查询都重新建立 TCP 连接和认证。
+连接池实现可以通过 settings.ENGINE_CONNECTION_POOL["class"] 替换。
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger("default")
+
+
+class PoolExhaustedError(Exception):
+    """连接池已满，并且等待超时"""
+
+
+class ConnectionPool:
+    """
+    有界连接池
+    :param max_size: 连接总数上限（包含使用中的连接）
+    :param max_idle: 空闲连接数上限，超过后归还的连接直接关闭
+    :param idle_timeout: 空闲超时时间（秒），超过后关闭
+    :param max_lifetime: 连接最大存活时间（秒），超过后不再复用
+    :param wait_timeout: 连接池满时获取连接的等待时间（秒）
+    :param ping_interval: 连接空闲超过该时间（秒）后，取出前进行健康检查
+    """
+
+    def __init__(
+        self,
+        max_size=10,
+        max_idle=5,
+        idle_timeout=300,
+        max_lifetime=3600,
+        wait_timeout=10,
+        ping_interval=30,
+        **kwargs,
+    ):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.ping_interval = ping_interval
+        # 空闲连接 [(conn, created_at, last_used)]，后进先出，尽量复用最近使用的连接
+        self._idle = []
+        # 使用中的连接 {id(conn): created_at}
+        self._in_use = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self.created_count = 0
+        self.reused_count = 0
+        self.discarded_count = 0
+
+    @staticmethod
+    def _close_conn(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"连接池关闭连接失败：{e}")
+
+    def _expired(self, created_at, now):
+        return bool(self.max_lifetime) and now - created_at > self.max_lifetime
+
+    def _evict(self, now):
+        """清理过期的空闲连接，返回需要关闭的连接，调用方需持有锁"""
+        keep, expired = [], []
+        for item in self._idle:
+            conn, created_at, last_used = item
+            if self._expired(created_at, now) or (
+                self.idle_timeout and now - last_used > self.idle_timeout
+            ):
+                expired.append(conn)
+            else:
+                keep.append(item)
+        self._idle = keep
+        self.discarded_count += len(expired)
+        return expired
+
+    def acquire(self, creator, validator=None):
+        """
+        获取连接
+        :param creator: 新建连接的函数
+        :param validator: 健康检查函数，返回False或抛出异常的连接会被丢弃
+        :return: conn
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            candidate = None
+            with self._cond:
+                if self._closed:
+                    raise PoolExhaustedError("连接池已关闭")
+                now = time.time()
+                expired = self._evict(now)
+                if self._idle:
+                    candidate = self._idle.pop()
+                    self._in_use[id(candidate[0])] = candidate[1]
+                elif len(self._in_use) < self.max_size:
+                    # 先占位，避免并发时超出上限
+                    placeholder = object()
+                    self._in_use[id(placeholder)] = now
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"连接池已满({self.max_size})，等待{self.wait_timeout}秒后仍无可用连接"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+            for conn in expired:
+                self._close_conn(conn)
+
+            if candidate:
+                conn, created_at, last_used = candidate
+                if self._validate(conn, last_used, validator):
+                    self.reused_count += 1
+                    return conn
+                # 健康检查失败，丢弃后重新获取
+                self.release(conn, discard=True)
+                continue
+
+            try:
+                conn = creator()
+            except Exception:
+                with self._cond:
+                    self._in_use.pop(id(placeholder), None)
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._in_use.pop(id(placeholder), None)
+                self._in_use[id(conn)] = now
+                self.created_count += 1
+            return conn
+
+    def _validate(self, conn, last_used, validator):
+        if validator is None or time.time() - last_used < self.ping_interval:
+            return True
+        try:
+            return validator(conn) is not False
+        except Exception as e:
+            logger.debug(f"连接池健康检查失败，丢弃连接：{e}")
+            return False
+
+    def release(self, conn, discard=False):
+        """归还连接，discard=True时直接关闭"""
+        close = discard
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+            now = time.time()
+            if created_at is None:
+                # 不是从当前连接池取出的连接
+                close = True
+            elif (
+                self._closed
+                or self._expired(created_at, now)
+                or len(self._idle) >= self.max_idle
+            ):
+                close = True
+            if close:
+                self.discarded_count += 1
+            else:
+                self._idle.append((conn, created_at, now))
+            self._cond.notify()
+        if close:
+            self._close_conn(conn)
+
+    def evict(self):
+        """清理过期的空闲连接"""
+        with self._cond:
+            expired = self._evict(time.time())
+        for conn in expired:
+            self._close_conn(conn)
+
+    def close(self):
+        """关闭所有空闲连接，使用中的连接归还时关闭"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_conn(conn)
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    @property
+    def in_use_count(self):
+        return len(self._in_use)
+
+    def stats(self):
+        return {
+            "max_size": self.max_size,
+            "idle": self.idle_count,
+            "in_use": self.in_use_count,
+            "created": self.created_count,
+            "reused": self.reused_count,
+            "discarded": self.discarded_count,
+        }
+
+
+class ConnectionPoolManager:
+    """进程内的连接池注册表，key 由引擎生成"""
+
+    # 全量清理空闲连接的间隔（秒）
+    sweep_interval = 60
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    @staticmethod
+    def get_config():
+        return getattr(settings, "ENGINE_CONNECTION_POOL", {}) or {}
+
+    @property
+    def enabled(self):
+        return bool(self.get_config().get("enabled"))
+
+    def _pool_class(self):
+        path = (
+            self.get_config().get("class") or "sql.utils.connection_pool:ConnectionPool"
+        )
+        module, o = path.split(":")
+        return getattr(importlib.import_module(module), o)
+
+    def get_pool(self, key):
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                options = {k: v for k, v in self.get_config().items() if k != "class"}
+                pool = self._pool_class()(**options)
+                self._pools[key] = pool
+            sweep = time.time() - self._last_sweep > self.sweep_interval
+            if sweep:
+                self._last_sweep = time.time()
+                pools = list(self._pools.values())
+        if sweep:
+            for p in pools:
+                p.evict()
+        return pool
+
+    def close(self, key=None):
+        """关闭连接池，key为空时关闭全部"""
+        with self._lock:
+            if key is None:
+                pools, self._pools = list(self._pools.values()), {}
+            else:
+                pool = self._pools.pop(key, None)
+                pools = [pool] if pool else []
+        for pool in pools:
+            pool.close()
+
+    def close_instance(self, instance_id):
+        """关闭某个实例的所有连接池，实例配置修改或删除时使用"""
+        with self._lock:
+            keys = [k for k in self._pools if k[0] == instance_id]
+        for key in keys:
+            self.close(key)
+
+    def stats(self):
+        with self._lock:
+            items = list(self._pools.items())
+        return {":".join(str(i) for i in key): pool.stats() for key, pool in items}
+
+
+pool_manager = ConnectionPoolManager()
@@ -1,6 +1,6 @@
 # -*- coding:utf-8 -*-
 import logging
-import math
+from functools import lru_cache
 
 import sqlparse
 from django.forms import model_to_dict
@@ -8,12 +8,17 @@ from sqlparse.tokens import Keyword
 import pandas as pd
 
 from sql.engines.goinception import GoInceptionEngine
+from sql.engines.models import ColumnarRows
 from sql.models import DataMaskingRules, DataMaskingColumns
+from sql.utils.query_tree_cache import select_list_cache
 import re
 import traceback
 
 logger = logging.getLogger("default")
 
+# 结果集行数超过该值时按列脱敏
+MASKING_COLUMNAR_THRESHOLD = 1000
+
 
 def data_masking(instance, db_name, sql, sql_result):
     """脱敏数据"""
@@ -37,11 +42,14 @@ def data_masking(instance, db_name, sql, sql_result):
                 for index, field in enumerate(sql_result.column_list)
             ]
         else:
-            # 通过goInception获取select list
-            inception_engine = GoInceptionEngine()
-            select_list = inception_engine.query_data_masking(
-                instance=instance, db_name=db_name, sql=sql
-            )
+            # 通过goInception获取select list，相同指纹的查询直接使用缓存
+            select_list = select_list_cache.get(instance, db_name, sql)
+            if select_list is None:
+                inception_engine = GoInceptionEngine()
+                select_list = inception_engine.query_data_masking(
+                    instance=instance, db_name=db_name, sql=sql
+                )
+                select_list_cache.set(instance, db_name, sql, select_list)
         # 如果UNION存在，那么调用去重函数
         select_list = (
             del_repeat(select_list, keywords_count) if keywords_count else select_list
@@ -50,32 +58,26 @@ def data_masking(instance, db_name, sql, sql_result):
         hit_columns = analyze_query_tree(select_list, instance)
         sql_result.mask_rule_hit = True if hit_columns else False
         # 对命中规则列hit_columns的数据进行脱敏
-        masking_rules = {
-            i.rule_type: model_to_dict(i) for i in DataMaskingRules.objects.all()
-        }
         if hit_columns and sql_result.rows:
-            rows = list(sql_result.rows)
-            for column in hit_columns:
-                index, rule_type = column["index"], column["rule_type"]
-                masking_rule = masking_rules.get(rule_type)
-                # 如果是默认的三段式通用脱敏规则，数据库没有查询结果，则创建一个对象。
-                if not masking_rule and rule_type == 100:
-                    masking_rule_obj, created = DataMaskingRules.objects.get_or_create(
-                        rule_type=100,
-                        rule_regex="^([\\s\\S]{0,}?)([\\s\\S]{0,}?)([\\s\\S]{0,}?)$",
-                        hide_group=2,
-                        rule_desc="三段式通用脱敏规则：内部实现，正则暂不支持修改，隐藏组支持修改。",
-                    )
-                    if created:
-                        masking_rule = model_to_dict(masking_rule_obj)
-                        masking_rules[rule_type] = masking_rule  # 更新字典
-                        masking_rule = masking_rules.get(rule_type)
-                if not masking_rule:
-                    continue
-                for idx, item in enumerate(rows):
-                    rows[idx] = list(item)
-                    rows[idx][index] = regex(masking_rule, rows[idx][index])
-                sql_result.rows = rows
+            masking_rules = {
+                i.rule_type: model_to_dict(i) for i in DataMaskingRules.objects.all()
+            }
+            # 如果是默认的三段式通用脱敏规则，数据库没有查询结果，则创建一个对象。
+            if 100 not in masking_rules and any(
+                column["rule_type"] == 100 for column in hit_columns
+            ):
+                masking_rule_obj, created = DataMaskingRules.objects.get_or_create(
+                    rule_type=100,
+                    rule_regex="^([\\s\\S]{0,}?)([\\s\\S]{0,}?)([\\s\\S]{0,}?)$",
+                    hide_group=2,
+                    rule_desc="三段式通用脱敏规则：内部实现，正则暂不支持修改，隐藏组支持修改。",
+                )
+                if created:
+                    masking_rules[100] = model_to_dict(masking_rule_obj)
+            # 对命中规则列hit_columns的数据进行脱敏，规则只编译一次，结果集只遍历一次
+            plan = build_masking_plan(hit_columns, masking_rules)
+            if plan:
+                sql_result.rows = apply_masking_plan(sql_result.rows, plan)
             # 脱敏结果
             sql_result.is_masked = True
     except Exception as msg:
@@ -152,37 +154,90 @@ def analyze_query_tree(select_list, instance):
     return hit_columns
 
 
-def regex(masking_rule, value):
-    """利用正则表达式脱敏数据"""
-    # 如果为null或none或空字符串，则不脱敏直接返回。
-    if not value:
-        return value
-    rule_regex = masking_rule["rule_regex"]
-
-    rule_type = masking_rule["rule_type"]
-    # 系统通用规则正则表达式。 这是动态的。
-    if rule_type == 100 and isinstance(value, str):
-        value_average = math.floor(len(value) / 3)
-        value_remainder = len(value) % 3
-        value_average_1 = str(value_average)
-        value_average_2 = str(value_average + (1 if value_remainder > 0 else 0))
-        value_average_3 = str(value_average + (1 if value_remainder > 1 else 0))
-        # value_len_str=str(value_len if value_len >= 1 else 1)
-        rule_regex = (
-            "^([\\s\\S]{"
-            + value_average_1
-            + ",}?)([\\s\\S]{"
-            + value_average_2
-            + ",}?)([\\s\\S]{"
-            + value_average_3
-            + ",}?)$"
-        )
+def build_masking_plan(hit_columns, masking_rules):
+    """
+    生成脱敏计划，每个命中列对应一个脱敏函数，规则正则只编译一次
+    :param hit_columns: analyze_query_tree返回的命中列信息
+    :param masking_rules: {rule_type: masking_rule}
+    :return: [(index, mask_func)]
+    """
+    plan = []
+    mask_funcs = {}
+    for column in hit_columns:
+        rule_type = column["rule_type"]
+        masking_rule = masking_rules.get(rule_type)
+        if not masking_rule:
+            continue
+        if rule_type not in mask_funcs:
+            mask_funcs[rule_type] = masking_func(masking_rule)
+        plan.append((column["index"], mask_funcs[rule_type]))
+    return plan
+
 
+def apply_masking_plan(rows, plan):
+    """
+    按照脱敏计划对结果集脱敏，返回list of list
+    行数较多时按列处理，先转置再对整列调用脱敏函数，减少逐个单元格的寻址开销，
+    列式结果集(ColumnarRows)直接对命中的列脱敏，返回 ColumnarRows
+    """
+    if isinstance(rows, ColumnarRows):
+        return rows.map_columns(plan)
+    if len(rows) >= MASKING_COLUMNAR_THRESHOLD:
+        columns = [list(column) for column in zip(*rows)]
+        for index, func in plan:
+            columns[index] = list(map(func, columns[index]))
+        return [list(row) for row in zip(*columns)]
+    masked_rows = []
+    for row in rows:
+        row = list(row)
+        for index, func in plan:
+            row[index] = func(row[index])
+        masked_rows.append(row)
+    return masked_rows
+
+
+def masking_func(masking_rule):
+    """根据脱敏规则生成单个值的脱敏函数"""
     hide_group = masking_rule["hide_group"]
-    # 正则匹配必须分组，隐藏的组会使用****代替
+    pattern = compile_rule_regex(masking_rule["rule_regex"])
+
+    def mask_value(value):
+        # 如果为null或none或空字符串，则不脱敏直接返回。
+        if not value:
+            return value
+        return regex_mask(pattern, hide_group, value)
+
+    if masking_rule["rule_type"] != 100:
+        return mask_value
+
+    def mask_default(value):
+        # 系统通用规则，按长度三等分，余数依次分配给第二、三段，直接切片不走正则
+        if not value or not isinstance(value, str):
+            return mask_value(value)
+        if hide_group not in (1, 2, 3):
+            return value
+        average, remainder = divmod(len(value), 3)
+        bounds = (
+            0,
+            average,
+            average * 2 + (1 if remainder > 0 else 0),
+            len(value),
+        )
+        start, end = bounds[hide_group - 1], bounds[hide_group]
+        return value[:start] + "*" * (end - start) + value[end:]
+
+    return mask_default
+
+
+@lru_cache(maxsize=256)
+def compile_rule_regex(rule_regex):
+    return re.compile(rule_regex, re.I)
+
+
+def regex_mask(pattern, hide_group, value):
+    """使用编译后的正则脱敏，正则匹配必须分组，隐藏的组会使用****代替"""
     try:
-        p = re.compile(rule_regex, re.I)
-        m = p.search(str(value))
+        m = pattern.search(str(value))
         masking_str = ""
         if m is None:
             return value
@@ -198,6 +253,11 @@ def regex(masking_rule, value):
         return value
 
 
+def regex(masking_rule, value):
+    """利用正则表达式脱敏数据"""
+    return masking_func(masking_rule)(value)
+
+
 def brute_mask(instance, sql_result):
     """输入的是一个resultset
     sql_result.full_sql
@@ -3,13 +3,15 @@ import logging
 import traceback
 
 from django.db import close_old_connections, connection, transaction
-from django_redis import get_redis_connection
 from common.utils.const import WorkflowStatus, WorkflowType
 from common.config import SysConfig
 from sql.engines.models import ReviewResult, ReviewSet
 from sql.models import SqlWorkflow
 from sql.notify import notify_for_execute, EventType
 from sql.utils.workflow_audit import Audit
+from sql.utils.query_tree_cache import select_list_cache
+from sql.utils.schema_cache import invalidate_schema_cache
+from sql.utils.sql_utils import extract_tables
 from sql.engines import get_engine
 from sql.offlinedownload import OffLineDownLoad
 
@@ -48,6 +50,20 @@ def execute(workflow_id, user=None):
         return execute_engine.execute_workflow(workflow=workflow_detail)
 
 
+def workflow_db_names(db_name, sql_content):
+    """工单涉及的库，包括工单选择的库和语句中指定的库"""
+    db_names = {db_name}
+    try:
+        db_names.update(
+            i["schema"].strip("`")
+            for i in extract_tables(sql_content)
+            if i["schema"] is not None
+        )
+    except Exception as e:
+        logger.warning(f"解析工单涉及的库失败：{e}")
+    return db_names
+
+
 def execute_callback(task):
     """异步任务的回调, 将结果填入数据库等等
     使用django-q的hook, 传入参数为整个task
@@ -110,11 +126,17 @@ def execute_callback(task):
         operator_display="系统",
     )
 
-    # DDL工单结束后清空实例资源缓存
+    # DDL工单结束后失效工单涉及库的元数据缓存
     if workflow.syntax_type == 1:
-        r = get_redis_connection("default")
-        for key in r.scan_iter(match="*insRes*", count=2000):
-            r.delete(key)
+        invalidate_schema_cache(
+            workflow.instance_id,
+            db_names=workflow_db_names(
+                workflow.db_name, workflow.sqlworkflowcontent.sql_content
+            ),
+        )
+    # 非纯DML工单可能变更了表结构，脱敏select list缓存失效
+    if workflow.syntax_type != 2:
+        select_list_cache.invalidate_instance(workflow.instance_id)
 
     # 开启了Execute阶段通知参数才发送消息通知
     sys_config = SysConfig()
@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+"""
+goInception语法解析结果缓存，按 实例+库+SQL指纹+表结构版本 缓存，重复查询不再请求goInception。
+目前用于数据脱敏的select list和查询权限校验的table ref。
+两级缓存：进程内LRU + django cache(redis)，redis中的key设置过期时间，命中后续期。
+DDL工单执行结束后递增实例的表结构版本，旧的缓存自然失效。
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import sqlparse
+from django.core.cache import cache
+from sqlparse.tokens import Literal, Operator, Punctuation, Whitespace
+
+logger = logging.getLogger("default")
+
+# 只替换数字和单引号字符串；双引号在ANSI_QUOTES下可能是标识符，注释可能是MySQL的可执行注释，
+# 表名大小写可能敏感，这些都保持原样
+FINGERPRINT_LITERALS = (Literal.Number, Literal.String.Single)
+# 运算符和标点两侧的空白不影响语义，去掉
+FINGERPRINT_SEPARATORS = (Operator, Punctuation)
+
+
+def sql_fingerprint(sql):
+    """SQL指纹，常量替换为?，合并空白，去掉运算符和标点两侧的空白"""
+    parts = []
+    # 上一个token是否为运算符或标点
+    separated = True
+    for token in sqlparse.parse(sql.strip().rstrip(";"))[0].flatten():
+        if token.ttype in Whitespace:
+            if not separated and parts[-1] != " ":
+                parts.append(" ")
+            continue
+        if any(token.ttype in t for t in FINGERPRINT_SEPARATORS):
+            if parts and parts[-1] == " ":
+                parts.pop()
+            parts.append(token.value)
+            separated = True
+            continue
+        if any(token.ttype in t for t in FINGERPRINT_LITERALS):
+            parts.append("?")
+        else:
+            parts.append(token.value)
+        separated = False
+    return "".join(parts).strip()
+
+
+class QueryTreeCache:
+    """
+    :param prefix: 缓存key前缀，区分不同的解析结果
+    :param ttl: redis缓存过期时间（秒），命中后续期
+    :param local_size: 进程内缓存条数上限
+    :param local_ttl: 进程内缓存过期时间（秒）
+    """
+
+    def __init__(self, prefix, ttl=3600, local_size=512, local_ttl=300):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        # {key: (expire_at, value)}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_key(instance_id):
+        # 表结构版本在各类解析结果间共享
+        return f"query_tree_cache:version:{instance_id}"
+
+    def get_schema_version(self, instance_id):
+        version_key = self._version_key(instance_id)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, 1, timeout=None)
+            version = cache.get(version_key) or 1
+        return version
+
+    def make_key(self, instance, db_name, sql):
+        digest = hashlib.md5(sql_fingerprint(sql).encode("utf-8")).hexdigest()
+        version = self.get_schema_version(instance.id)
+        return f"{self.prefix}:{instance.id}:{version}:{db_name}:{digest}"
+
+    def _local_get(self, key):
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return item[1]
+
+    def _local_set(self, key, value):
+        with self._lock:
+            self._local[key] = (time.time() + self.local_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, instance, db_name, sql):
+        """获取缓存的解析结果，未命中或缓存异常时返回None"""
+        try:
+            key = self.make_key(instance, db_name, sql)
+            value = self._local_get(key)
+            if value is not None:
+                return value
+            value = cache.get(key)
+            if value is not None:
+                cache.touch(key, self.ttl)
+                self._local_set(key, value)
+            return value
+        except Exception as e:
+            logger.warning(f"读取语法解析缓存失败：{e}")
+            return None
+
+    def set(self, instance, db_name, sql, value):
+        try:
+            key = self.make_key(instance, db_name, sql)
+            cache.set(key, value, timeout=self.ttl)
+            self._local_set(key, value)
+        except Exception as e:
+            logger.warning(f"写入语法解析缓存失败：{e}")
+
+    def invalidate_instance(self, instance_id):
+        """实例表结构变更后调用，递增表结构版本，同时清理本进程的缓存"""
+        version_key = self._version_key(instance_id)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            cache.set(version_key, int(time.time()), timeout=None)
+        with self._lock:
+            for key in [k for k in self._local if k.split(":")[1] == str(instance_id)]:
+                del self._local[key]
+
+
+select_list_cache = QueryTreeCache("masking_select_list")
+table_ref_cache = QueryTreeCache("priv_table_ref")
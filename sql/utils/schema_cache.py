@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+"""
+实例元数据缓存，缓存 database、schema、table、column 列表和表结构，
+供 instance_resource、describe、api 的 InstanceResource 以及前端自动补全共用。
+缓存key由 实例版本号 + 库版本号 组成，DDL工单执行后按实例或库递增版本号精确失效，不需要SCAN整个redis。
+缓存超过 SCHEMA_CACHE_REFRESH 秒后依旧返回，同时提交后台任务刷新。
+查询等关键路径使用 peek_resource 只读缓存，缓存不存在时也不访问实例。
+"""
+
+import logging
+import time
+
+from django.core.cache import cache
+from django_q.tasks import async_task
+
+from sql.engines import get_engine
+from sql.models import Instance
+
+logger = logging.getLogger("default")
+
+# 缓存过期时间（秒）
+SCHEMA_CACHE_TTL = 24 * 3600
+# 超过该时间（秒）后台刷新
+SCHEMA_CACHE_REFRESH = 300
+RESOURCE_TYPES = ("database", "schema", "table", "column", "describe")
+
+
+def _get_version(version_key):
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, 1, timeout=None)
+        version = cache.get(version_key) or 1
+    return version
+
+
+def _incr_version(version_key):
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, int(time.time()), timeout=None)
+
+
+def resource_key(instance_id, resource_type, db_name="", schema_name="", tb_name=""):
+    """生成资源的缓存key，库列表只跟随实例版本号"""
+    instance_version = _get_version(f"schema_cache:version:{instance_id}")
+    prefix = f"schema_cache:{instance_id}:{instance_version}"
+    if resource_type == "database":
+        return f"{prefix}:database"
+    db_version = _get_version(f"schema_cache:version:{instance_id}:{db_name}")
+    return f"{prefix}:{db_name}:{db_version}:{resource_type}:{schema_name}:{tb_name}"
+
+
+def _load_resource(instance, resource_type, db_name, schema_name, tb_name):
+    query_engine = get_engine(instance=instance)
+    db_name = query_engine.escape_string(db_name)
+    schema_name = query_engine.escape_string(schema_name)
+    tb_name = query_engine.escape_string(tb_name)
+    if resource_type == "database":
+        return query_engine.get_all_databases()
+    elif resource_type == "schema":
+        return query_engine.get_all_schemas(db_name=db_name)
+    elif resource_type == "table":
+        return query_engine.get_all_tables(db_name=db_name, schema_name=schema_name)
+    elif resource_type == "column":
+        return query_engine.get_all_columns_by_tb(
+            db_name=db_name, tb_name=tb_name, schema_name=schema_name
+        )
+    elif resource_type == "describe":
+        return query_engine.describe_table(db_name, tb_name, schema_name=schema_name)
+    raise TypeError(f"不支持的资源类型{resource_type}")
+
+
+def refresh_resource(instance, resource_type, db_name="", schema_name="", tb_name=""):
+    """
+    从实例获取资源信息并写入缓存，获取失败时不写缓存
+    :param instance: 实例对象或实例id，后台任务传入实例id
+    :return: ResultSet
+    """
+    if not isinstance(instance, Instance):
+        instance = Instance.objects.get(id=instance)
+    key = resource_key(instance.id, resource_type, db_name, schema_name, tb_name)
+    resource = _load_resource(instance, resource_type, db_name, schema_name, tb_name)
+    if not resource.error:
+        cache.set(
+            key,
+            {"refreshed_at": time.time(), "resource": resource},
+            timeout=SCHEMA_CACHE_TTL,
+        )
+    cache.delete(f"{key}:refreshing")
+    return resource
+
+
+def get_resource(
+    instance, resource_type, db_name="", schema_name="", tb_name="", refresh=False
+):
+    """
+    获取实例资源信息，优先读取缓存
+    :param instance: 实例对象
+    :param resource_type: database、schema、table、column、describe
+    :param refresh: 是否跳过缓存直接从实例获取
+    :return: ResultSet
+    """
+    db_name, schema_name, tb_name = db_name or "", schema_name or "", tb_name or ""
+    key = resource_key(instance.id, resource_type, db_name, schema_name, tb_name)
+    cached = None if refresh else cache.get(key)
+    if cached is None:
+        return refresh_resource(instance, resource_type, db_name, schema_name, tb_name)
+    # 缓存较旧时后台刷新
+    if time.time() - cached["refreshed_at"] > SCHEMA_CACHE_REFRESH:
+        _refresh_in_background(
+            key, instance.id, resource_type, db_name, schema_name, tb_name
+        )
+    return cached["resource"]
+
+
+def peek_resource(instance, resource_type, db_name="", schema_name="", tb_name=""):
+    """
+    仅读取缓存，不在当前请求中访问实例，供查询等关键路径使用
+    缓存不存在或较旧时提交后台任务刷新
+    :return: ResultSet，缓存不存在时返回None
+    """
+    db_name, schema_name, tb_name = db_name or "", schema_name or "", tb_name or ""
+    key = resource_key(instance.id, resource_type, db_name, schema_name, tb_name)
+    cached = cache.get(key)
+    if cached is None or time.time() - cached["refreshed_at"] > SCHEMA_CACHE_REFRESH:
+        _refresh_in_background(
+            key, instance.id, resource_type, db_name, schema_name, tb_name
+        )
+    return cached["resource"] if cached else None
+
+
+def _refresh_in_background(
+    key, instance_id, resource_type, db_name, schema_name, tb_name
+):
+    """提交后台刷新任务，同一个key同时只提交一个任务"""
+    if not cache.add(f"{key}:refreshing", 1, timeout=SCHEMA_CACHE_REFRESH):
+        return
+    try:
+        async_task(
+            "sql.utils.schema_cache.refresh_resource",
+            instance_id,
+            resource_type,
+            db_name,
+            schema_name,
+            tb_name,
+            task_name=f"schema-cache-refresh-{instance_id}",
+        )
+    except Exception as e:
+        logger.warning(f"提交元数据缓存刷新任务失败：{e}")
+        cache.delete(f"{key}:refreshing")
+
+
+def invalidate_schema_cache(instance_id, db_names=None):
+    """
+    元数据缓存失效
+    :param instance_id: 实例id
+    :param db_names: 库名列表，为空时失效整个实例，否则失效指定库和库列表
+    """
+    try:
+        if not db_names:
+            _incr_version(f"schema_cache:version:{instance_id}")
+            return
+        for db_name in set(db_names):
+            _incr_version(f"schema_cache:version:{instance_id}:{db_name}")
+        cache.delete(resource_key(instance_id, "database"))
+    except Exception as e:
+        logger.warning(f"元数据缓存失效失败：{e}")
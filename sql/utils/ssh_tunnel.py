@@ -8,7 +8,14 @@
 
 from sshtunnel import SSHTunnelForwarder
 from paramiko import RSAKey
+from django.conf import settings
+import atexit
 import io
+import logging
+import threading
+import time
+
+logger = logging.getLogger("default")
 
 
 class SSHConnection(object):
@@ -59,6 +66,14 @@ class SSHConnection(object):
     def __del__(self):
         self.server.close()
 
+    @property
+    def is_active(self):
+        """ssh连接是否存活"""
+        return self.server.is_active
+
+    def close(self):
+        self.server.close()
+
     def get_ssh(self):
         """
         获取ssh映射的端口
@@ -66,3 +81,143 @@ class SSHConnection(object):
         :return:
         """
         return "127.0.0.1", self.server.local_bind_port
+
+
+class SSHTunnelLease(object):
+    """
+    共享隧道的引用，释放后引用计数减一，对象回收时自动释放
+    """
+
+    def __init__(self, manager, key, local_address):
+        self.manager = manager
+        self.key = key
+        self.local_address = local_address
+        self.released = False
+
+    def __del__(self):
+        self.release()
+
+    def get_ssh(self):
+        return self.local_address
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.manager.release(self.key)
+
+
+class SSHTunnelManager(object):
+    """
+    进程内共享的ssh隧道，按 隧道配置+远端地址 复用，引用计数为0后保留ttl秒再关闭，
+    隧道断开后下次获取时自动重建
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._tunnels = {}
+        self._lock = threading.RLock()
+        self.created_count = 0
+        self.reused_count = 0
+        self.restarted_count = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, "SSH_TUNNEL_IDLE_TTL", 300)
+
+    @staticmethod
+    def make_key(tunnel, host, port):
+        # 隧道配置修改后 update_time 变化，使用新的隧道
+        return tunnel.pk, tunnel.update_time, host, int(port)
+
+    def acquire(self, tunnel, host, port):
+        """获取隧道，返回 SSHTunnelLease"""
+        key = self.make_key(tunnel, host, port)
+        with self._lock:
+            self._evict()
+            entry = self._tunnels.get(key)
+            if entry and not entry["ssh"].is_active:
+                logger.warning(f"ssh隧道{tunnel}已断开，重新建立隧道")
+                self._close_entry(self._tunnels.pop(key))
+                self.restarted_count += 1
+                refcount = entry["refcount"]
+                entry = None
+            else:
+                refcount = 0
+            if entry:
+                self.reused_count += 1
+            else:
+                ssh = SSHConnection(
+                    host,
+                    port,
+                    tunnel.host,
+                    tunnel.port,
+                    tunnel.user,
+                    tunnel.password,
+                    tunnel.pkey,
+                    tunnel.pkey_password,
+                )
+                entry = {
+                    "ssh": ssh,
+                    "refcount": refcount,
+                    "create_time": time.time(),
+                    "last_release": time.time(),
+                }
+                self._tunnels[key] = entry
+                self.created_count += 1
+            entry["refcount"] += 1
+            return SSHTunnelLease(self, key, entry["ssh"].get_ssh())
+
+    def release(self, key):
+        with self._lock:
+            entry = self._tunnels.get(key)
+            if entry:
+                entry["refcount"] = max(entry["refcount"] - 1, 0)
+                entry["last_release"] = time.time()
+            self._evict()
+
+    @staticmethod
+    def _close_entry(entry):
+        try:
+            entry["ssh"].close()
+        except Exception as e:
+            logger.debug(f"关闭ssh隧道失败：{e}")
+
+    def _evict(self):
+        """关闭空闲超过ttl的隧道，调用方需持有锁"""
+        now = time.time()
+        for key, entry in list(self._tunnels.items()):
+            if entry["refcount"] == 0 and now - entry["last_release"] >= self.ttl:
+                self._close_entry(self._tunnels.pop(key))
+
+    def close(self):
+        """关闭所有隧道"""
+        with self._lock:
+            tunnels, self._tunnels = self._tunnels, {}
+        for entry in tunnels.values():
+            self._close_entry(entry)
+
+    def stats(self):
+        with self._lock:
+            tunnels = [
+                {
+                    "tunnel_id": key[0],
+                    "remote": f"{key[2]}:{key[3]}",
+                    "local": "{}:{}".format(*entry["ssh"].get_ssh()),
+                    "refcount": entry["refcount"],
+                    "active": entry["ssh"].is_active,
+                    "uptime": round(time.time() - entry["create_time"], 3),
+                }
+                for key, entry in self._tunnels.items()
+            ]
+        return {
+            "tunnels": tunnels,
+            "created": self.created_count,
+            "reused": self.reused_count,
+            "restarted": self.restarted_count,
+        }
+
+
+ssh_tunnel_manager = SSHTunnelManager()
+atexit.register(ssh_tunnel_manager.close)
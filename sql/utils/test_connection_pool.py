@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+from unittest.mock import Mock, patch
+
+from django.test import TestCase, override_settings
+
+from sql.utils.connection_pool import (
+    ConnectionPool,
+    ConnectionPoolManager,
+    PoolExhaustedError,
+    pool_manager,
+)
+from sql.models import Instance
+
+
+class TestConnectionPool(TestCase):
+    def test_reuse_released_connection(self):
+        pool = ConnectionPool(max_size=2)
+        creator = Mock(side_effect=lambda: Mock())
+        conn = pool.acquire(creator)
+        pool.release(conn)
+        self.assertIs(pool.acquire(creator), conn)
+        creator.assert_called_once()
+        self.assertEqual(pool.stats()["reused"], 1)
+
+    def test_max_size(self):
+        pool = ConnectionPool(max_size=1, wait_timeout=0)
+        creator = Mock(side_effect=lambda: Mock())
+        pool.acquire(creator)
+        with self.assertRaises(PoolExhaustedError):
+            pool.acquire(creator)
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_size=3, max_idle=1)
+        creator = Mock(side_effect=lambda: Mock())
+        conn1, conn2 = pool.acquire(creator), pool.acquire(creator)
+        pool.release(conn1)
+        pool.release(conn2)
+        self.assertEqual(pool.idle_count, 1)
+        conn2.close.assert_called_once()
+
+    def test_discard(self):
+        pool = ConnectionPool()
+        conn = pool.acquire(Mock)
+        pool.release(conn, discard=True)
+        conn.close.assert_called_once()
+        self.assertEqual(pool.idle_count, 0)
+        self.assertEqual(pool.in_use_count, 0)
+
+    @patch("sql.utils.connection_pool.time.time")
+    def test_idle_timeout(self, mock_time):
+        mock_time.return_value = 1000
+        pool = ConnectionPool(idle_timeout=10)
+        conn = pool.acquire(Mock)
+        pool.release(conn)
+        mock_time.return_value = 1011
+        self.assertIsNot(pool.acquire(Mock), conn)
+        conn.close.assert_called_once()
+
+    @patch("sql.utils.connection_pool.time.time")
+    def test_max_lifetime(self, mock_time):
+        mock_time.return_value = 1000
+        pool = ConnectionPool(max_lifetime=10)
+        conn = pool.acquire(Mock)
+        mock_time.return_value = 1011
+        pool.release(conn)
+        conn.close.assert_called_once()
+        self.assertEqual(pool.idle_count, 0)
+
+    @patch("sql.utils.connection_pool.time.time")
+    def test_health_check(self, mock_time):
+        mock_time.return_value = 1000
+        pool = ConnectionPool(ping_interval=5)
+        conn = pool.acquire(Mock)
+        pool.release(conn)
+        mock_time.return_value = 1006
+        validator = Mock(side_effect=Exception("gone away"))
+        new_conn = pool.acquire(Mock, validator)
+        validator.assert_called_once_with(conn)
+        conn.close.assert_called_once()
+        self.assertIsNot(new_conn, conn)
+
+    def test_close(self):
+        pool = ConnectionPool()
+        conn1, conn2 = pool.acquire(Mock), pool.acquire(Mock)
+        pool.release(conn1)
+        pool.close()
+        conn1.close.assert_called_once()
+        pool.release(conn2)
+        conn2.close.assert_called_once()
+
+
+class TestConnectionPoolManager(TestCase):
+    @override_settings(ENGINE_CONNECTION_POOL={"enabled": True, "max_size": 3})
+    def test_get_pool(self):
+        manager = ConnectionPoolManager()
+        self.assertTrue(manager.enabled)
+        pool = manager.get_pool((1, "mysql", "db"))
+        self.assertIs(pool, manager.get_pool((1, "mysql", "db")))
+        self.assertEqual(pool.max_size, 3)
+        self.assertIsNot(pool, manager.get_pool((2, "mysql", "db")))
+        manager.close_instance(1)
+        self.assertNotIn("1:mysql:db", manager.stats())
+        self.assertIn("2:mysql:db", manager.stats())
+
+    @override_settings(ENGINE_CONNECTION_POOL={"enabled": True})
+    def test_close_instance_on_change(self):
+        """实例修改后关闭该实例的连接池"""
+        instance = Instance.objects.create(
+            instance_name="pool_ins",
+            type="slave",
+            db_type="mysql",
+            host="some_host",
+            port=3306,
+            user="ins_user",
+            password="some_str",
+        )
+        key = (instance.pk, "mysql", "db")
+        pool = pool_manager.get_pool(key)
+        instance.password = "new_str"
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save()
+        self.assertIsNot(pool_manager.get_pool(key), pool)
+        pool_manager.close_instance(instance.pk)
+
+    @override_settings(ENGINE_CONNECTION_POOL={"enabled": False})
+    def test_disabled(self):
+        self.assertFalse(ConnectionPoolManager().enabled)
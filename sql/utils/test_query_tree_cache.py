@@ -0,0 +1,58 @@
+# -*- coding: UTF-8 -*-
+from unittest.mock import Mock
+
+from django.test import TestCase
+
+from sql.utils.query_tree_cache import QueryTreeCache, sql_fingerprint
+
+
+class TestSqlFingerprint(TestCase):
+    def test_literals(self):
+        self.assertEqual(
+            sql_fingerprint("select  a,\n b from t where id=1 and n='x';"),
+            "select a,b from t where id=? and n=?",
+        )
+        # 运算符和标点两侧的空白
+        self.assertEqual(
+            sql_fingerprint("select a , b from t where id = 2"),
+            sql_fingerprint("select a,b from t where id=1;"),
+        )
+
+    def test_keep_identifiers_and_comments(self):
+        self.assertNotEqual(
+            sql_fingerprint('select "a" from t'), sql_fingerprint('select "b" from t')
+        )
+        self.assertNotEqual(
+            sql_fingerprint("select a /*!, b */ from t"),
+            sql_fingerprint("select a from t"),
+        )
+        self.assertNotEqual(
+            sql_fingerprint("select a from T"), sql_fingerprint("select a from t")
+        )
+
+
+class TestQueryTreeCache(TestCase):
+    def setUp(self):
+        self.instance = Mock(id=-1)
+        self.cache = QueryTreeCache("test", local_size=1)
+        self.cache.invalidate_instance(self.instance.id)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get(self.instance, "db", "select 1"))
+        self.cache.set(self.instance, "db", "select 1", [{"index": 0}])
+        self.assertEqual(
+            self.cache.get(self.instance, "db", "select 2"), [{"index": 0}]
+        )
+        self.assertIsNone(self.cache.get(self.instance, "db2", "select 1"))
+        # 进程内缓存淘汰后从redis读取
+        self.cache.set(self.instance, "db", "select a", [])
+        self.assertEqual(len(self.cache._local), 1)
+        self.assertEqual(
+            self.cache.get(self.instance, "db", "select 1"), [{"index": 0}]
+        )
+
+    def test_invalidate_instance(self):
+        self.cache.set(self.instance, "db", "select 1", [{"index": 0}])
+        self.cache.invalidate_instance(self.instance.id)
+        self.assertIsNone(self.cache.get(self.instance, "db", "select 1"))
+        self.assertEqual(len(self.cache._local), 0)
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from sql.engines.models import ResultSet
+from sql.models import Instance
+from sql.utils.schema_cache import (
+    get_resource,
+    invalidate_schema_cache,
+    peek_resource,
+    refresh_resource,
+)
+
+
+class TestSchemaCache(TestCase):
+    def setUp(self):
+        self.ins = Instance.objects.create(
+            instance_name="some_ins",
+            type="slave",
+            db_type="mysql",
+            host="some_host",
+            port=3306,
+            user="ins_user",
+            password="some_str",
+        )
+        invalidate_schema_cache(self.ins.id)
+
+    def tearDown(self):
+        Instance.objects.all().delete()
+
+    @patch("sql.utils.schema_cache.get_engine")
+    def test_get_resource(self, _get_engine):
+        _get_engine.return_value.escape_string.side_effect = lambda s: s
+        _get_engine.return_value.get_all_tables.return_value = ResultSet(
+            rows=["t1", "t2"]
+        )
+        for _ in range(2):
+            r = get_resource(self.ins, "table", db_name="db1")
+            self.assertEqual(r.rows, ["t1", "t2"])
+        _get_engine.return_value.get_all_tables.assert_called_once_with(
+            db_name="db1", schema_name=""
+        )
+        get_resource(self.ins, "table", db_name="db1", refresh=True)
+        self.assertEqual(_get_engine.return_value.get_all_tables.call_count, 2)
+
+    @patch("sql.utils.schema_cache.get_engine")
+    def test_error_not_cached(self, _get_engine):
+        _get_engine.return_value.escape_string.side_effect = lambda s: s
+        result = ResultSet()
+        result.error = "some error"
+        _get_engine.return_value.get_all_databases.return_value = result
+        for _ in range(2):
+            r = get_resource(self.ins, "database")
+            self.assertEqual(r.error, "some error")
+        self.assertEqual(_get_engine.return_value.get_all_databases.call_count, 2)
+
+    @patch("sql.utils.schema_cache.get_engine")
+    def test_invalidate_db(self, _get_engine):
+        _get_engine.return_value.escape_string.side_effect = lambda s: s
+        _get_engine.return_value.get_all_databases.return_value = ResultSet(
+            rows=["db1", "db2"]
+        )
+        _get_engine.return_value.get_all_tables.return_value = ResultSet(rows=["t1"])
+        get_resource(self.ins, "database")
+        get_resource(self.ins, "table", db_name="db1")
+        get_resource(self.ins, "table", db_name="db2")
+        invalidate_schema_cache(self.ins.id, db_names=["db1"])
+        get_resource(self.ins, "database")
+        get_resource(self.ins, "table", db_name="db1")
+        get_resource(self.ins, "table", db_name="db2")
+        # 库列表和db1重新获取，db2仍然使用缓存
+        self.assertEqual(_get_engine.return_value.get_all_databases.call_count, 2)
+        self.assertEqual(_get_engine.return_value.get_all_tables.call_count, 3)
+
+    @patch("sql.utils.schema_cache.SCHEMA_CACHE_REFRESH", -1)
+    @patch("sql.utils.schema_cache.async_task")
+    @patch("sql.utils.schema_cache.get_engine")
+    def test_background_refresh(self, _get_engine, _async_task):
+        _get_engine.return_value.escape_string.side_effect = lambda s: s
+        _get_engine.return_value.get_all_columns_by_tb.return_value = ResultSet(
+            rows=["id"]
+        )
+        get_resource(self.ins, "column", db_name="db1", tb_name="t1")
+        r = get_resource(self.ins, "column", db_name="db1", tb_name="t1")
+        self.assertEqual(r.rows, ["id"])
+        _async_task.assert_called_once()
+        # 任务执行后刷新缓存
+        refresh_resource(*_async_task.call_args.args[1:])
+        self.assertEqual(_get_engine.return_value.get_all_columns_by_tb.call_count, 2)
+
+    @patch("sql.utils.schema_cache.async_task")
+    @patch("sql.utils.schema_cache.get_engine")
+    def test_peek_resource(self, _get_engine, _async_task):
+        _get_engine.return_value.escape_string.side_effect = lambda s: s
+        _get_engine.return_value.get_all_columns_by_tb.return_value = ResultSet(
+            rows=["_id", "name"]
+        )
+        # 缓存不存在时不访问实例，提交后台任务
+        self.assertIsNone(
+            peek_resource(self.ins, "column", db_name="db1", tb_name="c1")
+        )
+        self.assertIsNone(
+            peek_resource(self.ins, "column", db_name="db1", tb_name="c1")
+        )
+        _get_engine.assert_not_called()
+        _async_task.assert_called_once()
+        refresh_resource(*_async_task.call_args.args[1:])
+        r = peek_resource(self.ins, "column", db_name="db1", tb_name="c1")
+        self.assertEqual(r.rows, ["_id", "name"])
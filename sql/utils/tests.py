@@ -16,7 +16,7 @@ from django.test import TestCase, Client
 from django_q.models import Schedule
 
 from common.config import SysConfig
-from sql.engines.models import ReviewResult, ReviewSet
+from sql.engines.models import ReviewResult, ReviewSet, ColumnarRows
 from sql.models import (
     Users,
     SqlWorkflow,
@@ -38,7 +38,15 @@ from sql.utils.sql_review import (
 from sql.utils.sql_utils import *
 from sql.utils.execute_sql import execute, execute_callback
 from sql.utils.tasks import add_sql_schedule, del_schedule, task_info
-from sql.utils.data_masking import data_masking, brute_mask, simple_column_mask
+from sql.utils.data_masking import (
+    data_masking,
+    brute_mask,
+    simple_column_mask,
+    build_masking_plan,
+    apply_masking_plan,
+)
+from sql.utils.query_tree_cache import select_list_cache
+from sql.utils.ssh_tunnel import SSHTunnelManager
 
 User = Users
 __author__ = "hhyo"
@@ -541,6 +549,7 @@ class TestDataMasking(TestCase):
             user="ins_user",
             password="some_str",
         )
+        select_list_cache.invalidate_instance(self.ins.id)
         self.sys_config = SysConfig()
         self.wf1 = SqlWorkflow.objects.create(
             workflow_name="workflow_name",
@@ -1073,6 +1082,75 @@ class TestDataMasking(TestCase):
             print("test_data_masking_union_support_keyword", r.rows)
             self.assertEqual(r.rows, mask_result_rows)
 
+    @patch("sql.utils.data_masking.GoInceptionEngine")
+    def test_data_masking_select_list_cache(self, _inception):
+        """相同指纹的查询不再请求goInception，表结构版本变更后重新解析"""
+        _inception.return_value.query_data_masking.return_value = [
+            {
+                "index": 0,
+                "field": "phone",
+                "type": "varchar(80)",
+                "table": "users",
+                "schema": "archer_test",
+                "alias": "phone",
+            }
+        ]
+        for sql in [
+            "select phone from users where id=1;",
+            "select phone  from users where id = 2",
+        ]:
+            query_result = ReviewSet(
+                column_list=["phone"], rows=(("18888888888",),), full_sql=sql
+            )
+            r = data_masking(self.ins, "archery", sql, query_result)
+            self.assertEqual(r.rows, [["188****8888"]])
+        _inception.return_value.query_data_masking.assert_called_once()
+        select_list_cache.invalidate_instance(self.ins.id)
+        data_masking(self.ins, "archery", sql, query_result)
+        self.assertEqual(_inception.return_value.query_data_masking.call_count, 2)
+
+    def test_masking_plan(self):
+        """脱敏计划，规则100切片实现与行数较多时按列脱敏"""
+        masking_rules = {
+            1: {
+                "rule_type": 1,
+                "rule_regex": "^([\\s\\S]{3})([\\s\\S]*)([\\s\\S]{4})$",
+                "hide_group": 2,
+            },
+            100: {
+                "rule_type": 100,
+                "rule_regex": "^([\\s\\S]{0,}?)([\\s\\S]{0,}?)([\\s\\S]{0,}?)$",
+                "hide_group": 2,
+            },
+        }
+        plan = build_masking_plan(
+            [
+                {"index": 0, "rule_type": 1},
+                {"index": 2, "rule_type": 100},
+                {"index": 1, "rule_type": 999},
+            ],
+            masking_rules,
+        )
+        self.assertEqual([index for index, _ in plan], [0, 2])
+        rows = [("18888888888", 1, "123456789a"), ("", None, 12345)]
+        self.assertEqual(
+            apply_masking_plan(rows, plan),
+            [["188****8888", 1, "123****89a"], ["", None, "12345"]],
+        )
+        with patch("sql.utils.data_masking.MASKING_COLUMNAR_THRESHOLD", 1):
+            self.assertEqual(
+                apply_masking_plan(rows, plan),
+                [["188****8888", 1, "123****89a"], ["", None, "12345"]],
+            )
+        # 列式结果集按列脱敏，返回新的列式结果集
+        columnar_rows = ColumnarRows([list(column) for column in zip(*rows)])
+        masked_rows = apply_masking_plan(columnar_rows, plan)
+        self.assertIsInstance(masked_rows, ColumnarRows)
+        self.assertEqual(
+            masked_rows.tolist(),
+            [["188****8888", 1, "123****89a"], ["", None, "12345"]],
+        )
+
     def test_brute_mask(self):
         sql = """select * from users;"""
         rows = (("18888888888",), ("18888888889",), ("18888888810",))
@@ -1175,3 +1253,45 @@ class TestResourceGroup(TestCase):
             auth_group_names=[self.agp.name], group_id=self.rgp1.group_id
         )
         self.assertIn(self.user, users)
+
+
+class TestSSHTunnelManager(TestCase):
+    def setUp(self):
+        self.tunnel = MagicMock(pk=1, update_time=None, host="tunnel_host", port=22)
+
+    @patch("sql.utils.ssh_tunnel.SSHConnection")
+    def test_acquire_reuse(self, mock_ssh):
+        mock_ssh.return_value.get_ssh.return_value = ("127.0.0.1", 10001)
+        manager = SSHTunnelManager(ttl=300)
+        lease1 = manager.acquire(self.tunnel, "some_host", 3306)
+        lease2 = manager.acquire(self.tunnel, "some_host", 3306)
+        mock_ssh.assert_called_once()
+        self.assertEqual(lease1.get_ssh(), ("127.0.0.1", 10001))
+        self.assertEqual(manager.stats()["tunnels"][0]["refcount"], 2)
+        lease1.release()
+        lease2.release()
+        # 引用计数为0后在ttl内保留
+        self.assertEqual(manager.stats()["tunnels"][0]["refcount"], 0)
+        mock_ssh.return_value.close.assert_not_called()
+
+    @patch("sql.utils.ssh_tunnel.SSHConnection")
+    def test_release_after_ttl(self, mock_ssh):
+        manager = SSHTunnelManager(ttl=0)
+        manager.acquire(self.tunnel, "some_host", 3306).release()
+        mock_ssh.return_value.close.assert_called_once()
+        self.assertEqual(manager.stats()["tunnels"], [])
+
+    @patch("sql.utils.ssh_tunnel.SSHConnection")
+    def test_restart_inactive(self, mock_ssh):
+        dead, alive = MagicMock(is_active=False), MagicMock(is_active=True)
+        alive.get_ssh.return_value = ("127.0.0.1", 10002)
+        mock_ssh.side_effect = [dead, alive]
+        manager = SSHTunnelManager(ttl=300)
+        lease1 = manager.acquire(self.tunnel, "some_host", 3306)
+        lease2 = manager.acquire(self.tunnel, "some_host", 3306)
+        self.assertEqual(lease2.get_ssh(), ("127.0.0.1", 10002))
+        dead.close.assert_called_once()
+        self.assertEqual(manager.stats()["restarted"], 1)
+        self.assertEqual(manager.stats()["tunnels"][0]["refcount"], 2)
+        lease1.release()
+        self.assertEqual(manager.stats()["tunnels"][0]["refcount"], 1)
@@ -13,7 +13,7 @@ from .serializers import (
 from .pagination import CustomizedPagination
 from .filters import InstanceFilter
 from sql.models import Instance, Tunnel, AliyunRdsConfig
-from sql.engines import get_engine
+from sql.utils.schema_cache import get_resource
 from django.http import Http404
 import MySQLdb
 
@@ -188,36 +188,32 @@ class InstanceResource(views.APIView):
         instance = Instance.objects.get(pk=instance_id)
 
         try:
-            query_engine = get_engine(instance=instance)
-            db_name = query_engine.escape_string(db_name)
-            schema_name = query_engine.escape_string(schema_name)
-            tb_name = query_engine.escape_string(tb_name)
+            if not (
+                resource_type == "database"
+                or (resource_type in ("schema", "table") and db_name)
+                or (resource_type == "column" and db_name and tb_name)
+            ):
+                raise serializers.ValidationError(
+                    {"errors": "不支持的资源类型或者参数不完整！"}
+                )
+            resource = get_resource(
+                instance,
+                resource_type,
+                db_name=db_name,
+                schema_name=schema_name,
+                tb_name=tb_name,
+            )
             if resource_type == "database":
-                resource = query_engine.get_all_databases()
                 resource.rows = filter_db_list(
                     db_list=resource.rows,
-                    db_name_regex=query_engine.instance.show_db_name_regex,
+                    db_name_regex=instance.show_db_name_regex,
                     is_match_regex=True,
                 )
                 resource.rows = filter_db_list(
                     db_list=resource.rows,
-                    db_name_regex=query_engine.instance.denied_db_name_regex,
+                    db_name_regex=instance.denied_db_name_regex,
                     is_match_regex=False,
                 )
-            elif resource_type == "schema" and db_name:
-                resource = query_engine.get_all_schemas(db_name=db_name)
-            elif resource_type == "table" and db_name:
-                resource = query_engine.get_all_tables(
-                    db_name=db_name, schema_name=schema_name
-                )
-            elif resource_type == "column" and db_name and tb_name:
-                resource = query_engine.get_all_columns_by_tb(
-                    db_name=db_name, tb_name=tb_name, schema_name=schema_name
-                )
-            else:
-                raise serializers.ValidationError(
-                    {"errors": "不支持的资源类型或者参数不完整！"}
-                )
         except Exception as msg:
             raise serializers.ValidationError({"errors": msg})
         else: